@@ -0,0 +1,260 @@
+import mujoco
+import numpy as np
+from scipy.linalg import cho_factor,cho_solve
+from mujoco_parser import JointGroupClass,IKTaskStackClass
+from util import nullspace_ls
+
+class TrajectoryIKClass(object):
+    """
+        Damped least-squares IK over a whole trajectory
+        - multiple body/geom tasks (position and/or rotation) per frame
+        - each frame is warm-started from the previous frame's solution
+          (the previous IK correction is added to the current frame so that joints
+           not involved in any task keep following the input motion)
+        - Jacobian and normal-equation buffers are preallocated and solved with Cholesky
+        ik = TrajectoryIKClass(env,ik_tasks=[{'name':'rfoot','type':'geom','IK_P':True,'IK_R':True}],
+                               joint_names=rev_joint_names)
+        res = ik.solve(qpos_traj,p_trgt_traj,R_trgt_traj)
+    """
+    def __init__(self,env,ik_tasks,joint_names,
+                 eps=1e-3,stepsize=1.0,th=np.radians(10.0),max_iter=500,err_th=1e-3):
+        """
+            Initialize IK engine
+            ik_tasks: list of {'name':str,'type':'body' or 'geom','IK_P':bool,'IK_R':bool}
+            joint_names: list of joint names or a 'JointGroupClass' of hinge/slide joints
+        """
+        self.env         = env
+        self.model       = env.model
+        self.data        = env.data
+        self.ik_tasks    = ik_tasks
+        if not isinstance(joint_names,JointGroupClass):
+            joint_names = env.get_joint_group(joint_names)
+        if joint_names.nq != joint_names.nv:
+            raise ValueError("[TrajectoryIKClass] only hinge and slide joints are supported")
+        self.joint_group = joint_names
+        self.joint_names = joint_names.joint_names
+        self.eps         = eps
+        self.stepsize    = stepsize
+        self.th          = th
+        self.max_iter    = max_iter
+        self.err_th      = err_th
+        # Indices
+        self.idxs_fwd    = self.joint_group.qpos_idxs
+        self.idxs_jac    = self.joint_group.qvel_idxs
+        self.n_task      = len(self.ik_tasks)
+        self.n_joint     = len(self.joint_names)
+        # Preallocated buffers
+        self.ik_stack    = IKTaskStackClass(env,ik_tasks=self.ik_tasks)
+        self.task_rows   = self.ik_stack.task_rows # start row of each task in the stacked Jacobian
+        self.n_row       = self.ik_stack.n_row
+        self.J_full      = self.ik_stack.J # [m x nv]
+        self.J           = np.zeros((self.n_row,self.n_joint)) # [m x n]
+        self.err         = self.ik_stack.err # [m]
+        self.A           = np.zeros((self.n_joint,self.n_joint)) # [n x n]
+        self.b           = np.zeros(self.n_joint) # [n]
+        self.q           = np.zeros(self.n_joint) # [n]
+
+    def _fk(self):
+        """
+            Kinematics only (no dynamics) which is all the Jacobians need
+        """
+        mujoco.mj_kinematics(self.model,self.data)
+        mujoco.mj_comPos(self.model,self.data)
+
+    def _fill(self,p_trgts,R_trgts):
+        """
+            Fill the stacked Jacobian and error buffers in place
+        """
+        self.ik_stack(p_trgts,R_trgts)
+        np.take(self.J_full,self.idxs_jac,axis=1,out=self.J)
+
+    def _damped_ls(self):
+        """
+            dq = (J^T J + eps I)^{-1} J^T err via Cholesky (reuses buffers)
+        """
+        np.matmul(self.J.T,self.J,out=self.A)
+        self.A.flat[::self.n_joint+1] += self.eps
+        np.matmul(self.J.T,self.err,out=self.b)
+        c_and_lower = cho_factor(self.A,overwrite_a=True,check_finite=False)
+        dq = cho_solve(c_and_lower,self.b,overwrite_b=True,check_finite=False)
+        dq *= self.stepsize
+        dq_abs_max = np.abs(dq).max()
+        if dq_abs_max > self.th: # trim scale
+            dq *= self.th/dq_abs_max
+        return dq
+
+    def solve_frame(self,p_trgts,R_trgts,q_init=None):
+        """
+            Solve IK of the current frame (root pose and other joints must be set in 'env.data.qpos')
+        """
+        if q_init is not None:
+            self.q[:] = q_init
+        else:
+            self.q[:] = self.data.qpos[self.idxs_fwd]
+        err_norm = np.inf
+        for ik_tick in range(self.max_iter):
+            self.data.qpos[self.idxs_fwd] = self.q
+            self._fk()
+            self._fill(p_trgts,R_trgts)
+            err_norm = np.linalg.norm(self.err)
+            if err_norm < self.err_th: break
+            self.q += self._damped_ls()
+        else:
+            # Update kinematics and error with the last update
+            self.data.qpos[self.idxs_fwd] = self.q
+            self._fk()
+            self._fill(p_trgts,R_trgts)
+            err_norm = np.linalg.norm(self.err)
+        return self.q.copy(),ik_tick+1,err_norm
+
+    def solve(self,qpos_traj,p_trgt_traj=None,R_trgt_traj=None,WARM_START=True,
+              frame_callback=None,VERBOSE=False):
+        """
+            Solve IK for every frame
+            qpos_traj:   [L x nq] full qpos per frame (root pose and initial joint positions)
+            p_trgt_traj: [L x n_task x 3] or [n_task x 3] (constant) position targets
+            R_trgt_traj: [L x n_task x 3 x 3] or [n_task x 3 x 3] (constant) rotation targets
+            frame_callback: (optional) called as frame_callback(tick) after each frame is solved
+        """
+        L = qpos_traj.shape[0]
+        if p_trgt_traj is None: p_trgt_traj = np.zeros((self.n_task,3))
+        if R_trgt_traj is None: R_trgt_traj = np.tile(np.eye(3),(self.n_task,1,1))
+        p_trgt_traj = np.asarray(p_trgt_traj)
+        R_trgt_traj = np.asarray(R_trgt_traj)
+        if p_trgt_traj.ndim == 2: p_trgt_traj = np.broadcast_to(p_trgt_traj,(L,)+p_trgt_traj.shape)
+        if R_trgt_traj.ndim == 3: R_trgt_traj = np.broadcast_to(R_trgt_traj,(L,)+R_trgt_traj.shape)
+        q_traj    = np.zeros((L,self.n_joint))
+        n_iters   = np.zeros(L,dtype=np.int32)
+        err_norms = np.zeros(L)
+        for tick in range(L):
+            self.data.qpos[:] = qpos_traj[tick]
+            if WARM_START and (tick > 0):
+                q_init = qpos_traj[tick,self.idxs_fwd] + (q_traj[tick-1]-qpos_traj[tick-1,self.idxs_fwd])
+            else:
+                q_init = None
+            q_traj[tick],n_iters[tick],err_norms[tick] = self.solve_frame(
+                p_trgts=p_trgt_traj[tick],R_trgts=R_trgt_traj[tick],q_init=q_init)
+            if VERBOSE and (err_norms[tick] > self.err_th):
+                print ("[TrajectoryIKClass] tick:[%d] n_iter:[%d] err_norm:[%.3f] is above threshold:[%.3f]"%
+                       (tick,n_iters[tick],err_norms[tick],self.err_th))
+            if frame_callback is not None:
+                frame_callback(tick)
+        res = {'q_traj':q_traj,'n_iters':n_iters,'err_norms':err_norms}
+        return res
+
+class HierarchicalTrajectoryIKClass(TrajectoryIKClass):
+    """
+        Multi-priority IK over a whole trajectory with nullspace projection (see 'nullspace_ls')
+        - each task may have 'priority' (0 is the highest, default 0), 'weight' (default 1),
+          and 'err_th' (default 'err_th')
+        - (optional) posture task pulling the joints toward the input motion at the lowest priority
+        - joints are kept within their limits ('jnt_range' of limited joints)
+        - a frame stops as soon as every task with priority <= 'stop_priority' is within its 'err_th'
+        ik = HierarchicalTrajectoryIKClass(
+            env,ik_tasks=[{'name':'rfoot','type':'geom','priority':0},
+                          {'name':'rhand','type':'body','IK_R':False,'priority':1,'weight':0.5}],
+            joint_names=rev_joint_names,posture_weight=1e-2)
+        res = ik.solve(qpos_traj,p_trgt_traj,R_trgt_traj) # res['task_err_norms']: [L x n_task]
+    """
+    def __init__(self,env,ik_tasks,joint_names,
+                 eps=1e-3,stepsize=1.0,th=np.radians(10.0),max_iter=100,err_th=1e-3,
+                 posture_weight=0.0,stop_priority=0,JOINT_LIMIT=True):
+        """
+            Initialize hierarchical IK engine
+        """
+        super().__init__(env,ik_tasks,joint_names,eps=eps,stepsize=stepsize,th=th,
+                         max_iter=max_iter,err_th=err_th)
+        self.posture_weight = posture_weight
+        self.priorities     = np.array([ik_task.get('priority',0) for ik_task in self.ik_tasks])
+        self.task_err_ths   = np.array([ik_task.get('err_th',err_th) for ik_task in self.ik_tasks])
+        self.task_slices    = [slice(row,row+task.n_row)
+                               for row,task in zip(self.task_rows,self.ik_stack.tasks)]
+        self.stop_mask      = self.priorities <= stop_priority
+        # Rows and row weights of each priority level
+        self.level_rows,self.level_weights = [],[]
+        for priority in sorted(set(self.priorities.tolist())):
+            t_idxs = np.where(self.priorities == priority)[0]
+            self.level_rows.append(np.concatenate(
+                [np.arange(self.task_rows[t_idx],self.task_rows[t_idx]+self.ik_stack.tasks[t_idx].n_row)
+                 for t_idx in t_idxs]).astype(np.int64))
+            self.level_weights.append(np.concatenate(
+                [np.full(self.ik_stack.tasks[t_idx].n_row,self.ik_tasks[t_idx].get('weight',1.0))
+                 for t_idx in t_idxs]))
+        # Joint limits
+        joint_ids = self.joint_group.joint_ids
+        limited   = self.model.jnt_limited[joint_ids].astype(bool) if JOINT_LIMIT \
+            else np.zeros(len(joint_ids),dtype=bool)
+        self.q_min = np.where(limited,self.model.jnt_range[joint_ids,0],-np.inf)
+        self.q_max = np.where(limited,self.model.jnt_range[joint_ids,1],np.inf)
+        # Buffers
+        self.q_ref          = np.zeros(self.n_joint) # posture reference
+        self.I_posture      = np.eye(self.n_joint)
+        self.task_err_norms = np.zeros(self.n_task)
+
+    def _update_task_err_norms(self):
+        """
+            Per-task error norms of the current error buffer
+        """
+        for t_idx,task_slice in enumerate(self.task_slices):
+            self.task_err_norms[t_idx] = np.linalg.norm(self.err[task_slice])
+        return self.task_err_norms
+
+    def _nullspace_ls(self):
+        """
+            One hierarchical step with joint-limit clamping
+        """
+        Js      = [self.J[rows] for rows in self.level_rows]
+        errs    = [self.err[rows] for rows in self.level_rows]
+        weights = list(self.level_weights)
+        if self.posture_weight > 0:
+            Js.append(self.I_posture)
+            errs.append(self.q_ref-self.q)
+            weights.append(self.posture_weight)
+        dq = self.stepsize*nullspace_ls(
+            Js,errs,weights=weights,eps=self.eps,th=self.th/self.stepsize,
+            dq_min=np.minimum(self.q_min-self.q,0.0)/self.stepsize,
+            dq_max=np.maximum(self.q_max-self.q,0.0)/self.stepsize)
+        return dq
+
+    def solve_frame(self,p_trgts,R_trgts,q_init=None):
+        """
+            Solve IK of the current frame (the joints in 'env.data.qpos' are the posture reference)
+        """
+        self.q_ref[:] = self.data.qpos[self.idxs_fwd]
+        self.q[:] = self.q_ref if q_init is None else q_init
+        for ik_tick in range(self.max_iter):
+            self.data.qpos[self.idxs_fwd] = self.q
+            self._fk()
+            self._fill(p_trgts,R_trgts)
+            self._update_task_err_norms()
+            if np.all(self.task_err_norms[self.stop_mask] < self.task_err_ths[self.stop_mask]): break
+            self.q += self._nullspace_ls()
+        else:
+            # Update kinematics and errors with the last update
+            self.data.qpos[self.idxs_fwd] = self.q
+            self._fk()
+            self._fill(p_trgts,R_trgts)
+            self._update_task_err_norms()
+        return self.q.copy(),ik_tick+1,np.linalg.norm(self.err)
+
+    def solve(self,qpos_traj,p_trgt_traj=None,R_trgt_traj=None,WARM_START=True,
+              frame_callback=None,VERBOSE=False):
+        """
+            Solve IK for every frame (see 'TrajectoryIKClass.solve')
+            Additionally returns 'task_err_norms' [L x n_task] and 'task_converged' [L x n_task]
+        """
+        L = qpos_traj.shape[0]
+        task_err_norms = np.zeros((L,self.n_task))
+        def callback(tick):
+            task_err_norms[tick] = self.task_err_norms
+            if frame_callback is not None:
+                frame_callback(tick)
+        res = super().solve(qpos_traj,p_trgt_traj=p_trgt_traj,R_trgt_traj=R_trgt_traj,
+                            WARM_START=WARM_START,frame_callback=callback,VERBOSE=False)
+        res['task_err_norms'] = task_err_norms
+        res['task_converged'] = task_err_norms < self.task_err_ths
+        if VERBOSE:
+            for tick in np.where(~np.all(res['task_converged'][:,self.stop_mask],axis=1))[0]:
+                print ("[HierarchicalTrajectoryIKClass] tick:[%d] n_iter:[%d] task_err_norms:%s"%
+                       (tick,res['n_iters'][tick],np.round(task_err_norms[tick],4)))
+        return res
@@ -0,0 +1,160 @@
+import os,hashlib,tempfile
+import xml.etree.ElementTree as ET
+import mujoco
+
+DEFAULT_CACHE_DIR   = os.path.join(os.path.expanduser('~'),'.cache','mujoco_motion','models')
+DEFAULT_MAX_SIZE_MB = 512
+
+def get_model_cache_dir(cache_dir=None):
+    """
+        Cache directory ('MUJOCO_MODEL_CACHE_DIR' environment variable overrides the default)
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('MUJOCO_MODEL_CACHE_DIR',DEFAULT_CACHE_DIR)
+    return cache_dir
+
+def is_model_cache_enabled():
+    """
+        The cache can be turned off with 'MUJOCO_MODEL_CACHE=0'
+    """
+    return os.environ.get('MUJOCO_MODEL_CACHE','1').lower() not in ('0','false','off')
+
+def get_xml_dependencies(xml_path):
+    """
+        Get all files a model depends on: the xml itself, included xmls, and mesh/texture/hfield/skin files
+        (asset paths are resolved with 'meshdir', 'texturedir', and 'assetdir' of the compiler)
+    """
+    xml_path  = os.path.abspath(xml_path)
+    model_dir = os.path.dirname(xml_path) # includes and assets are relative to the main model
+    xml_paths,asset_paths = [],[]
+    dirs = {'assetdir':'','meshdir':'','texturedir':''}
+    def parse(path):
+        if path in xml_paths: return
+        xml_paths.append(path)
+        root = ET.parse(path).getroot()
+        for compiler in root.iter('compiler'):
+            for key in dirs:
+                if key in compiler.attrib: dirs[key] = compiler.attrib[key]
+        for elem in root.iter():
+            if elem.tag == 'include':
+                inc_path = os.path.join(model_dir,elem.attrib['file'])
+                if not os.path.exists(inc_path): # fall back to the including file
+                    inc_path = os.path.join(os.path.dirname(path),elem.attrib['file'])
+                parse(os.path.abspath(inc_path))
+            elif elem.tag in ('mesh','skin','hfield','texture'):
+                for attr,file in elem.attrib.items():
+                    if not attr.startswith('file'): continue
+                    asset_paths.append((elem.tag,file))
+    parse(xml_path)
+    # Resolve asset paths after all compiler directories are known
+    dep_paths = list(xml_paths)
+    for tag,file in asset_paths:
+        if tag in ('mesh','skin'):
+            asset_dir = dirs['meshdir'] or dirs['assetdir']
+        elif tag == 'texture':
+            asset_dir = dirs['texturedir'] or dirs['assetdir']
+        else:
+            asset_dir = dirs['assetdir']
+        dep_path = os.path.abspath(os.path.join(model_dir,asset_dir,file))
+        if dep_path not in dep_paths:
+            dep_paths.append(dep_path)
+    return dep_paths
+
+def get_model_hash(xml_path):
+    """
+        Content hash of a model (xml, includes, assets, and the MuJoCo version)
+        Any change in these files or an upgrade of MuJoCo gives a new hash (invalidation rule)
+    """
+    xml_path  = os.path.abspath(xml_path)
+    model_dir = os.path.dirname(xml_path)
+    h = hashlib.sha1()
+    h.update(mujoco.__version__.encode())
+    for dep_path in get_xml_dependencies(xml_path):
+        h.update(os.path.relpath(dep_path,model_dir).encode())
+        if not os.path.exists(dep_path): continue # let the compiler report it
+        with open(dep_path,'rb') as f:
+            for chunk in iter(lambda: f.read(1<<20),b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+def evict_model_cache(cache_dir=None,max_size_mb=DEFAULT_MAX_SIZE_MB):
+    """
+        Remove least recently used '.mjb' files until the cache fits in 'max_size_mb'
+    """
+    cache_dir = get_model_cache_dir(cache_dir)
+    if not os.path.isdir(cache_dir): return
+    entries = []
+    for file in os.listdir(cache_dir):
+        if not file.endswith('.mjb'): continue
+        path = os.path.join(cache_dir,file)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime,stat.st_size,path))
+    total_size = sum([entry[1] for entry in entries])
+    for _,size,path in sorted(entries): # oldest first
+        if total_size <= max_size_mb*1024*1024: break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size = total_size - size
+
+def clear_model_cache(cache_dir=None):
+    """
+        Remove all cached models
+    """
+    evict_model_cache(cache_dir=cache_dir,max_size_mb=0)
+
+def load_model_cached(xml_path,cache_dir=None,max_size_mb=DEFAULT_MAX_SIZE_MB,VERBOSE=False):
+    """
+        Load 'MjModel' of an xml through the on-disk cache of compiled '.mjb' files
+        - hit: 'from_binary_path' (the file's mtime is touched for LRU eviction)
+        - miss: 'from_xml_path' and save the compiled model
+        Any cache failure falls back to compiling the xml
+    """
+    xml_path  = os.path.abspath(xml_path)
+    cache_dir = get_model_cache_dir(cache_dir)
+    try:
+        mjb_path = os.path.join(cache_dir,get_model_hash(xml_path)+'.mjb')
+    except Exception as e:
+        if VERBOSE: print ("[load_model_cached] hashing failed (%s), compiling [%s]"%(e,xml_path))
+        return mujoco.MjModel.from_xml_path(xml_path)
+    if os.path.exists(mjb_path):
+        try:
+            model = mujoco.MjModel.from_binary_path(mjb_path)
+            os.utime(mjb_path)
+            if VERBOSE: print ("[load_model_cached] hit [%s]"%(mjb_path))
+            return model
+        except Exception as e: # corrupted or incompatible entry
+            if VERBOSE: print ("[load_model_cached] removing invalid entry [%s] (%s)"%(mjb_path,e))
+            try:
+                os.remove(mjb_path)
+            except OSError:
+                pass
+    model = mujoco.MjModel.from_xml_path(xml_path)
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir,exist_ok=True)
+        # Write to a temporary file and rename so that concurrent workers never read a partial file
+        fd,tmp_path = tempfile.mkstemp(suffix='.tmp',dir=cache_dir)
+        os.close(fd)
+        mujoco.mj_saveModel(model,tmp_path,None)
+        os.replace(tmp_path,mjb_path)
+        if VERBOSE: print ("[load_model_cached] saved [%s]"%(mjb_path))
+        evict_model_cache(cache_dir=cache_dir,max_size_mb=max_size_mb)
+    except Exception as e:
+        if VERBOSE: print ("[load_model_cached] saving failed (%s)"%(e))
+        if (tmp_path is not None) and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return model
+
+def preload_model_cache(xml_paths,cache_dir=None,max_size_mb=DEFAULT_MAX_SIZE_MB,VERBOSE=True):
+    """
+        Compile and cache models in the parent process before spawning a process pool
+        so that every worker hits the cache
+    """
+    if isinstance(xml_paths,str): xml_paths = [xml_paths]
+    for xml_path in xml_paths:
+        load_model_cached(xml_path,cache_dir=cache_dir,max_size_mb=max_size_mb,VERBOSE=VERBOSE)
@@ -1,7 +1,16 @@
 import cv2,os,mujoco,mujoco_viewer
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 import numpy as np
+from model_cache import is_model_cache_enabled, load_model_cached
 from util import (compute_view_params, get_rotation_matrix_from_two_points,
-                  meters2xyz, pr2t, r2w, rpy2r, trim_scale, r2quat)
+                  pr2t, r2w, rpy2r, trim_scale, r2quat, RingBufferClass,
+                  LoopSchedulerClass, CameraProjectionClass,
+                  get_rotation_matrices_from_two_points, nullspace_ls)
+
+# Constant rotations of the x, y, and z axis cylinders of 'plot_T' (cylinders are along z)
+R_PLOT_AXES = np.array([rpy2r(np.deg2rad([0,0,90]))@rpy2r(np.pi/2*e) for e in np.eye(3)])
+RGBA_PLOT_AXES = np.array([[1.0,0.0,0.0,0.9],[0.0,1.0,0.0,0.9],[0.0,0.0,1.0,0.9]])
 
 class MuJoCoParserClass(object):
     """
@@ -17,11 +26,16 @@ class MuJoCoParserClass(object):
         # Constants
         self.tick         = 0
         self.render_tick  = 0
+        self.fk_datas     = [] # per-thread MjData of 'batch_fk'
+        self.state_history = None # ring buffer of states (see 'init_state_history')
+        self.sensor_history = None # ring buffer of sensor readings (see 'init_sensor_history')
+        self.marker_batch  = MarkerBatchClass() # batched markers written into the scene by 'render'
         # Parse an xml file
         if self.rel_xml_path is not None:
             self._parse_xml()
         # Viewer
         self.USE_MUJOCO_VIEWER = USE_MUJOCO_VIEWER
+        self.USE_OFFSCREEN     = False
         if self.USE_MUJOCO_VIEWER:
             self.init_viewer()
         # Initial joint position
@@ -38,7 +52,10 @@ class MuJoCoParserClass(object):
         """
         if self.rel_xml_path.split('.')[-1] == 'xml':
             self.full_xml_path    = os.path.abspath(os.path.join(os.getcwd(),self.rel_xml_path))
-            self.model            = mujoco.MjModel.from_xml_path(self.full_xml_path)
+            if is_model_cache_enabled(): # compiled '.mjb' cache keyed by the content hash
+                self.model        = load_model_cached(self.full_xml_path,VERBOSE=self.VERBOSE)
+            else:
+                self.model        = mujoco.MjModel.from_xml_path(self.full_xml_path)
             self.data             = mujoco.MjData(self.model)
         elif self.rel_xml_path.split('.')[-1] == 'mjb':
             self.full_mjb_path    = os.path.abspath(os.path.join(os.getcwd(),self.rel_xml_path))
@@ -100,7 +117,47 @@ class MuJoCoParserClass(object):
         self.n_site           = self.model.nsite
         self.site_names       = [mujoco.mj_id2name(self.model,mujoco.mjtObj.mjOBJ_SITE,x)
                                 for x in range(self.n_site)]
-
+        # Name-to-index tables (built once so that hot loops never touch strings)
+        def name2idx(names):
+            return MappingProxyType({name:idx for idx,name in enumerate(names) if name is not None})
+        self.body_name2id       = name2idx(self.body_names)
+        self.geom_name2id       = name2idx(self.geom_names)
+        self.joint_name2id      = name2idx(self.joint_names)
+        self.site_name2id       = name2idx(self.site_names)
+        self.sensor_name2id     = name2idx(self.sensor_names)
+        self.joint_name2qposadr = MappingProxyType(
+            {name:int(self.model.jnt_qposadr[idx]) for name,idx in self.joint_name2id.items()})
+        self.joint_name2dofadr  = MappingProxyType(
+            {name:int(self.model.jnt_dofadr[idx]) for name,idx in self.joint_name2id.items()})
+        self.joint_name2bodyid  = MappingProxyType(
+            {name:int(self.model.jnt_bodyid[idx]) for name,idx in self.joint_name2id.items()})
+        self.joint_nqposs       = np.diff(np.append(self.model.jnt_qposadr,self.model.nq)) # qpos size per joint
+        self.joint_ndofs        = np.diff(np.append(self.model.jnt_dofadr,self.model.nv)) # dof size per joint
+        self.body_jntadrs       = self.model.body_jntadr.copy()
+        # Sensor to site index (only for sensors attached to sites)
+        self.sensor_id2site_id  = np.array(
+            [self.model.sensor_objid[x] if self.model.sensor_objtype[x]==mujoco.mjtObj.mjOBJ_SITE else -1
+             for x in range(self.n_sensor)],dtype=np.int32)
+        self.sensor_name2site_id = MappingProxyType(
+            {name:int(self.sensor_id2site_id[idx]) for name,idx in self.sensor_name2id.items()
+             if self.sensor_id2site_id[idx] >= 0})
+        # Sensor data addresses and dimensions (and cached 'sensordata' indices per sensor list)
+        self.sensor_adrs        = self.model.sensor_adr.copy()
+        self.sensor_dims        = self.model.sensor_dim.copy()
+        self.sensor_idxs_cache  = {}
+        # Joint group handles (see 'get_joint_group')
+        self.joint_group_cache  = {}
+        # IK task workspaces (see 'get_ik_task')
+        self.ik_task_cache      = {}
+        # Depth-to-pointcloud projections (see 'get_camera_projection')
+        self.camera_projection_cache = {}
+        # Full physics state spec of 'save_state' and 'restore_state'
+        self.state_spec = (mujoco.mjtState.mjSTATE_TIME.value | mujoco.mjtState.mjSTATE_QPOS.value |
+                           mujoco.mjtState.mjSTATE_QVEL.value | mujoco.mjtState.mjSTATE_ACT.value |
+                           mujoco.mjtState.mjSTATE_WARMSTART.value)
+        self.state_size = mujoco.mj_stateSize(self.model,self.state_spec)
+        # Geom-name prefix masks of 'get_contacts' (built on first use)
+        self.geom_prefix_masks = {}
 
     def print_info(self):
         """
@@ -147,12 +204,43 @@ class MuJoCoParserClass(object):
             - FONTSCALE_VALUE:[50,100,150,200,250,300]
         """
         self.USE_MUJOCO_VIEWER = True
-        self.viewer = mujoco_viewer.MujocoViewer(
+        self.viewer = MuJoCoWindowViewerClass(
                 self.model,self.data,mode='window',title=viewer_title,
                 width=viewer_width,height=viewer_height,hide_menus=viewer_hide_menus)
         # Modify the fontsize
         self.viewer.ctx = mujoco.MjrContext(self.model,FONTSCALE_VALUE)
 
+    def init_offscreen_viewer(self,viewer_width=1200,viewer_height=800,backends=('egl','osmesa'),
+                              FONTSCALE_VALUE=mujoco.mjtFontScale.mjFONTSCALE_100.value):
+        """
+            Initialize headless offscreen viewer (no window required)
+            - backends: tried in order ('egl','osmesa'(software),'glfw')
+            Marker APIs (e.g., 'plot_T') and 'update_viewer' work as with the windowed viewer
+        """
+        self.USE_MUJOCO_VIEWER = True
+        self.USE_OFFSCREEN     = True
+        self.viewer = MuJoCoOffscreenViewerClass(
+            self.model,self.data,width=viewer_width,height=viewer_height,
+            backends=backends,FONTSCALE_VALUE=FONTSCALE_VALUE)
+        if self.VERBOSE:
+            print ("[%s] Offscreen viewer initialized with [%s]."%(self.name,self.viewer.backend))
+
+    def init_multi_camera(self,width=320,height=240,backends=('egl','osmesa')):
+        """
+            Initialize synchronized offscreen capture from several cameras (see 'MuJoCoMultiCameraClass')
+        """
+        self.multi_camera = MuJoCoMultiCameraClass(
+            self.model,self.data,width=width,height=height,backends=backends)
+        if self.VERBOSE:
+            print ("[%s] Multi-camera capture initialized with [%s]."%(self.name,self.multi_camera.backend))
+        return self.multi_camera
+
+    def capture_cameras(self,RGB=True,DEPTH=True,PCD=False,stride=1,dtype=np.float64):
+        """
+            Capture all cameras registered to 'self.multi_camera'
+        """
+        return self.multi_camera.capture(RGB=RGB,DEPTH=DEPTH,PCD=PCD,stride=stride,dtype=dtype)
+
     def update_viewer(self,azimuth=None,distance=None,elevation=None,lookat=None,
                       VIS_TRANSPARENT=None,VIS_CONTACTPOINT=None,
                       contactwidth=None,contactheight=None,contactrgba=None,
@@ -258,18 +346,69 @@ class MuJoCoParserClass(object):
         if ctrl is not None:
             if ctrl_idxs is None:
                 self.data.ctrl[:] = ctrl
+            elif isinstance(ctrl_idxs,JointGroupClass):
+                self.data.ctrl[ctrl_idxs.get_ctrl_idxs()] = ctrl
             else:
                 self.data.ctrl[ctrl_idxs] = ctrl
         mujoco.mj_step(self.model,self.data,nstep=nstep)
+        if self.state_history is not None:
+            mujoco.mj_getState(self.model,self.data,self.state_history.push(),self.state_spec)
+        if self.sensor_history is not None:
+            self.record_sensor_history()
         if INCREASE_TICK:
             self.tick = self.tick + 1
 
+    def init_state(self):
+        """
+            Initialize a flat buffer for 'save_state'
+        """
+        return np.zeros(self.state_size)
+
+    def save_state(self,state=None):
+        """
+            Save the full physics state (time, qpos, qvel, act, warmstart) into a flat buffer
+            state: buffer from 'init_state' which is filled in-place (no allocation)
+        """
+        if state is None:
+            state = self.init_state()
+        mujoco.mj_getState(self.model,self.data,state,self.state_spec)
+        return state
+
+    def restore_state(self,state,FORWARD=False):
+        """
+            Restore the physics state saved by 'save_state'
+            Derived quantities (xpos, contacts, ...) are stale until the next step
+            unless FORWARD is True
+        """
+        mujoco.mj_setState(self.model,self.data,state,self.state_spec)
+        if FORWARD:
+            mujoco.mj_forward(self.model,self.data)
+
+    def init_state_history(self,capacity=1000):
+        """
+            Keep the last 'capacity' states (the current state and one per 'step' call)
+            so that rollouts can be rewound with 'rewind_state'
+        """
+        self.state_history = RingBufferClass(capacity=capacity,shape=(self.state_size,))
+        mujoco.mj_getState(self.model,self.data,self.state_history.push(),self.state_spec)
+
+    def rewind_state(self,n_step=1,FORWARD=False):
+        """
+            Go back 'n_step' steps without re-simulating
+        """
+        if self.state_history is None:
+            raise RuntimeError("[%s] call 'init_state_history' first"%(self.name))
+        self.restore_state(self.state_history.rewind(n_step),FORWARD=FORWARD)
+        self.tick = max(self.tick-n_step,0)
+
     def forward(self,q=None,joint_idxs=None,INCREASE_TICK=True):
         """
             Forward kinematics
         """
         if q is not None:
-            if joint_idxs is not None:
+            if isinstance(joint_idxs,JointGroupClass):
+                self.data.qpos[joint_idxs.qpos_idxs] = q
+            elif joint_idxs is not None:
                 self.data.qpos[joint_idxs] = q
             else:
                 self.data.qpos = q
@@ -289,7 +428,10 @@ class MuJoCoParserClass(object):
         """
         if self.USE_MUJOCO_VIEWER:
             if ((self.render_tick % render_every) == 0) or (self.render_tick == 0):
+                if len(self.marker_batch) > 0:
+                    self.viewer._markers.append({'marker_batch':self.marker_batch})
                 self.viewer.render()
+                self.marker_batch.clear() # static markers are kept
             self.render_tick = self.render_tick + 1
         else:
             print ("[%s] Viewer NOT initialized."%(self.name))
@@ -297,7 +439,15 @@ class MuJoCoParserClass(object):
     def grab_image(self,resize_rate=None,interpolation=cv2.INTER_NEAREST):
         """
             Grab the rendered iamge
-        """
+            (offscreen viewer returns a view of its pixel buffer which is overwritten by the next grab)
+        """
+        if self.USE_OFFSCREEN:
+            img = self.viewer.read_pixels()
+            if resize_rate is not None:
+                h = int(img.shape[0]*resize_rate)
+                w = int(img.shape[1]*resize_rate)
+                img = cv2.resize(img,(w,h),interpolation=interpolation)
+            return img
         img = np.zeros((self.viewer.viewport.height,self.viewer.viewport.width,3),dtype=np.uint8)
         mujoco.mjr_render(self.viewer.viewport,self.viewer.scn,self.viewer.ctx)
         mujoco.mjr_readPixels(img, None,self.viewer.viewport,self.viewer.ctx)
@@ -314,19 +464,32 @@ class MuJoCoParserClass(object):
             Close viewer
         """
         self.USE_MUJOCO_VIEWER = False
+        self.USE_OFFSCREEN     = False
         self.viewer.close()
 
     def get_p_body(self,body_name):
         """
             Get body position
         """
-        return self.data.body(body_name).xpos.copy()
+        return self.data.xpos[self.body_name2id[body_name]].copy()
 
     def get_R_body(self,body_name):
         """
             Get body rotation matrix
         """
-        return self.data.body(body_name).xmat.reshape([3,3]).copy()
+        return self.data.xmat[self.body_name2id[body_name]].reshape([3,3]).copy()
+
+    def get_p_body_by_id(self,body_id):
+        """
+            Get body position from body index
+        """
+        return self.data.xpos[body_id].copy()
+
+    def get_R_body_by_id(self,body_id):
+        """
+            Get body rotation matrix from body index
+        """
+        return self.data.xmat[body_id].reshape([3,3]).copy()
 
     def get_pR_body(self,body_name):
         """
@@ -340,15 +503,13 @@ class MuJoCoParserClass(object):
         """
             Get joint position
         """
-        body_id = self.model.joint(joint_name).bodyid[0] # first body ID
-        return self.get_p_body(self.body_names[body_id])
+        return self.get_p_body_by_id(self.joint_name2bodyid[joint_name])
 
     def get_R_joint(self,joint_name):
         """
             Get joint rotation matrix
         """
-        body_id = self.model.joint(joint_name).bodyid[0] # first body ID
-        return self.get_R_body(self.body_names[body_id])
+        return self.get_R_body_by_id(self.joint_name2bodyid[joint_name])
     
     def get_pR_joint(self,joint_name):
         """
@@ -362,13 +523,25 @@ class MuJoCoParserClass(object):
         """ 
             Get geom position
         """
-        return self.data.geom(geom_name).xpos
+        return self.data.geom_xpos[self.geom_name2id[geom_name]]
     
     def get_R_geom(self,geom_name):
         """ 
             Get geom rotation
         """
-        return self.data.geom(geom_name).xmat.reshape((3,3))
+        return self.data.geom_xmat[self.geom_name2id[geom_name]].reshape((3,3))
+
+    def get_p_geom_by_id(self,geom_id):
+        """
+            Get geom position from geom index
+        """
+        return self.data.geom_xpos[geom_id]
+
+    def get_R_geom_by_id(self,geom_id):
+        """
+            Get geom rotation from geom index
+        """
+        return self.data.geom_xmat[geom_id].reshape((3,3))
     
     def get_pR_geom(self,geom_name):
         """
@@ -377,28 +550,141 @@ class MuJoCoParserClass(object):
         p = self.get_p_geom(geom_name)
         R = self.get_R_geom(geom_name)
         return p,R
-    
+
+    def init_pose_snapshot(self,body_ids=None,geom_ids=None):
+        """
+            Initialize buffers for 'get_pose_snapshot'
+            (None: all bodies or geoms, []: none)
+        """
+        n_body = self.n_body if body_ids is None else len(body_ids)
+        n_geom = self.n_geom if geom_ids is None else len(geom_ids)
+        snapshot = {
+            'p_body':np.zeros((n_body,3)),'R_body':np.zeros((n_body,3,3)),
+            'p_geom':np.zeros((n_geom,3)),'R_geom':np.zeros((n_geom,3,3))}
+        return snapshot
+
+    def get_pose_snapshot(self,body_ids=None,geom_ids=None,out=None):
+        """
+            Get positions [n x 3] and rotation matrices [n x 3 x 3] of bodies and geoms at once
+            (None: all bodies or geoms, []: none)
+            out: buffers from 'init_pose_snapshot' which are filled in-place (no allocation)
+        """
+        if out is None:
+            out = self.init_pose_snapshot(body_ids=body_ids,geom_ids=geom_ids)
+        xmat      = self.data.xmat.reshape((-1,3,3)) # view
+        geom_xmat = self.data.geom_xmat.reshape((-1,3,3)) # view
+        if body_ids is None:
+            np.copyto(out['p_body'],self.data.xpos)
+            np.copyto(out['R_body'],xmat)
+        elif len(body_ids) > 0:
+            np.take(self.data.xpos,body_ids,axis=0,out=out['p_body'])
+            np.take(xmat,body_ids,axis=0,out=out['R_body'])
+        if geom_ids is None:
+            np.copyto(out['p_geom'],self.data.geom_xpos)
+            np.copyto(out['R_geom'],geom_xmat)
+        elif len(geom_ids) > 0:
+            np.take(self.data.geom_xpos,geom_ids,axis=0,out=out['p_geom'])
+            np.take(geom_xmat,geom_ids,axis=0,out=out['R_geom'])
+        return out
+
+    def init_batch_fk(self,L,body_ids=None,geom_ids=None):
+        """
+            Initialize buffers for 'batch_fk'
+            (None: all bodies or geoms, []: none)
+        """
+        n_body = self.n_body if body_ids is None else len(body_ids)
+        n_geom = self.n_geom if geom_ids is None else len(geom_ids)
+        fk_res = {
+            'p_body':np.zeros((L,n_body,3)),'R_body':np.zeros((L,n_body,3,3)),
+            'p_geom':np.zeros((L,n_geom,3)),'R_geom':np.zeros((L,n_geom,3,3))}
+        return fk_res
+
+    def batch_fk(self,qpos_traj,body_ids=None,geom_ids=None,n_thread=None,out=None):
+        """
+            Forward kinematics of a whole trajectory without touching 'self.data'
+            qpos_traj: [L x nq] full qpos per frame
+            Returns positions [L x n x 3] and rotation matrices [L x n x 3 x 3] of bodies and geoms
+            (None: all bodies or geoms, []: none)
+            - 'mj_kinematics' only (no dynamics), frames are split over a thread pool of per-thread MjData
+            - out: buffers from 'init_batch_fk' which are filled in-place
+        """
+        L = qpos_traj.shape[0]
+        if out is None:
+            out = self.init_batch_fk(L,body_ids=body_ids,geom_ids=geom_ids)
+        if n_thread is None:
+            n_thread = min(os.cpu_count() or 1,max(L//64,1))
+        n_thread = max(min(n_thread,L),1)
+        # Per-thread MjData (created once and reused)
+        while len(self.fk_datas) < n_thread:
+            self.fk_datas.append(mujoco.MjData(self.model))
+        def fk_chunk(thread_idx,ticks):
+            data = self.fk_datas[thread_idx]
+            data.mocap_pos[:]  = self.data.mocap_pos
+            data.mocap_quat[:] = self.data.mocap_quat
+            xmat      = data.xmat.reshape((-1,3,3)) # view
+            geom_xmat = data.geom_xmat.reshape((-1,3,3)) # view
+            for tick in ticks:
+                data.qpos[:] = qpos_traj[tick]
+                mujoco.mj_kinematics(self.model,data)
+                if body_ids is None:
+                    out['p_body'][tick] = data.xpos
+                    out['R_body'][tick] = xmat
+                elif len(body_ids) > 0:
+                    np.take(data.xpos,body_ids,axis=0,out=out['p_body'][tick])
+                    np.take(xmat,body_ids,axis=0,out=out['R_body'][tick])
+                if geom_ids is None:
+                    out['p_geom'][tick] = data.geom_xpos
+                    out['R_geom'][tick] = geom_xmat
+                elif len(geom_ids) > 0:
+                    np.take(data.geom_xpos,geom_ids,axis=0,out=out['p_geom'][tick])
+                    np.take(geom_xmat,geom_ids,axis=0,out=out['R_geom'][tick])
+        tick_chunks = np.array_split(np.arange(L),n_thread)
+        if n_thread == 1:
+            fk_chunk(0,tick_chunks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=n_thread) as pool:
+                list(pool.map(fk_chunk,range(n_thread),tick_chunks))
+        return out
+
     def get_p_sensor(self,sensor_name):
         """
              Get sensor position
         """
-        sensor_id = self.model.sensor(sensor_name).id # get sensor ID
-        sensor_objtype = self.model.sensor_objtype[sensor_id] # get attached object type (i.e., site)
-        sensor_objid = self.model.sensor_objid[sensor_id] # get attached object ID
-        site_name = mujoco.mj_id2name(self.model,sensor_objtype,sensor_objid) # get the site name
-        p = self.data.site(site_name).xpos.copy() # get the position of the site
+        site_id = self.sensor_name2site_id[sensor_name] # attached site ID
+        p = self.data.site_xpos[site_id].copy() # get the position of the site
         return p
     
     def get_R_sensor(self,sensor_name):
         """
              Get sensor position
         """
-        sensor_id = self.model.sensor(sensor_name).id
-        sensor_objtype = self.model.sensor_objtype[sensor_id]
-        sensor_objid = self.model.sensor_objid[sensor_id]
-        site_name = mujoco.mj_id2name(self.model,sensor_objtype,sensor_objid)
-        R = self.data.site(site_name).xmat.reshape([3,3]).copy()
+        site_id = self.sensor_name2site_id[sensor_name]
+        R = self.data.site_xmat[site_id].reshape([3,3]).copy()
         return R
+
+    def get_p_sensor_by_id(self,sensor_id):
+        """
+             Get sensor position from sensor index
+        """
+        return self.data.site_xpos[self.sensor_id2site_id[sensor_id]].copy()
+
+    def get_R_sensor_by_id(self,sensor_id):
+        """
+             Get sensor rotation matrix from sensor index
+        """
+        return self.data.site_xmat[self.sensor_id2site_id[sensor_id]].reshape([3,3]).copy()
+
+    def get_p_site_by_id(self,site_id):
+        """
+             Get site position from site index
+        """
+        return self.data.site_xpos[site_id].copy()
+
+    def get_R_site_by_id(self,site_id):
+        """
+             Get site rotation matrix from site index
+        """
+        return self.data.site_xmat[site_id].reshape([3,3]).copy()
     
     def get_pR_sensor(self,sensor_name):
         """
@@ -414,6 +700,8 @@ class MuJoCoParserClass(object):
         """
         if joint_idxs is None:
             q = self.data.qpos
+        elif isinstance(joint_idxs,JointGroupClass):
+            q = self.data.qpos[joint_idxs.qpos_idxs]
         else:
             q = self.data.qpos[joint_idxs]
         return q.copy()
@@ -422,73 +710,56 @@ class MuJoCoParserClass(object):
         """
             Get Jocobian matrices of a body
         """
-        J_p = np.zeros((3,self.model.nv)) # nv: nDoF
-        J_R = np.zeros((3,self.model.nv))
-        mujoco.mj_jacBody(self.model,self.data,J_p,J_R,self.data.body(body_name).id)
-        J_full = np.array(np.vstack([J_p,J_R]))
+        return self.get_J_body_by_id(self.body_name2id[body_name])
+
+    def get_J_body_by_id(self,body_id):
+        """
+            Get Jocobian matrices of a body from body index
+        """
+        J_full = np.zeros((6,self.model.nv)) # nv: nDoF
+        J_p,J_R = J_full[:3],J_full[3:] # views of 'J_full'
+        mujoco.mj_jacBody(self.model,self.data,J_p,J_R,body_id)
         return J_p,J_R,J_full
     
     def get_J_geom(self,geom_name):
         """
             Get Jocobian matrices of a geom
         """
-        J_p = np.zeros((3,self.model.nv)) # nv: nDoF
-        J_R = np.zeros((3,self.model.nv))
-        mujoco.mj_jacGeom(self.model,self.data,J_p,J_R,self.data.geom(geom_name).id)
-        J_full = np.array(np.vstack([J_p,J_R]))
+        return self.get_J_geom_by_id(self.geom_name2id[geom_name])
+
+    def get_J_geom_by_id(self,geom_id):
+        """
+            Get Jocobian matrices of a geom from geom index
+        """
+        J_full = np.zeros((6,self.model.nv)) # nv: nDoF
+        J_p,J_R = J_full[:3],J_full[3:] # views of 'J_full'
+        mujoco.mj_jacGeom(self.model,self.data,J_p,J_R,geom_id)
         return J_p,J_R,J_full
 
+    def get_ik_task(self,name,type='body',IK_P=True,IK_R=True):
+        """
+            Get a (cached) 'IKTaskClass' workspace of a body or geom
+        """
+        key = (name,type,IK_P,IK_R)
+        ik_task = self.ik_task_cache.get(key)
+        if ik_task is None:
+            ik_task = IKTaskClass(env=self,name=name,type=type,IK_P=IK_P,IK_R=IK_R)
+            self.ik_task_cache[key] = ik_task
+        return ik_task
+
     def get_ik_ingredients(self,body_name,p_trgt=None,R_trgt=None,IK_P=True,IK_R=True):
         """
             Get IK ingredients
+            J and err are views of a persistent workspace overwritten by the next call of the same task
         """
-        J_p,J_R,J_full = self.get_J_body(body_name=body_name)
-        p_curr,R_curr = self.get_pR_body(body_name=body_name)
-        if (IK_P and IK_R):
-            p_err = (p_trgt-p_curr)
-            R_err = np.linalg.solve(R_curr,R_trgt)
-            w_err = R_curr @ r2w(R_err)
-            J     = J_full
-            err   = np.concatenate((p_err,w_err))
-        elif (IK_P and not IK_R):
-            p_err = (p_trgt-p_curr)
-            J     = J_p
-            err   = p_err
-        elif (not IK_P and IK_R):
-            R_err = np.linalg.solve(R_curr,R_trgt)
-            w_err = R_curr @ r2w(R_err)
-            J     = J_R
-            err   = w_err
-        else:
-            J   = None
-            err = None
-        return J,err
+        return self.get_ik_task(name=body_name,type='body',IK_P=IK_P,IK_R=IK_R)(p_trgt=p_trgt,R_trgt=R_trgt)
     
     def get_ik_ingredients_geom(self,geom_name,p_trgt=None,R_trgt=None,IK_P=True,IK_R=True):
         """
             Get IK ingredients
+            J and err are views of a persistent workspace overwritten by the next call of the same task
         """
-        J_p,J_R,J_full = self.get_J_geom(geom_name=geom_name)
-        p_curr,R_curr = self.get_pR_geom(geom_name=geom_name)
-        if (IK_P and IK_R):
-            p_err = (p_trgt-p_curr)
-            R_err = np.linalg.solve(R_curr,R_trgt)
-            w_err = R_curr @ r2w(R_err)
-            J     = J_full
-            err   = np.concatenate((p_err,w_err))
-        elif (IK_P and not IK_R):
-            p_err = (p_trgt-p_curr)
-            J     = J_p
-            err   = p_err
-        elif (not IK_P and IK_R):
-            R_err = np.linalg.solve(R_curr,R_trgt)
-            w_err = R_curr @ r2w(R_err)
-            J     = J_R
-            err   = w_err
-        else:
-            J   = None
-            err = None
-        return J,err
+        return self.get_ik_task(name=geom_name,type='geom',IK_P=IK_P,IK_R=IK_R)(p_trgt=p_trgt,R_trgt=R_trgt)
 
     def damped_ls(self,J,err,eps=1e-6,stepsize=1.0,th=5*np.pi/180.0):
         """
@@ -498,6 +769,32 @@ class MuJoCoParserClass(object):
         dq = trim_scale(x=dq,th=th)
         return dq
 
+    def hierarchical_ls(self,Js,errs,weights=None,eps=1e-3,stepsize=1.0,th=5*np.pi/180.0,
+                        JOINT_LIMIT=True):
+        """
+            Multi-priority IK step: tasks in 'Js' and 'errs' are ordered from the highest priority and
+            lower-priority tasks only act in the nullspace of higher ones (see 'nullspace_ls')
+            - weights: (optional) scalar or per-row weights of each task
+            - th: max absolute step (spent from the highest priority)
+            - JOINT_LIMIT: keep revolute joints within [rev_joint_mins,rev_joint_maxs]
+            Example)
+            J_foot,err_foot = env.get_ik_ingredients_geom('rfoot',p_trgt=p_trgt,R_trgt=R_trgt)
+            J_hand,err_hand = env.get_ik_ingredients('rhand',p_trgt=p_hand,IK_R=False)
+            dq = env.hierarchical_ls([J_foot,J_hand],[err_foot,err_hand])
+            q = q + dq[idxs_jac]
+        """
+        dq_min,dq_max = None,None
+        if JOINT_LIMIT and (self.n_rev_joint > 0):
+            dofadrs = self.model.jnt_dofadr[self.rev_joint_idxs]
+            q_rev   = self.data.qpos[self.model.jnt_qposadr[self.rev_joint_idxs]]
+            limited = self.model.jnt_limited[self.rev_joint_idxs].astype(bool)
+            dq_min  = np.full(self.model.nv,-np.inf)
+            dq_max  = np.full(self.model.nv,np.inf)
+            dq_min[dofadrs[limited]] = np.minimum(self.rev_joint_mins-q_rev,0.0)[limited]/stepsize
+            dq_max[dofadrs[limited]] = np.maximum(self.rev_joint_maxs-q_rev,0.0)[limited]/stepsize
+        dq = stepsize*nullspace_ls(Js,errs,weights=weights,eps=eps,th=th/stepsize,dq_min=dq_min,dq_max=dq_max)
+        return dq
+
     def onestep_ik(self,body_name,p_trgt=None,R_trgt=None,IK_P=True,IK_R=True,
                    joint_idxs=None,stepsize=1,eps=1e-1,th=5*np.pi/180.0):
         """
@@ -509,7 +806,10 @@ class MuJoCoParserClass(object):
         if joint_idxs is None:
             joint_idxs = self.rev_joint_idxs
         q = self.get_q(joint_idxs=joint_idxs)
-        q = q + dq[joint_idxs]
+        if isinstance(joint_idxs,JointGroupClass):
+            q = joint_idxs.integrate(q,dq[joint_idxs.qvel_idxs])
+        else:
+            q = q + dq[joint_idxs]
         # FK
         self.forward(q=q,joint_idxs=joint_idxs)
         return q, err
@@ -521,7 +821,7 @@ class MuJoCoParserClass(object):
         """
         if RESET:
             self.reset()
-        q_backup = self.get_q(joint_idxs=rev_joint_idxs)
+        state_backup = self.save_state()
         q = q_init.copy()
         self.forward(q=q,joint_idxs=rev_joint_idxs)
         tick = 0
@@ -530,7 +830,10 @@ class MuJoCoParserClass(object):
             J,err = self.get_ik_ingredients(
                 body_name=body_name,p_trgt=p_trgt,R_trgt=R_trgt,IK_P=IK_P,IK_R=IK_R)
             dq = self.damped_ls(J,err,stepsize=1,eps=1e-1,th=th)
-            q = q + dq[rev_joint_idxs]
+            if isinstance(rev_joint_idxs,JointGroupClass):
+                q = rev_joint_idxs.integrate(q,dq[rev_joint_idxs.qvel_idxs])
+            else:
+                q = q + dq[rev_joint_idxs]
             self.forward(q=q,joint_idxs=rev_joint_idxs)
             # Terminate condition
             err_norm = np.linalg.norm(err)
@@ -545,18 +848,18 @@ class MuJoCoParserClass(object):
                     self.render()
         # Back to back-uped position
         q_ik = self.get_q(joint_idxs=rev_joint_idxs)
-        self.forward(q=q_backup,joint_idxs=rev_joint_idxs)
+        self.restore_state(state_backup,FORWARD=True)
         return q_ik
 
     def plot_sphere(self,p,r,rgba=[1,1,1,1],label=''):
         """
-            Add sphere
+            Add sphere (batched, see 'MarkerBatchClass')
         """
-        self.viewer.add_marker(
+        self.marker_batch.add(
+            type  = mujoco.mjtGeom.mjGEOM_SPHERE,
             pos   = p,
             size  = [r,r,r],
             rgba  = rgba,
-            type  = mujoco.mjtGeom.mjGEOM_SPHERE,
             label = label)
 
     def plot_T(self,p,R,
@@ -564,61 +867,20 @@ class MuJoCoParserClass(object):
                PLOT_SPHERE=False,sphere_r=0.05,sphere_rgba=[1,0,0,0.5],axis_rgba=None,
                label=None):
         """
-            Plot coordinate axes
+            Plot coordinate axes (batched, see 'MarkerBatchClass')
         """
         if PLOT_AXIS:
-            if axis_rgba is None:
-                rgba_x = [1.0,0.0,0.0,0.9]
-                rgba_y = [0.0,1.0,0.0,0.9]
-                rgba_z = [0.0,0.0,1.0,0.9]
-            else:
-                rgba_x = axis_rgba
-                rgba_y = axis_rgba
-                rgba_z = axis_rgba
-            # X axis
-            R_x = R@rpy2r(np.deg2rad([0,0,90]))@rpy2r(np.pi/2*np.array([1,0,0]))
-            p_x = p + R_x[:,2]*axis_len/2
-            self.viewer.add_marker(
-                pos   = p_x,
-                type  = mujoco.mjtGeom.mjGEOM_CYLINDER,
-                size  = [axis_width,axis_width,axis_len/2],
-                mat   = R_x,
-                rgba  = rgba_x,
-                label = ''
-            )
-            R_y = R@rpy2r(np.deg2rad([0,0,90]))@rpy2r(np.pi/2*np.array([0,1,0]))
-            p_y = p + R_y[:,2]*axis_len/2
-            self.viewer.add_marker(
-                pos   = p_y,
-                type  = mujoco.mjtGeom.mjGEOM_CYLINDER,
-                size  = [axis_width,axis_width,axis_len/2],
-                mat   = R_y,
-                rgba  = rgba_y,
-                label = ''
-            )
-            R_z = R@rpy2r(np.deg2rad([0,0,90]))@rpy2r(np.pi/2*np.array([0,0,1]))
-            p_z = p + R_z[:,2]*axis_len/2
-            self.viewer.add_marker(
-                pos   = p_z,
-                type  = mujoco.mjtGeom.mjGEOM_CYLINDER,
-                size  = [axis_width,axis_width,axis_len/2],
-                mat   = R_z,
-                rgba  = rgba_z,
-                label = ''
-            )
+            self.marker_batch.add_frames(
+                ps=np.asarray(p)[None],Rs=np.asarray(R)[None],
+                axis_len=axis_len,axis_width=axis_width,axis_rgba=axis_rgba)
         if PLOT_SPHERE:
-            self.viewer.add_marker(
-                pos   = p,
-                size  = [sphere_r,sphere_r,sphere_r],
-                rgba  = sphere_rgba,
-                type  = mujoco.mjtGeom.mjGEOM_SPHERE,
-                label = '')
+            self.marker_batch.add_spheres(ps=p,r=sphere_r,rgba=sphere_rgba)
         if label is not None:
-            self.viewer.add_marker(
+            self.marker_batch.add(
+                type  = mujoco.mjtGeom.mjGEOM_SPHERE,
                 pos   = p,
                 size  = [0.0001,0.0001,0.0001],
                 rgba  = [1,1,1,0.01],
-                type  = mujoco.mjtGeom.mjGEOM_SPHERE,
                 label = label)
             
     def plot_box(self,p=np.array([0,0,0]),R=np.eye(3),
@@ -781,14 +1043,14 @@ class MuJoCoParserClass(object):
         """ 
             Plot revolute joint 
         """
-        for rev_joint_idx,rev_joint_name in zip(self.rev_joint_idxs,self.rev_joint_names):
-            axis_joint = self.model.jnt_axis[rev_joint_idx]
-            p_joint,R_joint = self.get_pR_joint(joint_name=rev_joint_name)
-            axis_world = R_joint@axis_joint
-            axis_rgba = np.append(np.eye(3)[:,np.argmax(axis_joint)],0.2)
-            self.plot_arrow_fr2to(
-                p_fr=p_joint,p_to=p_joint+axis_len*axis_world,
-                r=axis_r,rgba=axis_rgba)
+        axis_joints = self.model.jnt_axis[self.rev_joint_idxs] # [n x 3]
+        body_ids    = self.model.jnt_bodyid[self.rev_joint_idxs]
+        p_joints    = self.data.xpos[body_ids] # [n x 3]
+        R_joints    = self.data.xmat[body_ids].reshape((-1,3,3)) # [n x 3 x 3]
+        axis_worlds = np.einsum('nij,nj->ni',R_joints,axis_joints)
+        axis_rgbas  = np.hstack((np.eye(3)[np.argmax(axis_joints,axis=1)],0.2*np.ones((len(body_ids),1))))
+        self.marker_batch.add_arrows_fr2to(
+            p_frs=p_joints,p_tos=p_joints+axis_len*axis_worlds,r=axis_r,rgbas=axis_rgbas)
             
     def plot_ik_geom_info(self,ik_geom_names,ik_p_trgts,ik_R_trgts,
                           axis_len=0.3,axis_width=0.01,sphere_r=0.05):
@@ -816,54 +1078,78 @@ class MuJoCoParserClass(object):
         body_names = [x for x in self.body_names if x[:len(prefix)]==prefix]
         return body_names
 
+    def get_geom_prefix_mask(self,prefix):
+        """
+            Boolean mask [n_geom] of geoms whose names start with 'prefix' (cached)
+        """
+        mask = self.geom_prefix_masks.get(prefix)
+        if mask is None:
+            mask = np.array([(geom_name or '').startswith(prefix) for geom_name in self.geom_names],dtype=bool)
+            mask.setflags(write=False)
+            self.geom_prefix_masks[prefix] = mask
+        return mask
+
+    def get_contacts(self,must_include_prefix=None,must_exclude_prefix=None):
+        """
+            Get contact information as arrays (no per-contact Python loop)
+            must_include_prefix: keep contacts where either geom name starts with the prefix
+            must_exclude_prefix: drop contacts where either geom name starts with the prefix
+            Returns a dictionary of
+                'idxs':    [n] contact indices in 'data.contact'
+                'p':       [n x 3] contact positions
+                'R_frame': [n x 3 x 3] contact frames (rows: normal and two tangents)
+                'f_local': [n x 6] contact forces in the contact frame (same as 'mj_contactForce')
+                'f':       [n x 3] contact forces in the global coordinate
+                'geom1','geom2','body1','body2': [n] geom and body indices
+        """
+        contact = self.data.contact
+        geoms   = contact.geom.reshape((-1,2)) # [ncon x 2]
+        keep    = np.ones(self.data.ncon,dtype=bool)
+        if must_include_prefix is not None:
+            mask = self.get_geom_prefix_mask(must_include_prefix)
+            keep &= mask[geoms].any(axis=1)
+        elif must_exclude_prefix is not None:
+            mask = self.get_geom_prefix_mask(must_exclude_prefix)
+            keep &= ~mask[geoms].any(axis=1)
+        idxs    = np.flatnonzero(keep)
+        n       = len(idxs)
+        R_frame = contact.frame.reshape((-1,3,3))[idxs]
+        # Contact forces in the contact frame (decode the constraint forces of each contact)
+        f_local  = np.zeros((n,6))
+        efc_adrs = contact.efc_address[idxs]
+        dims     = contact.dim[idxs]
+        ELLIPTIC = self.model.opt.cone == mujoco.mjtCone.mjCONE_ELLIPTIC
+        for dim in np.unique(dims):
+            sel = np.flatnonzero((dims == dim) & (efc_adrs >= 0))
+            if len(sel) == 0: continue
+            adr = efc_adrs[sel]
+            if (dim == 1) or ELLIPTIC:
+                f_local[sel,:dim] = self.data.efc_force[adr[:,None]+np.arange(dim)]
+            else: # pyramidal: normal is the sum of the edges, friction is the difference of each pair
+                pyramid = self.data.efc_force[adr[:,None]+np.arange(2*(dim-1))] # [k x 2(dim-1)]
+                f_local[sel,0]   = pyramid.sum(axis=1)
+                f_local[sel,1:dim] = (pyramid[:,0::2]-pyramid[:,1::2])*contact.friction[idxs[sel],:dim-1]
+        f = np.einsum('nji,nj->ni',R_frame,f_local[:,:3]) # frame rows are the axes in the global coordinate
+        geom1 = geoms[idxs,0]
+        geom2 = geoms[idxs,1]
+        contacts = {
+            'idxs':idxs,'p':contact.pos[idxs],'R_frame':R_frame,'f_local':f_local,'f':f,
+            'geom1':geom1,'geom2':geom2,
+            'body1':self.model.geom_bodyid[geom1],'body2':self.model.geom_bodyid[geom2]}
+        return contacts
+
     def get_contact_info(self,must_include_prefix=None,must_exclude_prefix=None):
         """
             Get contact information
         """
-        p_contacts = []
-        f_contacts = []
-        geom1s = []
-        geom2s = []
-        body1s = []
-        body2s = []
-        for c_idx in range(self.data.ncon):
-            contact   = self.data.contact[c_idx]
-            # Contact position and frame orientation
-            p_contact = contact.pos # contact position
-            R_frame   = contact.frame.reshape(( 3,3))
-            # Contact force
-            f_contact_local = np.zeros(6,dtype=np.float64)
-            mujoco.mj_contactForce(self.model,self.data,0,f_contact_local)
-            f_contact = R_frame @ f_contact_local[:3] # in the global coordinate
-            # Contacting geoms
-            contact_geom1 = self.geom_names[contact.geom1]
-            contact_geom2 = self.geom_names[contact.geom2]
-            contact_body1 = self.body_names[self.model.geom_bodyid[contact.geom1]]
-            contact_body2 = self.body_names[self.model.geom_bodyid[contact.geom2]]
-            # Append
-            if must_include_prefix is not None:
-                if (contact_geom1[:len(must_include_prefix)] == must_include_prefix) or (contact_geom2[:len(must_include_prefix)] == must_include_prefix):
-                    p_contacts.append(p_contact)
-                    f_contacts.append(f_contact)
-                    geom1s.append(contact_geom1)
-                    geom2s.append(contact_geom2)
-                    body1s.append(contact_body1)
-                    body2s.append(contact_body2)
-            elif must_exclude_prefix is not None:
-                if (contact_geom1[:len(must_exclude_prefix)] != must_exclude_prefix) and (contact_geom2[:len(must_exclude_prefix)] != must_exclude_prefix):
-                    p_contacts.append(p_contact)
-                    f_contacts.append(f_contact)
-                    geom1s.append(contact_geom1)
-                    geom2s.append(contact_geom2)
-                    body1s.append(contact_body1)
-                    body2s.append(contact_body2)
-            else:
-                p_contacts.append(p_contact)
-                f_contacts.append(f_contact)
-                geom1s.append(contact_geom1)
-                geom2s.append(contact_geom2)
-                body1s.append(contact_body1)
-                body2s.append(contact_body2)
+        contacts = self.get_contacts(
+            must_include_prefix=must_include_prefix,must_exclude_prefix=must_exclude_prefix)
+        p_contacts = list(contacts['p'])
+        f_contacts = list(contacts['f'])
+        geom1s = [self.geom_names[geom_id] for geom_id in contacts['geom1']]
+        geom2s = [self.geom_names[geom_id] for geom_id in contacts['geom2']]
+        body1s = [self.body_names[body_id] for body_id in contacts['body1']]
+        body2s = [self.body_names[body_id] for body_id in contacts['body2']]
         return p_contacts,f_contacts,geom1s,geom2s,body1s,body2s
 
     def plot_contact_info(self,must_include_prefix=None,h_arrow=0.3,rgba_arrow=[1,0,0,1],
@@ -872,24 +1158,29 @@ class MuJoCoParserClass(object):
             Plot contact information
         """
         # Get contact information
-        p_contacts,f_contacts,geom1s,geom2s,body1s,body2s = self.get_contact_info(
-            must_include_prefix=must_include_prefix)
-        # Render contact informations
-        for (p_contact,f_contact,geom1,geom2,body1,body2) in zip(p_contacts,f_contacts,geom1s,geom2s,body1s,body2s):
-            f_norm = np.linalg.norm(f_contact)
-            f_uv = f_contact / (f_norm+1e-8)
-            # h_arrow = 0.3 # f_norm*0.05
-            self.plot_arrow_contact(p=p_contact,uv=f_uv,r_arrow=0.01,h_arrow=h_arrow,rgba=rgba_arrow,
-                        label='')
-            self.plot_arrow_contact(p=p_contact,uv=-f_uv,r_arrow=0.01,h_arrow=h_arrow,rgba=rgba_arrow,
-                        label='')
+        contacts = self.get_contacts(must_include_prefix=must_include_prefix)
+        p_contacts = contacts['p']
+        n_contact = len(p_contacts)
+        if n_contact > 0:
+            # Arrows along both directions of the contact force
+            f_uvs = contacts['f']/(np.linalg.norm(contacts['f'],axis=1,keepdims=True)+1e-8)
+            p_arrows = np.vstack((p_contacts,p_contacts))
+            R_arrows = get_rotation_matrices_from_two_points(p_frs=p_arrows,p_tos=p_arrows+np.vstack((f_uvs,-f_uvs)))
+            self.marker_batch.add_batch(
+                types=mujoco.mjtGeom.mjGEOM_ARROW,poss=p_arrows,sizes=[0.01,0.01,h_arrow],mats=R_arrows,
+                rgbas=rgba_arrow)
+            # Spheres at contact points
             if PRINT_CONTACT_BODY:
-                label = '[%s]-[%s]'%(body1,body2)
+                labels = ['[%s]-[%s]'%(self.body_names[b1],self.body_names[b2])
+                          for b1,b2 in zip(contacts['body1'],contacts['body2'])]
             elif PRINT_CONTACT_GEOM:
-                label = '[%s]-[%s]'%(geom1,geom2)
+                labels = ['[%s]-[%s]'%(self.geom_names[g1],self.geom_names[g2])
+                          for g1,g2 in zip(contacts['geom1'],contacts['geom2'])]
             else:
-                label = '' 
-            self.plot_sphere(p=p_contact,r=0.02,rgba=[1,0.2,0.2,1],label=label)
+                labels = None
+            self.marker_batch.add_batch(
+                types=mujoco.mjtGeom.mjGEOM_SPHERE,poss=p_contacts,sizes=[0.02,0.02,0.02],
+                rgbas=[1,0.2,0.2,1],labels=labels)
         # Print
         if VERBOSE:
             self.print_contact_info(must_include_prefix=must_include_prefix)
@@ -937,10 +1228,13 @@ class MuJoCoParserClass(object):
         """
             Grab RGB and Depth images
         """
-        rgb_img = np.zeros((self.viewer.viewport.height,self.viewer.viewport.width,3),dtype=np.uint8)
-        depth_img = np.zeros((self.viewer.viewport.height,self.viewer.viewport.width,1), dtype=np.float32)
-        mujoco.mjr_readPixels(rgb_img,depth_img,self.viewer.viewport,self.viewer.ctx)
-        rgb_img,depth_img = np.flipud(rgb_img),np.flipud(depth_img)
+        if self.USE_OFFSCREEN:
+            rgb_img,depth_img = self.viewer.read_pixels(depth=True) # views
+        else:
+            rgb_img = np.zeros((self.viewer.viewport.height,self.viewer.viewport.width,3),dtype=np.uint8)
+            depth_img = np.zeros((self.viewer.viewport.height,self.viewer.viewport.width,1), dtype=np.float32)
+            mujoco.mjr_readPixels(rgb_img,depth_img,self.viewer.viewport,self.viewer.ctx)
+            rgb_img,depth_img = np.flipud(rgb_img),np.flipud(depth_img)
 
         # Rescale depth image
         extent = self.model.stat.extent
@@ -950,36 +1244,40 @@ class MuJoCoParserClass(object):
         depth_img = scaled_depth_img.squeeze()
         return rgb_img,depth_img
     
-    def get_pcd_from_depth_img(self,depth_img,fovy=45):
+    def get_camera_projection(self,height,width,fovy=45,stride=1,dtype=np.float64):
+        """
+            Get a (cached) 'CameraProjectionClass' for an image size, fovy, and stride
+        """
+        key = (height,width,fovy,stride,np.dtype(dtype).str)
+        proj = self.camera_projection_cache.get(key)
+        if proj is None:
+            proj = CameraProjectionClass(height=height,width=width,fovy=fovy,stride=stride,dtype=dtype)
+            self.camera_projection_cache[key] = proj
+        return proj
+
+    def get_pcd_from_depth_img(self,depth_img,fovy=45,stride=1,dtype=np.float64,REUSE_BUFFER=False):
         """
             Get point cloud data from depth image
+            stride: use every 'stride'-th pixel
+            dtype: output type (e.g., np.float32)
+            REUSE_BUFFER: return views of buffers which are overwritten by the next call (no copy)
         """
         # Get camera pose
         T_viewer = self.get_T_viewer(fovy=fovy)
 
-        # Camera intrinsic
-        img_height = depth_img.shape[0]
-        img_width = depth_img.shape[1]
-        focal_scaling = 0.5*img_height/np.tan(fovy*np.pi/360)
-        cam_matrix = np.array(((focal_scaling,0,img_width/2),
-                            (0,focal_scaling,img_height/2),
-                            (0,0,1)))
-
-        # Estimate 3D point from depth image
-        xyz_img = meters2xyz(depth_img,cam_matrix) # [H x W x 3]
-        xyz_transpose = np.transpose(xyz_img,(2,0,1)).reshape(3,-1) # [3 x N]
-        xyzone_transpose = np.vstack((xyz_transpose,np.ones((1,xyz_transpose.shape[1])))) # [4 x N]
-
-        # To world coordinate
-        xyzone_world_transpose = T_viewer @ xyzone_transpose
-        xyz_world_transpose = xyzone_world_transpose[:3,:] # [3 x N]
-        xyz_world = np.transpose(xyz_world_transpose,(1,0)) # [N x 3]
+        # Cached rays of the camera and transform to world coordinate
+        proj = self.get_camera_projection(
+            height=depth_img.shape[0],width=depth_img.shape[1],fovy=fovy,stride=stride,dtype=dtype)
+        xyz_world,xyz_img = proj.depth_to_pcd(depth_img,p_cam=T_viewer[:3,3],R_cam=T_viewer[:3,:3])
+        if not REUSE_BUFFER:
+            xyz_world,xyz_img = xyz_world.copy(),xyz_img.copy()
         return xyz_world,xyz_img
     
     def get_egocentric_rgb_depth_pcd(self,p_ego=None,p_trgt=None,rsz_rate=50,fovy=45,
-                                     BACKUP_AND_RESTORE_VIEW=False):
+                                     BACKUP_AND_RESTORE_VIEW=False,dtype=np.float64,REUSE_BUFFER=False):
         """
             Get egocentric 1) RGB image, 2) Depth image, 3) Point Cloud Data
+            (the point cloud uses every 'rsz_rate'-th pixel of the depth image)
         """
         if BACKUP_AND_RESTORE_VIEW:
             # Backup camera information
@@ -994,12 +1292,9 @@ class MuJoCoParserClass(object):
         # Grab RGB and depth image
         rgb_img,depth_img = self.grab_rgb_depth_img() # get rgb and depth images
 
-        # Resize
-        h_rsz,w_rsz = depth_img.shape[0]//rsz_rate,depth_img.shape[1]//rsz_rate
-        depth_img_rsz = cv2.resize(depth_img,(w_rsz,h_rsz),interpolation=cv2.INTER_NEAREST)
-
-        # Get PCD
-        pcd,xyz_img = self.get_pcd_from_depth_img(depth_img_rsz,fovy=fovy) # [N x 3]
+        # Get PCD (strided pixels instead of resizing)
+        pcd,xyz_img = self.get_pcd_from_depth_img(
+            depth_img,fovy=fovy,stride=rsz_rate,dtype=dtype,REUSE_BUFFER=REUSE_BUFFER) # [N x 3]
 
         if BACKUP_AND_RESTORE_VIEW:
             # Restore camera information
@@ -1025,53 +1320,148 @@ class MuJoCoParserClass(object):
         if tick_every is not None:
             FLAG = (self.tick-1)%(tick_every)==0
         return FLAG
+
+    def init_scheduler(self,ctrl_func=None,ctrl_HZ=None,render_HZ=None,log_func=None,log_HZ=1,
+                       REAL_TIME=True,max_lag=0.5):
+        """
+            Fixed-rate scheduler with physics at 'self.HZ' and optional control, rendering, and logging
+            - ctrl_func(tick): returns 'ctrl' [nu] (applied before the physics step) or None
+            - render_HZ: rendering rate (viewer must be initialized)
+            - log_func(tick): called at 'log_HZ'
+            Tasks run in the order of control, physics, rendering, and logging
+        """
+        scheduler = LoopSchedulerClass(HZ=self.HZ,REAL_TIME=REAL_TIME,max_lag=max_lag,name=self.name)
+        if ctrl_func is not None:
+            def ctrl_task(tick):
+                ctrl = ctrl_func(tick)
+                if ctrl is not None:
+                    self.data.ctrl[:] = ctrl
+            scheduler.add_task('ctrl',ctrl_task,HZ=self.HZ if ctrl_HZ is None else ctrl_HZ)
+        scheduler.add_task('physics',lambda tick: self.step())
+        if render_HZ is not None:
+            scheduler.add_task('render',lambda tick: self.render(),HZ=render_HZ)
+        if log_func is not None:
+            scheduler.add_task('log',log_func,HZ=log_HZ)
+        return scheduler
+
+    def run_loop(self,ctrl_func=None,ctrl_HZ=None,render_HZ=None,log_func=None,log_HZ=1,
+                 n_tick=None,duration=None,REAL_TIME=True,VERBOSE=True):
+        """
+            Run a fixed-rate loop (see 'init_scheduler') until 'n_tick' physics steps, 'duration' seconds,
+            or the viewer is closed, and return the scheduler (for its statistics)
+        """
+        scheduler = self.init_scheduler(ctrl_func=ctrl_func,ctrl_HZ=ctrl_HZ,render_HZ=render_HZ,
+                                        log_func=log_func,log_HZ=log_HZ,REAL_TIME=REAL_TIME)
+        stop_func = (lambda: not self.is_viewer_alive()) if self.USE_MUJOCO_VIEWER else None
+        scheduler.run(n_tick=n_tick,duration=duration,stop_func=stop_func)
+        if VERBOSE:
+            scheduler.print_stats()
+        return scheduler
     
     def get_sensor_value(self,sensor_name):
         """
             Read sensor value
         """
-        data = self.data.sensor(sensor_name).data
-        return data.copy()
+        adr = self.sensor_adrs[self.sensor_name2id[sensor_name]]
+        dim = self.sensor_dims[self.sensor_name2id[sensor_name]]
+        return self.data.sensordata[adr:adr+dim].copy()
+
+    def get_sensor_values(self,sensor_names=None,out=None):
+        """
+            Read multiple sensor values as one flat array (concatenated in the order of 'sensor_names')
+            out: (optional) buffer which is filled in-place (no allocation)
+        """
+        idxs = self.get_idxs_sensor(sensor_names)
+        if not isinstance(idxs,slice):
+            return np.take(self.data.sensordata,idxs,out=out)
+        if out is None:
+            return self.data.sensordata[idxs].copy()
+        np.copyto(out,self.data.sensordata[idxs])
+        return out
 
-    def get_sensor_values(self,sensor_names=None):
+    def get_sensor_view(self,sensor_names=None):
         """
-            Read multiple sensor values
+            Live (no copy) view of 'sensordata' for sensors stored contiguously
+        """
+        idxs = self.get_idxs_sensor(sensor_names)
+        if not isinstance(idxs,slice):
+            raise ValueError("[%s] sensors %s are not contiguous in sensordata"%(self.name,sensor_names))
+        return self.data.sensordata[idxs]
+
+    def init_sensor_history(self,sensor_names=None,capacity=1000):
         """
-        if sensor_names is None:
-            sensor_names = self.sensor_names
-        data = np.array([self.get_sensor_value(sensor_name) for sensor_name in self.sensor_names]).squeeze()
-        return data.copy()
+            Keep the last 'capacity' readings of 'sensor_names' (recorded after every 'step' call)
+        """
+        self.sensor_history_names = self.sensor_names if sensor_names is None else list(sensor_names)
+        n_dim = len(self.data.sensordata[self.get_idxs_sensor(self.sensor_history_names)])
+        self.sensor_history = RingBufferClass(capacity=capacity,shape=(n_dim,))
+
+    def record_sensor_history(self):
+        """
+            Append the current reading to the sensor history
+        """
+        self.get_sensor_values(sensor_names=self.sensor_history_names,out=self.sensor_history.push())
+
+    def get_sensor_history(self,n_last=None):
+        """
+            Sensor history from the oldest to the latest [n x dim]
+        """
+        history = self.sensor_history.to_array()
+        if n_last is not None:
+            history = history[-n_last:]
+        return history
     
     def get_qpos_joint(self,joint_name):
         """
             Get joint position
         """
-        addr = self.model.joint(joint_name).qposadr[0]
-        L = len(self.model.joint(joint_name).qpos0)
-        qpos = self.data.qpos[addr:addr+L]
-        return qpos
+        return self.get_qpos_joint_by_id(self.joint_name2id[joint_name])
     
     def get_qvel_joint(self,joint_name):
         """
             Get joint velocity
         """
-        addr = self.model.joint(joint_name).dofadr[0]
-        L = len(self.model.joint(joint_name).qpos0)
-        if L > 1: L = 6
-        qvel = self.data.qvel[addr:addr+L]
-        return qvel
+        return self.get_qvel_joint_by_id(self.joint_name2id[joint_name])
+
+    def get_qpos_joint_by_id(self,joint_id):
+        """
+            Get joint position from joint index
+        """
+        addr = self.model.jnt_qposadr[joint_id]
+        return self.data.qpos[addr:addr+self.joint_nqposs[joint_id]]
+
+    def get_qvel_joint_by_id(self,joint_id):
+        """
+            Get joint velocity from joint index
+        """
+        addr = self.model.jnt_dofadr[joint_id]
+        return self.data.qvel[addr:addr+self.joint_ndofs[joint_id]]
     
     def get_qpos_joints(self,joint_names):
         """
-            Get multiple joint positions from 'joint_names'
+            Get multiple joint positions from 'joint_names' (concatenated, multi-dof joints included)
         """
-        return np.array([self.get_qpos_joint(joint_name) for joint_name in joint_names]).squeeze()
+        return self.get_joint_group(joint_names).get_qpos()
     
     def get_qvel_joints(self,joint_names):
         """
-            Get multiple joint velocities from 'joint_names'
+            Get multiple joint velocities from 'joint_names' (concatenated, multi-dof joints included)
+        """
+        return self.get_joint_group(joint_names).get_qvel()
+
+    def get_joint_group(self,joint_names):
         """
-        return np.array([self.get_qvel_joint(joint_name) for joint_name in joint_names]).squeeze()
+            Get a (cached) 'JointGroupClass' handle of 'joint_names'
+            Example)
+            group = env.get_joint_group(joint_names=env.rev_joint_names)
+            env.forward(q=q,joint_idxs=group) # <= HERE
+        """
+        key = tuple(joint_names)
+        group = self.joint_group_cache.get(key)
+        if group is None:
+            group = JointGroupClass(env=self,joint_names=joint_names)
+            self.joint_group_cache[key] = group
+        return group
     
     def viewer_pause(self):
         """
@@ -1091,7 +1481,7 @@ class MuJoCoParserClass(object):
             Example)
             env.forward(q=q,joint_idxs=idxs_fwd) # <= HERE
         """
-        return [self.model.joint(jname).qposadr[0] for jname in joint_names]
+        return [self.joint_name2qposadr[jname] for jname in joint_names]
     
     def get_idxs_jac(self,joint_names):
         """ 
@@ -1101,7 +1491,7 @@ class MuJoCoParserClass(object):
             dq = env.damped_ls(J,ik_err,stepsize=1,eps=1e-2,th=np.radians(1.0))
             q = q + dq[idxs_jac] # <= HERE
         """
-        return [self.model.joint(jname).dofadr[0] for jname in joint_names]
+        return [self.joint_name2dofadr[jname] for jname in joint_names]
     
     def get_idxs_step(self,joint_names):
         """ 
@@ -1117,14 +1507,41 @@ class MuJoCoParserClass(object):
             Example)
             env.forward(q=q,joint_idxs=idxs_fwd) # <= HERE
         """
-        return [self.model.body(bname).id for bname in body_names]
+        return [self.body_name2id[bname] for bname in body_names]
+
+    def get_idxs_geom(self,geom_names):
+        """
+            Get geom indices
+            Example)
+            env.get_pose_snapshot(geom_ids=idxs_geom) # <= HERE
+        """
+        return [self.geom_name2id[gname] for gname in geom_names]
+
+    def get_idxs_sensor(self,sensor_names=None):
+        """
+            Get 'sensordata' indices of sensors (cached per sensor list)
+            Returns a slice when the sensors are stored contiguously, otherwise an index array
+        """
+        key = None if sensor_names is None else tuple(sensor_names)
+        idxs = self.sensor_idxs_cache.get(key)
+        if idxs is None:
+            if sensor_names is None:
+                sensor_names = self.sensor_names
+            sensor_ids = [self.sensor_name2id[sensor_name] for sensor_name in sensor_names]
+            idxs = np.concatenate(
+                [np.arange(self.sensor_adrs[x],self.sensor_adrs[x]+self.sensor_dims[x]) for x in sensor_ids]
+                +[np.zeros(0,dtype=np.int64)]).astype(np.int64)
+            if (len(idxs) > 0) and np.all(np.diff(idxs) == 1):
+                idxs = slice(int(idxs[0]),int(idxs[-1])+1)
+            self.sensor_idxs_cache[key] = idxs
+        return idxs
 
 
     def get_geom_idxs_from_body_name(self,body_name):
         """ 
             Get geometry indices for a body name to modify the properties of geom attached to a body
         """
-        body_idx = self.body_names.index(body_name)
+        body_idx = self.body_name2id[body_name]
         geom_idxs = [idx for idx,val in enumerate(self.model.geom_bodyid) if val==body_idx] 
         return geom_idxs
     
@@ -1133,7 +1550,7 @@ class MuJoCoParserClass(object):
              Set the position of a specific body
              FK must be called after
         """
-        jntadr  = self.model.body(root_name).jntadr[0]
+        jntadr  = self.body_jntadrs[self.body_name2id[root_name]]
         qposadr = self.model.jnt_qposadr[jntadr]
         self.data.qpos[qposadr:qposadr+3] = p
         
@@ -1142,7 +1559,7 @@ class MuJoCoParserClass(object):
             Set the rotation of a root joint
             FK must be called after
         """
-        jntadr  = self.model.body(root_name).jntadr[0]
+        jntadr  = self.body_jntadrs[self.body_name2id[root_name]]
         qposadr = self.model.jnt_qposadr[jntadr]
         self.data.qpos[qposadr+3:qposadr+7] = r2quat(R)
         
@@ -1151,6 +1568,795 @@ class MuJoCoParserClass(object):
             Set the rotation of a root joint
             FK must be called after
         """
-        jntadr  = self.model.body(root_name).jntadr[0]
+        jntadr  = self.body_jntadrs[self.body_name2id[root_name]]
         qposadr = self.model.jnt_qposadr[jntadr]
-        self.data.qpos[qposadr+3:qposadr+7] = quat
\ No newline at end of file
+        self.data.qpos[qposadr+3:qposadr+7] = quat
+
+class MarkerBatchClass(object):
+    """
+        Batched markers (type, pos, mat, size, rgba arrays) written into 'mjvScene.geoms' in one pass
+        - dynamic markers are cleared after every render
+        - static markers (STATIC=True) stay cached and are written every frame without recomputation
+        env.marker_batch.add_frames(ps,Rs,axis_len=0.1,axis_width=0.005)
+        env.marker_batch.add_spheres(ps,r=0.02,STATIC=True)
+        env.render()
+    """
+    def __init__(self,capacity=256):
+        """
+            Initialize static and dynamic layers
+        """
+        self.layers = {True:self._init_layer(capacity),False:self._init_layer(capacity)}
+
+    def _init_layer(self,capacity):
+        return {'n':0,'types':np.zeros(capacity,dtype=np.int32),'poss':np.zeros((capacity,3)),
+                'mats':np.zeros((capacity,9)),'sizes':np.zeros((capacity,3)),
+                'rgbas':np.zeros((capacity,4),dtype=np.float32),'labels':{}}
+
+    def __len__(self):
+        return self.layers[True]['n']+self.layers[False]['n']
+
+    def _reserve(self,layer,n):
+        """
+            Grow the layer (doubling) to fit 'n' more markers and return the slice of the new markers
+        """
+        n_curr = layer['n']
+        capacity = layer['types'].shape[0]
+        if n_curr+n > capacity:
+            capacity = max(2*capacity,n_curr+n)
+            for key in ['types','poss','mats','sizes','rgbas']:
+                buf = np.zeros((capacity,)+layer[key].shape[1:],dtype=layer[key].dtype)
+                buf[:n_curr] = layer[key][:n_curr]
+                layer[key] = buf
+        layer['n'] = n_curr+n
+        return slice(n_curr,n_curr+n)
+
+    def clear(self,STATIC=False):
+        """
+            Clear dynamic markers (and static markers if STATIC is True)
+        """
+        self.layers[False]['n'] = 0
+        self.layers[False]['labels'].clear()
+        if STATIC:
+            self.layers[True]['n'] = 0
+            self.layers[True]['labels'].clear()
+
+    def add_batch(self,types,poss,sizes,mats=None,rgbas=None,labels=None,STATIC=False):
+        """
+            Add 'n' markers (scalar 'types' and single 'sizes', 'mats', or 'rgbas' are broadcasted)
+        """
+        poss  = np.asarray(poss,dtype=np.float64).reshape((-1,3))
+        n     = poss.shape[0]
+        layer = self.layers[STATIC]
+        idxs  = self._reserve(layer,n)
+        layer['types'][idxs] = types
+        layer['poss'][idxs]  = poss
+        layer['sizes'][idxs] = np.reshape(sizes,(-1,3)) # broadcasted by the assignment
+        if mats is None:
+            layer['mats'][idxs] = np.eye(3).ravel()
+        else:
+            layer['mats'][idxs] = np.asarray(mats,dtype=np.float64).reshape((-1,9))
+        layer['rgbas'][idxs] = np.ones(4) if rgbas is None else np.asarray(rgbas).reshape((-1,4))
+        if labels is not None:
+            for m_idx,label in zip(range(idxs.start,idxs.stop),labels):
+                if label: layer['labels'][m_idx] = label
+        return idxs
+
+    def add(self,type,pos,size,mat=None,rgba=None,label='',STATIC=False):
+        """
+            Add a single marker
+        """
+        return self.add_batch(types=type,poss=pos,sizes=size,mats=mat,rgbas=rgba,
+                              labels=[label] if label else None,STATIC=STATIC)
+
+    def add_frames(self,ps,Rs,axis_len=0.1,axis_width=0.005,axis_rgba=None,STATIC=False):
+        """
+            Add coordinate axes of 'n' frames ([n x 3] positions and [n x 3 x 3] rotations) as in 'plot_T'
+        """
+        ps = np.asarray(ps,dtype=np.float64).reshape((-1,3))
+        Rs = np.asarray(Rs,dtype=np.float64).reshape((-1,3,3))
+        R_axes = np.matmul(Rs[:,None],R_PLOT_AXES) # [n x 3 x 3 x 3]
+        p_axes = ps[:,None,:]+R_axes[:,:,:,2]*axis_len/2 # [n x 3 x 3]
+        if axis_rgba is None:
+            rgbas = np.tile(RGBA_PLOT_AXES,(ps.shape[0],1))
+        else:
+            rgbas = axis_rgba # single color (broadcasted)
+        return self.add_batch(
+            types=mujoco.mjtGeom.mjGEOM_CYLINDER,poss=p_axes.reshape((-1,3)),
+            sizes=[axis_width,axis_width,axis_len/2],mats=R_axes.reshape((-1,9)),
+            rgbas=rgbas,STATIC=STATIC)
+
+    def add_spheres(self,ps,r=0.02,rgba=[1,0,0,0.5],labels=None,STATIC=False):
+        """
+            Add spheres at 'n' positions
+        """
+        r = np.asarray(r,dtype=np.float64).reshape((-1,1))
+        return self.add_batch(types=mujoco.mjtGeom.mjGEOM_SPHERE,poss=ps,sizes=np.repeat(r,3,axis=1),
+                              rgbas=rgba,labels=labels,STATIC=STATIC)
+
+    def add_arrows_fr2to(self,p_frs,p_tos,r=0.01,rgbas=[0.5,0.5,0.5,0.5],STATIC=False):
+        """
+            Add arrows from 'p_frs' to 'p_tos' ([n x 3]) as in 'plot_arrow_fr2to'
+        """
+        p_frs = np.asarray(p_frs,dtype=np.float64).reshape((-1,3))
+        p_tos = np.asarray(p_tos,dtype=np.float64).reshape((-1,3))
+        sizes = np.zeros((p_frs.shape[0],3))
+        sizes[:,0:2] = r
+        sizes[:,2] = 2*np.linalg.norm(p_tos-p_frs,axis=1)
+        return self.add_batch(
+            types=mujoco.mjtGeom.mjGEOM_ARROW,poss=p_frs,sizes=sizes,
+            mats=get_rotation_matrices_from_two_points(p_frs=p_frs,p_tos=p_tos),rgbas=rgbas,STATIC=STATIC)
+
+    def write_to_scene(self,scn):
+        """
+            Write static and dynamic markers into 'scn.geoms' (after 'mjv_updateScene')
+        """
+        n_total = len(self)
+        if scn.ngeom+n_total > scn.maxgeom:
+            raise RuntimeError('Ran out of geoms. maxgeom: %d'%(scn.maxgeom))
+        for STATIC in [True,False]:
+            layer = self.layers[STATIC]
+            types,poss,mats,sizes,rgbas = \
+                layer['types'],layer['poss'],layer['mats'],layer['sizes'],layer['rgbas']
+            for m_idx in range(layer['n']):
+                g = scn.geoms[scn.ngeom]
+                mujoco.mjv_initGeom(g,int(types[m_idx]),sizes[m_idx],poss[m_idx],mats[m_idx],rgbas[m_idx])
+                g.category = mujoco.mjtCatBit.mjCAT_DECOR
+                label = layer['labels'].get(m_idx)
+                if label:
+                    g.label = label
+                scn.ngeom += 1
+
+class IKTaskClass(object):
+    """
+        IK task of a body or geom with preallocated Jacobian and error buffers
+        - mode is position (IK_P), rotation (IK_R), or both (rows are stacked as [p;R])
+        - calling the task fills the buffers in place with 'mj_jacBody' or 'mj_jacGeom' and returns views
+        - 'J_buf' and 'err_buf' can be views of a larger stack (see 'IKTaskStackClass')
+        ik_task = env.get_ik_task(name='tcp_link',type='body',IK_P=True,IK_R=True)
+        J,err = ik_task(p_trgt=p_trgt,R_trgt=R_trgt) # [6 x nv], [6]
+    """
+    def __init__(self,env,name,type='body',IK_P=True,IK_R=True,J_buf=None,err_buf=None):
+        """
+            Initialize IK task
+        """
+        self.env   = env
+        self.name  = name
+        self.type  = type
+        self.IK_P  = IK_P
+        self.IK_R  = IK_R
+        if type == 'body':
+            self.obj_id   = env.body_name2id[name]
+            self.jac_func = mujoco.mj_jacBody
+        elif type == 'geom':
+            self.obj_id   = env.geom_name2id[name]
+            self.jac_func = mujoco.mj_jacGeom
+        else:
+            raise ValueError("[IKTaskClass] unknown type:[%s] (use 'body' or 'geom')"%(type))
+        self.n_row = 3*IK_P + 3*IK_R
+        nv = env.model.nv
+        self.J   = np.zeros((self.n_row,nv)) if J_buf is None else J_buf
+        self.err = np.zeros(self.n_row) if err_buf is None else err_buf
+        if (self.J.shape != (self.n_row,nv)) or (self.err.shape != (self.n_row,)):
+            raise ValueError("[IKTaskClass] buffer shapes must be [%d x %d] and [%d]"%(self.n_row,nv,self.n_row))
+        # Row views of each part
+        self.J_p   = self.J[:3] if IK_P else None
+        self.J_R   = self.J[3*IK_P:3*IK_P+3] if IK_R else None
+        self.err_p = self.err[:3] if IK_P else None
+        self.err_w = self.err[3*IK_P:3*IK_P+3] if IK_R else None
+
+    def get_pR(self):
+        """
+            Current position and rotation (views of 'env.data')
+        """
+        data = self.env.data
+        if self.type == 'body':
+            return data.xpos[self.obj_id],data.xmat[self.obj_id].reshape((3,3))
+        return data.geom_xpos[self.obj_id],data.geom_xmat[self.obj_id].reshape((3,3))
+
+    def __call__(self,p_trgt=None,R_trgt=None):
+        """
+            Fill Jacobian and error in place (kinematics must be up-to-date)
+        """
+        if self.n_row == 0:
+            return None,None
+        self.jac_func(self.env.model,self.env.data,self.J_p,self.J_R,self.obj_id)
+        p_curr,R_curr = self.get_pR()
+        if self.IK_P:
+            np.subtract(p_trgt,p_curr,out=self.err_p)
+        if self.IK_R:
+            np.matmul(R_curr,r2w(R_curr.T@R_trgt),out=self.err_w) # R_curr^{-1} = R_curr^T
+        return self.J,self.err
+
+
+class IKTaskStackClass(object):
+    """
+        Multiple IK tasks stacked in one preallocated [m x nv] Jacobian and [m] error (m <= 6k)
+        ik_stack = IKTaskStackClass(env,ik_tasks=[{'name':'rfoot','type':'geom','IK_P':True,'IK_R':True},
+                                                  {'name':'lfoot','type':'geom','IK_P':True,'IK_R':False}])
+        J,err = ik_stack(p_trgts=[p_rfoot,p_lfoot],R_trgts=[R_rfoot,np.eye(3)])
+    """
+    def __init__(self,env,ik_tasks):
+        """
+            Initialize stacked IK tasks
+            ik_tasks: list of {'name':str,'type':'body' or 'geom','IK_P':bool,'IK_R':bool}
+        """
+        self.env       = env
+        self.task_rows = [] # start row of each task in the stacked Jacobian
+        n_row = 0
+        for ik_task in ik_tasks:
+            self.task_rows.append(n_row)
+            n_row = n_row + 3*ik_task.get('IK_P',True) + 3*ik_task.get('IK_R',True)
+        self.n_row = n_row
+        self.J     = np.zeros((self.n_row,env.model.nv))
+        self.err   = np.zeros(self.n_row)
+        self.tasks = []
+        for row,ik_task in zip(self.task_rows,ik_tasks):
+            IK_P,IK_R = ik_task.get('IK_P',True),ik_task.get('IK_R',True)
+            n = 3*IK_P + 3*IK_R
+            self.tasks.append(IKTaskClass(
+                env=env,name=ik_task['name'],type=ik_task.get('type','body'),IK_P=IK_P,IK_R=IK_R,
+                J_buf=self.J[row:row+n],err_buf=self.err[row:row+n]))
+        self.n_task = len(self.tasks)
+
+    def __call__(self,p_trgts,R_trgts):
+        """
+            Fill the stacked Jacobian and error in place
+        """
+        for t_idx,task in enumerate(self.tasks):
+            task(p_trgt=p_trgts[t_idx],R_trgt=R_trgts[t_idx])
+        return self.J,self.err
+
+
+class JointGroupClass(object):
+    """
+        Precompiled handle of a group of joints
+        qpos and qvel gather indices are computed once (free: 7/6, ball: 4/3, hinge and slide: 1/1 each)
+        so that reading and writing the group is a single fancy-index operation
+        group = env.get_joint_group(joint_names=['hip','knee'])
+        q = group.get_qpos()
+        env.forward(q=q,joint_idxs=group)
+    """
+    def __init__(self,env,joint_names):
+        """
+            Initialize joint group
+        """
+        self.env         = env
+        self.joint_names = list(joint_names)
+        self.joint_ids   = np.array([env.joint_name2id[x] for x in self.joint_names],dtype=np.int64)
+        def gather(adrs,sizes):
+            return np.concatenate([np.arange(adr,adr+size) for adr,size in zip(adrs,sizes)]
+                                  +[np.zeros(0,dtype=np.int64)]).astype(np.int64)
+        self.qpos_idxs   = gather(env.model.jnt_qposadr[self.joint_ids],env.joint_nqposs[self.joint_ids])
+        self.qvel_idxs   = gather(env.model.jnt_dofadr[self.joint_ids],env.joint_ndofs[self.joint_ids])
+        self.nq          = len(self.qpos_idxs)
+        self.nv          = len(self.qvel_idxs)
+        # Actuator of each joint (None if some joints are not actuated)
+        ctrl_idxs = [env.ctrl_joint_names.index(x) if x in env.ctrl_joint_names else -1
+                     for x in self.joint_names]
+        self.ctrl_idxs   = None if (-1 in ctrl_idxs) else np.array(ctrl_idxs,dtype=np.int64)
+        # Buffers for integrating multi-dof joints
+        self.qpos_buf    = np.zeros(env.model.nq)
+        self.dq_buf      = np.zeros(env.model.nv)
+
+    def get_qpos(self,out=None):
+        """
+            Get joint positions [nq]
+        """
+        return np.take(self.env.data.qpos,self.qpos_idxs,out=out)
+
+    def set_qpos(self,q):
+        """
+            Set joint positions (FK must be called after)
+        """
+        self.env.data.qpos[self.qpos_idxs] = q
+
+    def get_qvel(self,out=None):
+        """
+            Get joint velocities [nv]
+        """
+        return np.take(self.env.data.qvel,self.qvel_idxs,out=out)
+
+    def set_qvel(self,qvel):
+        """
+            Set joint velocities
+        """
+        self.env.data.qvel[self.qvel_idxs] = qvel
+
+    def get_ctrl_idxs(self):
+        """
+            Actuator indices for 'env.step(ctrl=ctrl,ctrl_idxs=group)'
+        """
+        if self.ctrl_idxs is None:
+            raise ValueError("[JointGroupClass] some of %s are not actuated"%(self.joint_names))
+        return self.ctrl_idxs
+
+    def integrate(self,q,dq,scale=1.0):
+        """
+            Integrate group positions 'q' [nq] with group velocities 'dq' [nv]
+            (quaternions of free and ball joints stay on the unit sphere)
+        """
+        if self.nq == self.nv:
+            return q + scale*dq
+        self.qpos_buf[:] = self.env.data.qpos
+        self.qpos_buf[self.qpos_idxs] = q
+        self.dq_buf[:] = 0.0
+        self.dq_buf[self.qvel_idxs] = dq
+        mujoco.mj_integratePos(self.env.model,self.qpos_buf,self.dq_buf,scale)
+        return self.qpos_buf[self.qpos_idxs]
+
+def create_gl_context(width,height,backends=('egl','osmesa')):
+    """
+        Create an OpenGL context for offscreen rendering
+        Backends are tried in order ('egl': GPU headless, 'osmesa': software, 'glfw': hidden window)
+    """
+    mujoco_gl = os.environ.get('MUJOCO_GL','').lower()
+    if mujoco_gl in ['egl','osmesa','glfw']: # user preference comes first
+        backends = [mujoco_gl] + [x for x in backends if x != mujoco_gl]
+    for backend in backends:
+        pyopengl_platform = os.environ.get('PYOPENGL_PLATFORM')
+        try:
+            if backend == 'egl':
+                from mujoco.egl import GLContext
+            elif backend == 'osmesa':
+                from mujoco.osmesa import GLContext
+            elif backend == 'glfw':
+                from mujoco.glfw import GLContext
+            else:
+                raise ValueError("Unknown backend:[%s]"%(backend))
+            gl_context = GLContext(width,height)
+            gl_context.make_current()
+            return backend,gl_context
+        except Exception as e:
+            print ("[create_gl_context] backend:[%s] failed. %s"%(backend,e))
+            # Restore 'PYOPENGL_PLATFORM' so that the next backend can be imported
+            if pyopengl_platform is None:
+                os.environ.pop('PYOPENGL_PLATFORM',None)
+            else:
+                os.environ['PYOPENGL_PLATFORM'] = pyopengl_platform
+    raise RuntimeError("[create_gl_context] No available backend among %s"%(list(backends)))
+
+class MuJoCoWindowViewerClass(mujoco_viewer.MujocoViewer):
+    """
+        Windowed viewer that also writes 'MarkerBatchClass' markers into the scene
+        'MujocoViewer.render' rebuilds 'scn' with 'mjv_updateScene' (which resets 'scn.ngeom') and calls
+        '_add_marker_to_scene' for each queued marker right before 'mjr_render', so that hook is the only
+        point where a batch can be written into 'scn.geoms' without one 'add_marker' dict per geom
+        ('MuJoCoParserClass.render' queues the batch as a single {'marker_batch':...} marker)
+    """
+    def _add_marker_to_scene(self,marker):
+        """
+            Write a marker batch or fall back to a single marker
+        """
+        if 'marker_batch' in marker:
+            marker['marker_batch'].write_to_scene(self.scn)
+        else:
+            super()._add_marker_to_scene(marker)
+
+class MuJoCoOffscreenViewerClass(object):
+    """
+        Headless offscreen viewer (same interface as 'mujoco_viewer.MujocoViewer')
+        Rendered pixels are read into persistent buffers and handed out as views
+    """
+    def __init__(self,model,data,width=1200,height=800,backends=('egl','osmesa'),
+                 FONTSCALE_VALUE=mujoco.mjtFontScale.mjFONTSCALE_100.value,maxgeom=10000):
+        """
+            Initialize offscreen viewer
+        """
+        self.model    = model
+        self.data     = data
+        self.width    = width
+        self.height   = height
+        self.is_alive = True
+        self._paused  = False
+        self._markers = []
+        # Offscreen buffer should be large enough
+        self.model.vis.global_.offwidth  = max(self.model.vis.global_.offwidth,self.width)
+        self.model.vis.global_.offheight = max(self.model.vis.global_.offheight,self.height)
+        # OpenGL context
+        self.backend,self.gl_context = create_gl_context(self.width,self.height,backends=backends)
+        # Scene, camera, and options
+        self.scn      = mujoco.MjvScene(self.model,maxgeom=maxgeom)
+        self.cam      = mujoco.MjvCamera()
+        self.vopt     = mujoco.MjvOption()
+        self.pert     = mujoco.MjvPerturb()
+        self.viewport = mujoco.MjrRect(0,0,self.width,self.height)
+        mujoco.mjv_defaultFreeCamera(self.model,self.cam)
+        self.ctx      = mujoco.MjrContext(self.model,FONTSCALE_VALUE)
+        # Persistent pixel buffers
+        self.rgb_buf   = np.zeros((self.height,self.width,3),dtype=np.uint8)
+        self.depth_buf = np.zeros((self.height,self.width),dtype=np.float32)
+
+    @property
+    def ctx(self):
+        return self._ctx
+
+    @ctx.setter
+    def ctx(self,ctx):
+        """
+            (Re)set rendering context (e.g., font scale change) and bind the offscreen buffer
+        """
+        self.gl_context.make_current()
+        self._ctx = ctx
+        mujoco.mjr_setBuffer(mujoco.mjtFramebuffer.mjFB_OFFSCREEN,self._ctx)
+
+    def add_marker(self,**marker_params):
+        """
+            Add marker to be rendered in the next 'render()'
+        """
+        self._markers.append(marker_params)
+
+    def _add_marker_to_scene(self,marker):
+        """
+            Add marker geom to the scene
+        """
+        if 'marker_batch' in marker:
+            marker['marker_batch'].write_to_scene(self.scn)
+            return
+        if self.scn.ngeom >= self.scn.maxgeom:
+            raise RuntimeError('Ran out of geoms. maxgeom: %d'%(self.scn.maxgeom))
+        size = np.zeros(3)
+        size[:] = marker.get('size',0.1) # scalar size (e.g., line) is broadcasted
+        g = self.scn.geoms[self.scn.ngeom]
+        mujoco.mjv_initGeom(
+            g,
+            marker.get('type',mujoco.mjtGeom.mjGEOM_BOX),
+            size,
+            np.asarray(marker.get('pos',np.zeros(3)),dtype=np.float64).ravel(),
+            np.asarray(marker.get('mat',np.eye(3)),dtype=np.float64).ravel(),
+            np.asarray(marker.get('rgba',np.ones(4)),dtype=np.float32).ravel())
+        g.category = mujoco.mjtCatBit.mjCAT_DECOR
+        label = marker.get('label','')
+        if label:
+            g.label = label
+        self.scn.ngeom += 1
+
+    def render(self):
+        """
+            Render the scene with markers into the offscreen buffer
+        """
+        self.gl_context.make_current()
+        mujoco.mjv_updateScene(
+            self.model,self.data,self.vopt,self.pert,self.cam,
+            mujoco.mjtCatBit.mjCAT_ALL.value,self.scn)
+        for marker in self._markers:
+            self._add_marker_to_scene(marker)
+        mujoco.mjr_render(self.viewport,self.scn,self.ctx)
+        self._markers[:] = []
+
+    def read_pixels(self,depth=False):
+        """
+            Read the rendered pixels into persistent buffers
+            Returns (flipped) views that are overwritten by the next call
+        """
+        self.gl_context.make_current()
+        mujoco.mjr_readPixels(self.rgb_buf,self.depth_buf if depth else None,self.viewport,self.ctx)
+        if depth:
+            return self.rgb_buf[::-1],self.depth_buf[::-1]
+        return self.rgb_buf[::-1]
+
+    def close(self):
+        """
+            Free the rendering context
+        """
+        self.is_alive = False
+        if self.gl_context is not None:
+            self.gl_context.free()
+            self.gl_context = None
+
+
+class MuJoCoMultiCameraClass(object):
+    """
+        Synchronized offscreen capture from several named cameras
+        - camera types: 'free' (azimuth/distance/elevation/lookat), 'fixed' (camera in the model),
+          'tracking' (follows a body), 'ego' (attached to a body with an offset and a view direction)
+        - the scene is built once per capture ('mjv_updateScene') and only the camera is updated
+          for the other cameras ('mjv_updateCamera')
+        - RGB, depth, and point clouds of all cameras are returned as stacked arrays
+        cams = env.init_multi_camera(width=320,height=240)
+        cams.add_camera('top',cam_type='free',azimuth=0,distance=4,elevation=-89,lookat=[0,0,0])
+        cams.add_camera('head',cam_type='ego',body_name='head',p_offset=[0.1,0,0])
+        res = cams.capture(PCD=True,stride=4) # res['rgb']: [n_cam x H x W x 3]
+    """
+    def __init__(self,model,data,width=320,height=240,backends=('egl','osmesa'),maxgeom=10000):
+        """
+            Initialize multi-camera capture
+        """
+        self.model  = model
+        self.data   = data
+        self.width  = width
+        self.height = height
+        self.model.vis.global_.offwidth  = max(self.model.vis.global_.offwidth,self.width)
+        self.model.vis.global_.offheight = max(self.model.vis.global_.offheight,self.height)
+        self.backend,self.gl_context = create_gl_context(self.width,self.height,backends=backends)
+        self.scn      = mujoco.MjvScene(self.model,maxgeom=maxgeom)
+        self.vopt     = mujoco.MjvOption()
+        self.pert     = mujoco.MjvPerturb()
+        self.viewport = mujoco.MjrRect(0,0,self.width,self.height)
+        self.ctx      = mujoco.MjrContext(self.model,mujoco.mjtFontScale.mjFONTSCALE_100.value)
+        mujoco.mjr_setBuffer(mujoco.mjtFramebuffer.mjFB_OFFSCREEN,self.ctx)
+        self.cameras  = [] # list of dictionaries (in the order of the stacked outputs)
+        self.cam_names = []
+        self._alloc()
+
+    def _alloc(self):
+        """
+            (Re)allocate stacked buffers for the registered cameras
+        """
+        n_cam = len(self.cameras)
+        self.rgb_buf   = np.zeros((n_cam,self.height,self.width,3),dtype=np.uint8)
+        self.depth_buf = np.zeros((n_cam,self.height,self.width),dtype=np.float32)
+        self.T_cams    = np.tile(np.eye(4),(n_cam,1,1))
+        self.pcd_bufs  = {}
+
+    def add_camera(self,name,cam_type='free',azimuth=90,distance=3.0,elevation=-30,lookat=[0,0,0],
+                   cam_name=None,body_name=None,p_offset=[0,0,0],d_view=[1,0,0]):
+        """
+            Register a camera
+            - 'free': azimuth, distance, elevation, lookat
+            - 'fixed': 'cam_name' of a camera in the model
+            - 'tracking': follows 'body_name' with azimuth, distance, and elevation
+            - 'ego': placed at 'p_offset' in the frame of 'body_name' looking along 'd_view' (body frame)
+        """
+        if name in self.cam_names:
+            raise ValueError("[MuJoCoMultiCameraClass] camera [%s] already exists"%(name))
+        cam = mujoco.MjvCamera()
+        mujoco.mjv_defaultFreeCamera(self.model,cam)
+        fovy = self.model.vis.global_.fovy
+        if cam_type in ['free','ego']:
+            cam.type = mujoco.mjtCamera.mjCAMERA_FREE
+        elif cam_type == 'fixed':
+            cam.type = mujoco.mjtCamera.mjCAMERA_FIXED
+            cam.fixedcamid = mujoco.mj_name2id(self.model,mujoco.mjtObj.mjOBJ_CAMERA,cam_name)
+            if cam.fixedcamid < 0:
+                raise ValueError("[MuJoCoMultiCameraClass] unknown model camera [%s]"%(cam_name))
+            fovy = self.model.cam_fovy[cam.fixedcamid]
+        elif cam_type == 'tracking':
+            cam.type = mujoco.mjtCamera.mjCAMERA_TRACKING
+            cam.trackbodyid = mujoco.mj_name2id(self.model,mujoco.mjtObj.mjOBJ_BODY,body_name)
+        else:
+            raise ValueError("[MuJoCoMultiCameraClass] unknown camera type [%s]"%(cam_type))
+        cam.azimuth,cam.distance,cam.elevation = azimuth,distance,elevation
+        cam.lookat[:] = lookat
+        camera = {'name':name,'type':cam_type,'cam':cam,'fovy':float(fovy),
+                  'body_id':mujoco.mj_name2id(self.model,mujoco.mjtObj.mjOBJ_BODY,body_name) if body_name else -1,
+                  'p_offset':np.asarray(p_offset,dtype=np.float64),'d_view':np.asarray(d_view,dtype=np.float64)}
+        self.cameras.append(camera)
+        self.cam_names.append(name)
+        self._alloc()
+        return camera
+
+    def set_camera_view(self,name,azimuth=None,distance=None,elevation=None,lookat=None,
+                        p_ego=None,p_trgt=None):
+        """
+            Update the view of a 'free' camera (or place it at 'p_ego' looking at 'p_trgt')
+        """
+        cam = self.cameras[self.cam_names.index(name)]['cam']
+        if (p_ego is not None) and (p_trgt is not None):
+            azimuth,distance,elevation,lookat = compute_view_params(
+                camera_pos=p_ego,target_pos=p_trgt,up_vector=np.array([0,0,1]))
+        if azimuth is not None: cam.azimuth = azimuth
+        if distance is not None: cam.distance = distance
+        if elevation is not None: cam.elevation = elevation
+        if lookat is not None: cam.lookat[:] = lookat
+
+    def _update_ego_camera(self,camera):
+        """
+            Place an egocentric camera on its body
+        """
+        p_body = self.data.xpos[camera['body_id']]
+        R_body = self.data.xmat[camera['body_id']].reshape((3,3))
+        p_ego  = p_body + R_body@camera['p_offset']
+        p_trgt = p_ego + R_body@camera['d_view']
+        azimuth,distance,elevation,lookat = compute_view_params(
+            camera_pos=p_ego,target_pos=p_trgt,up_vector=np.array([0,0,1]))
+        cam = camera['cam']
+        cam.azimuth,cam.distance,cam.elevation = azimuth,distance,elevation
+        cam.lookat[:] = lookat
+
+    def _get_T_cam(self,c_idx):
+        """
+            Camera pose from the OpenGL camera of the scene (x: forward, y: left, z: up)
+        """
+        gl_cam  = mujoco.mjv_averageCamera(self.scn.camera[0],self.scn.camera[1]) # mono rendering uses the average
+        forward = np.asarray(gl_cam.forward,dtype=np.float64)
+        up      = np.asarray(gl_cam.up,dtype=np.float64)
+        self.T_cams[c_idx,:3,0] = forward
+        self.T_cams[c_idx,:3,1] = np.cross(up,forward)
+        self.T_cams[c_idx,:3,2] = up
+        self.T_cams[c_idx,:3,3] = gl_cam.pos
+
+    def capture(self,RGB=True,DEPTH=True,PCD=False,stride=1,dtype=np.float64):
+        """
+            Render all cameras from one scene update
+            Returns a dictionary with 'names', 'rgb' [n x H x W x 3], 'depth' [n x H x W] (meters),
+            'T_cams' [n x 4 x 4], and 'pcd' [n x N x 3] (world frame) when PCD is True
+            (arrays are views of persistent buffers which are overwritten by the next capture)
+        """
+        n_cam = len(self.cameras)
+        self.gl_context.make_current()
+        DEPTH = DEPTH or PCD
+        for c_idx,camera in enumerate(self.cameras):
+            if camera['type'] == 'ego':
+                self._update_ego_camera(camera)
+            if c_idx == 0:
+                mujoco.mjv_updateScene(
+                    self.model,self.data,self.vopt,self.pert,camera['cam'],
+                    mujoco.mjtCatBit.mjCAT_ALL.value,self.scn)
+            else:
+                mujoco.mjv_updateCamera(self.model,self.data,camera['cam'],self.scn)
+            mujoco.mjr_render(self.viewport,self.scn,self.ctx)
+            mujoco.mjr_readPixels(self.rgb_buf[c_idx] if RGB else None,
+                                  self.depth_buf[c_idx] if DEPTH else None,self.viewport,self.ctx)
+            self._get_T_cam(c_idx)
+        res = {'names':self.cam_names,'T_cams':self.T_cams}
+        if RGB:
+            res['rgb'] = self.rgb_buf[:,::-1]
+        if DEPTH:
+            # Rescale depth image (in place)
+            extent = self.model.stat.extent
+            near   = self.model.vis.map.znear * extent
+            far    = self.model.vis.map.zfar * extent
+            depth  = self.depth_buf
+            np.multiply(depth,-(1-near/far),out=depth)
+            depth += 1
+            np.divide(near,depth,out=depth)
+            res['depth'] = depth[:,::-1]
+        if PCD:
+            key = (stride,np.dtype(dtype).str)
+            if key not in self.pcd_bufs: # cached rays per camera and a stacked output buffer
+                projs = [CameraProjectionClass(height=self.height,width=self.width,fovy=camera['fovy'],
+                                               stride=stride,dtype=dtype) for camera in self.cameras]
+                self.pcd_bufs[key] = {
+                    'projs':projs,'pcd':np.zeros((n_cam,projs[0].h*projs[0].w,3),dtype=dtype)}
+            pcd_buf = self.pcd_bufs[key]
+            for c_idx,proj in enumerate(pcd_buf['projs']):
+                pcd,_ = proj.depth_to_pcd(res['depth'][c_idx],
+                                          p_cam=self.T_cams[c_idx,:3,3],R_cam=self.T_cams[c_idx,:3,:3])
+                pcd_buf['pcd'][c_idx] = pcd
+            res['pcd'] = pcd_buf['pcd']
+        return res
+
+    def close(self):
+        """
+            Free the rendering context
+        """
+        if self.gl_context is not None:
+            self.gl_context.free()
+            self.gl_context = None
+
+
+class MuJoCoVecEnvClass(object):
+    """
+        Vectorized MuJoCo environment
+        N MjData instances share a single MjModel and are advanced by a thread pool
+        (mj_step and mj_forward release the GIL)
+    """
+    def __init__(self,env=None,rel_xml_path=None,n_env=8,n_thread=None,name='VecEnv',VERBOSE=True):
+        """
+            Initialize vectorized environment from a 'MuJoCoParserClass' or an xml path
+        """
+        if env is None:
+            env = MuJoCoParserClass(name=name,rel_xml_path=rel_xml_path,VERBOSE=False)
+        self.env      = env
+        self.name     = name
+        self.model    = env.model
+        self.n_env    = n_env
+        self.n_thread = min(n_env,os.cpu_count() or 1) if n_thread is None else n_thread
+        self.VERBOSE  = VERBOSE
+        self.datas    = [mujoco.MjData(self.model) for _ in range(self.n_env)]
+        # Contiguous chunks of environment indices (one per thread)
+        self.env_chunks = [chunk for chunk in np.array_split(np.arange(self.n_env),self.n_thread)
+                           if len(chunk) > 0]
+        self.pool     = ThreadPoolExecutor(max_workers=self.n_thread)
+        self.tick     = 0
+        self.reset()
+        if self.VERBOSE:
+            print ("[%s] n_env:[%d] n_thread:[%d]"%(self.name,self.n_env,self.n_thread))
+
+    def _run(self,func):
+        """
+            Run 'func(env_idx)' over all environments using the thread pool
+        """
+        def run_chunk(chunk):
+            for env_idx in chunk:
+                func(env_idx)
+        if self.n_thread == 1:
+            run_chunk(np.arange(self.n_env))
+        else:
+            list(self.pool.map(run_chunk,self.env_chunks))
+
+    def reset(self,qpos=None):
+        """
+            Reset all environments
+        """
+        def reset_env(env_idx):
+            data = self.datas[env_idx]
+            mujoco.mj_resetData(self.model,data)
+            data.qpos[:] = self.model.qpos0 if qpos is None else qpos[env_idx]
+            mujoco.mj_forward(self.model,data)
+        self._run(reset_env)
+        self.tick = 0
+
+    def step(self,ctrl=None,ctrl_idxs=None,nstep=1,INCREASE_TICK=True):
+        """
+            Forward dynamics of all environments
+            ctrl: [N x nu] (or [N x len(ctrl_idxs)])
+        """
+        def step_env(env_idx):
+            data = self.datas[env_idx]
+            if ctrl is not None:
+                if ctrl_idxs is None:
+                    data.ctrl[:] = ctrl[env_idx]
+                else:
+                    data.ctrl[ctrl_idxs] = ctrl[env_idx]
+            mujoco.mj_step(self.model,data,nstep=nstep)
+        self._run(step_env)
+        if INCREASE_TICK:
+            self.tick = self.tick + 1
+
+    def forward(self,q=None,joint_idxs=None,INCREASE_TICK=True):
+        """
+            Forward kinematics of all environments
+            q: [N x nq] (or [N x len(joint_idxs)])
+        """
+        def forward_env(env_idx):
+            data = self.datas[env_idx]
+            if q is not None:
+                if joint_idxs is None:
+                    data.qpos[:] = q[env_idx]
+                else:
+                    data.qpos[joint_idxs] = q[env_idx]
+            mujoco.mj_forward(self.model,data)
+        self._run(forward_env)
+        if INCREASE_TICK:
+            self.tick = self.tick + 1
+
+    def get_q(self,joint_idxs=None):
+        """
+            Get joint positions of all environments [N x nq]
+        """
+        if joint_idxs is None:
+            return np.stack([data.qpos for data in self.datas])
+        return np.stack([data.qpos[joint_idxs] for data in self.datas])
+
+    def get_qvel(self,joint_idxs=None):
+        """
+            Get joint velocities of all environments [N x nv]
+        """
+        if joint_idxs is None:
+            return np.stack([data.qvel for data in self.datas])
+        return np.stack([data.qvel[joint_idxs] for data in self.datas])
+
+    def get_sim_time(self):
+        """
+            Get simulation times of all environments [N]
+        """
+        return np.array([data.time for data in self.datas])
+
+    def get_p_body(self,body_name):
+        """
+            Get body positions of all environments [N x 3]
+        """
+        body_id = self.env.body_name2id[body_name]
+        return np.stack([data.xpos[body_id] for data in self.datas])
+
+    def get_R_body(self,body_name):
+        """
+            Get body rotation matrices of all environments [N x 3 x 3]
+        """
+        body_id = self.env.body_name2id[body_name]
+        return np.stack([data.xmat[body_id] for data in self.datas]).reshape((-1,3,3))
+
+    def get_pR_body(self,body_name):
+        """
+            Get body positions [N x 3] and rotation matrices [N x 3 x 3]
+        """
+        p = self.get_p_body(body_name)
+        R = self.get_R_body(body_name)
+        return p,R
+
+    def close(self):
+        """
+            Shutdown the thread pool
+        """
+        self.pool.shutdown(wait=True)
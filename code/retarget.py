@@ -0,0 +1,196 @@
+import os,json
+import numpy as np
+
+RETARGET_SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','asset','retarget')
+
+class RetargetRigClass(object):
+    """
+        Table-driven analytic retargeting of source keypoints to a target rig
+        - a rig is a list of bones in topological order, each bone is
+          (name, target, parent bone index (-1: root), source 'fr' and 'to' indices, length)
+        - the unit vector of a bone is the direction of p[to]-p[fr]
+          (if 'fr' is -1, v[to] of a separate direction array is used instead)
+        - the target of a bone is its parent's target (or p[root]) plus length times its unit vector
+          which, with the ancestor matrix A (A[b,a]=1 if a is b or an ancestor of b), is
+          p_targets = p[root] + A @ (lengths * uvs) for every frame at once
+        rig = load_retarget_rig('em') # or a path to a spec file (a new rig on every call)
+        rig.set_lengths_from_env(env) # (optional) measure bone lengths from the model (this rig only)
+        p_targets = rig.get_targets(p_clip) # [L x J x 3] => [L x B x 3]
+    """
+    def __init__(self,bone_names,target_names,parent_idxs,fr_idxs,to_idxs,lengths,
+                 root_idx=0,root_body=None,name='Rig'):
+        """
+            Initialize rig
+        """
+        self.name         = name
+        self.bone_names   = list(bone_names)
+        self.target_names = list(target_names)
+        self.parent_idxs  = np.asarray(parent_idxs,dtype=np.int64)
+        self.fr_idxs      = np.asarray(fr_idxs,dtype=np.int64)
+        self.to_idxs      = np.asarray(to_idxs,dtype=np.int64)
+        self.lengths      = np.asarray(lengths,dtype=np.float64).copy()
+        self.root_idx     = root_idx
+        self.root_body    = root_body
+        self.n_bone       = len(self.bone_names)
+        if np.any(self.parent_idxs >= np.arange(self.n_bone)):
+            raise ValueError("[%s] bones must be in topological order (parent before child)"%(self.name))
+        self.target_name2idx = {name:idx for idx,name in enumerate(self.target_names)}
+        # Ancestor matrix (bone itself included)
+        self.ancestors = np.zeros((self.n_bone,self.n_bone))
+        for b_idx in range(self.n_bone):
+            self.ancestors[b_idx] = self.ancestors[self.parent_idxs[b_idx]] if self.parent_idxs[b_idx] >= 0 else 0
+            self.ancestors[b_idx,b_idx] = 1.0
+        # Bones whose direction comes from a direction array
+        self.vec_mask = self.fr_idxs < 0
+
+    def get_uvs(self,p=None,v=None):
+        """
+            Unit vectors of bones from keypoints 'p' ([L x J x 3] or [J x 3]) and/or directions 'v'
+        """
+        src = p if p is not None else v
+        uvs = np.zeros(np.shape(src)[:-2]+(self.n_bone,3))
+        pos_mask = ~self.vec_mask
+        if pos_mask.any():
+            p = np.asarray(p)
+            uvs[...,pos_mask,:] = p[...,self.to_idxs[pos_mask],:] - p[...,self.fr_idxs[pos_mask],:]
+        if self.vec_mask.any():
+            uvs[...,self.vec_mask,:] = np.asarray(v)[...,self.to_idxs[self.vec_mask],:]
+        uvs /= np.linalg.norm(uvs,axis=-1,keepdims=True)
+        return uvs
+
+    def get_targets(self,p,v=None,uvs=None):
+        """
+            Chained target positions [L x B x 3] (or [B x 3]) in a single matrix product
+        """
+        if uvs is None:
+            uvs = self.get_uvs(p=p,v=v)
+        p = np.asarray(p)
+        return p[...,self.root_idx:self.root_idx+1,:] + \
+            np.matmul(self.ancestors,self.lengths[:,None]*uvs)
+
+    def get_uv_dict(self,p=None,v=None):
+        """
+            Unit vectors of a single frame as {bone name: uv}
+        """
+        uvs = self.get_uvs(p=p,v=v)
+        return {name:uvs[b_idx] for b_idx,name in enumerate(self.bone_names)}
+
+    def get_p_target_dict(self,p,uv_dict):
+        """
+            Targets of a single frame as {target name: position} from {bone name: uv}
+        """
+        uvs = np.array([uv_dict[name] for name in self.bone_names])
+        p_targets = self.get_targets(p,uvs=uvs)
+        return {name:p_targets[b_idx] for b_idx,name in enumerate(self.target_names)}
+
+    def get_target_idxs(self,target_names):
+        """
+            Bone indices of 'target_names' (e.g., to select IK targets)
+        """
+        return [self.target_name2idx[name] for name in target_names]
+
+    def get_bone_lengths_from_env(self,env,root_body=None):
+        """
+            Bone lengths measured from the current pose of a 'MuJoCoParserClass' model
+            (distance between the body of each target and the body of its parent target or 'root_body')
+            NaN for bones whose bodies do not exist in the model
+        """
+        if root_body is None: root_body = self.root_body
+        lengths = np.full(self.n_bone,np.nan)
+        for b_idx,target_name in enumerate(self.target_names):
+            parent_idx = self.parent_idxs[b_idx]
+            parent_body = root_body if parent_idx < 0 else self.target_names[parent_idx]
+            if (target_name not in env.body_names) or (parent_body not in env.body_names): continue
+            lengths[b_idx] = np.linalg.norm(
+                env.data.xpos[env.body_name2id[target_name]]-env.data.xpos[env.body_name2id[parent_body]])
+        return lengths
+
+    def set_lengths_from_env(self,env,root_body=None,VERBOSE=True):
+        """
+            Overwrite bone lengths with those measured from 'env' (missing bodies keep their lengths)
+        """
+        lengths = self.get_bone_lengths_from_env(env,root_body=root_body)
+        measured = ~np.isnan(lengths)
+        self.lengths[measured] = lengths[measured]
+        if VERBOSE and (~measured).any():
+            print ("[%s] lengths of %s are not measured"%
+                   (self.name,[self.bone_names[b_idx] for b_idx in np.where(~measured)[0]]))
+        return self.lengths
+
+    def to_spec(self):
+        """
+            Rig spec dictionary (see 'load_retarget_rig')
+        """
+        bones = []
+        for b_idx in range(self.n_bone):
+            parent_idx = self.parent_idxs[b_idx]
+            bones.append({
+                'name':self.bone_names[b_idx],'target':self.target_names[b_idx],
+                'parent':None if parent_idx < 0 else self.target_names[parent_idx],
+                'fr':None if self.fr_idxs[b_idx] < 0 else int(self.fr_idxs[b_idx]),
+                'to':int(self.to_idxs[b_idx]),'length':float(self.lengths[b_idx])})
+        return {'name':self.name,'root':self.root_idx,'root_body':self.root_body,'bones':bones}
+
+def get_retarget_rig_from_spec(spec):
+    """
+        Rig from a spec dictionary
+        {'name':str,'root':int,'root_body':str or None,
+         'bones':[{'name':str,'target':str,'parent':target name or None,'fr':int or None,'to':int,'length':float}]}
+        Bones may be listed in any order as long as parents exist; they are sorted topologically
+    """
+    bones = spec['bones']
+    target2bone = {bone['target']:bone for bone in bones}
+    order,visited = [],set()
+    def visit(bone,path=()):
+        if bone['target'] in visited: return
+        if bone['target'] in path:
+            raise ValueError("[%s] cyclic bone [%s]"%(spec.get('name','Rig'),bone['target']))
+        if bone.get('parent') is not None:
+            visit(target2bone[bone['parent']],path+(bone['target'],))
+        visited.add(bone['target'])
+        order.append(bone)
+    for bone in bones:
+        visit(bone)
+    target_names = [bone['target'] for bone in order]
+    return RetargetRigClass(
+        bone_names   = [bone['name'] for bone in order],
+        target_names = target_names,
+        parent_idxs  = [-1 if bone.get('parent') is None else target_names.index(bone['parent'])
+                        for bone in order],
+        fr_idxs      = [-1 if bone.get('fr') is None else bone['fr'] for bone in order],
+        to_idxs      = [bone['to'] for bone in order],
+        lengths      = [bone.get('length',np.nan) for bone in order],
+        root_idx     = spec.get('root',0),
+        root_body    = spec.get('root_body'),
+        name         = spec.get('name','Rig'))
+
+_retarget_spec_cache = {}
+
+def load_retarget_rig(spec_path,CACHE=True):
+    """
+        Load a rig from a json spec file or a built-in spec name ('em','smpl','smpl_cmu','myohuman')
+        Every call returns a new rig (its lengths can be modified freely)
+        'CACHE': reuse the parsed spec instead of reading the file again
+    """
+    if not spec_path.endswith('.json'):
+        spec_path = os.path.join(RETARGET_SPEC_DIR,spec_path+'.json')
+    spec_path = os.path.abspath(spec_path)
+    spec = _retarget_spec_cache.get(spec_path) if CACHE else None
+    if spec is None:
+        with open(spec_path,'r') as f:
+            spec = json.load(f)
+        if CACHE:
+            _retarget_spec_cache[spec_path] = spec
+    return get_retarget_rig_from_spec(spec)
+
+def save_retarget_rig(rig,spec_path):
+    """
+        Save a rig as a json spec file
+    """
+    spec  = rig.to_spec()
+    bones = spec.pop('bones')
+    lines = ['{'] + ['    %s: %s,'%(json.dumps(key),json.dumps(val)) for key,val in spec.items()] + ['    "bones": [']
+    lines = lines + ['        '+json.dumps(bone)+(',' if b_idx < len(bones)-1 else '') for b_idx,bone in enumerate(bones)]
+    lines = lines + ['    ]','}']
+    with open(spec_path,'w') as f:
+        f.write('\n'.join(lines)+'\n')
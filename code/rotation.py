@@ -0,0 +1,291 @@
+"""
+    Batched rotation conversions with NumPy and torch backends
+    - every function accepts arrays with arbitrary leading dimensions ([...,3,3], [...,4], [...,3], [...,6])
+      and returns the same type (numpy in, numpy out; torch in, torch out with dtype, device, and autograd kept)
+    - quaternions are [w,x,y,z] (MuJoCo convention) and 'r2quat' returns w >= 0
+    - rpy is [roll,pitch,yaw] with R = Rz(yaw) @ Ry(pitch) @ Rx(roll)
+    - axis-angle 'w' is the rotation vector (unit axis times angle in radian)
+    - 6D is the first two columns of R ([...,6] = [R[...,:,0],R[...,:,1]])
+"""
+
+import numpy as np
+import torch
+
+EPS = 1e-8
+
+def _xp(x):
+    """
+        Backend module of 'x'
+    """
+    return torch if torch.is_tensor(x) else np
+
+def _asarray(x):
+    """
+        Keep torch tensors and convert anything else to a float64 numpy array
+    """
+    return x if torch.is_tensor(x) else np.asarray(x,dtype=np.float64)
+
+def _atan2(y,x):
+    return torch.atan2(y,x) if torch.is_tensor(y) else np.arctan2(y,x)
+
+def _cat(xs):
+    return torch.cat(xs,-1) if torch.is_tensor(xs[0]) else np.concatenate(xs,-1)
+
+def _eye3(like):
+    return torch.eye(3,dtype=like.dtype,device=like.device) if torch.is_tensor(like) else np.eye(3,dtype=like.dtype)
+
+def _onehot(idxs,n,like):
+    """
+        One-hot [...,n] of integer indices [...] with the dtype (and device) of 'like'
+    """
+    if torch.is_tensor(like):
+        return (idxs[...,None] == torch.arange(n,device=like.device)).to(like.dtype)
+    return (idxs[...,None] == np.arange(n)).astype(like.dtype)
+
+def _norm(x):
+    """
+        Norm over the last axis (keeps the axis)
+    """
+    return _xp(x).sqrt((x*x).sum(-1))[...,None]
+
+def _cross(a,b):
+    xp = _xp(a)
+    return xp.stack([a[...,1]*b[...,2]-a[...,2]*b[...,1],
+                     a[...,2]*b[...,0]-a[...,0]*b[...,2],
+                     a[...,0]*b[...,1]-a[...,1]*b[...,0]],-1)
+
+def _matrix(rows):
+    """
+        [...,3,3] matrix from a 3 x 3 nested list of [...] arrays
+    """
+    xp = _xp(rows[0][0])
+    return xp.stack([xp.stack(row,-1) for row in rows],-2)
+
+def skew(w):
+    """
+        Skew-symmetric matrices [...,3,3] of [...,3] vectors
+    """
+    w = _asarray(w)
+    z = _xp(w).zeros_like(w[...,0])
+    return _matrix([[z,-w[...,2],w[...,1]],[w[...,2],z,-w[...,0]],[-w[...,1],w[...,0],z]])
+
+def rpy2r(rpy):
+    """
+        Roll, pitch, and yaw [...,3] in radian to R [...,3,3]
+    """
+    rpy = _asarray(rpy)
+    xp = _xp(rpy)
+    Cphi,Sphi = xp.cos(rpy[...,0]),xp.sin(rpy[...,0])
+    Cthe,Sthe = xp.cos(rpy[...,1]),xp.sin(rpy[...,1])
+    Cpsi,Spsi = xp.cos(rpy[...,2]),xp.sin(rpy[...,2])
+    return _matrix([
+        [Cpsi*Cthe, -Spsi*Cphi+Cpsi*Sthe*Sphi, Spsi*Sphi+Cpsi*Sthe*Cphi],
+        [Spsi*Cthe, Cpsi*Cphi+Spsi*Sthe*Sphi, -Cpsi*Sphi+Spsi*Sthe*Cphi],
+        [-Sthe, Cthe*Sphi, Cthe*Cphi]])
+
+def euler2r(angles,order=(0,1,2)):
+    """
+        Product of elementary rotations about x (0), y (1), and z (2) by angles [...,3] in 'order'
+        (e.g., order=(0,1,2) is Rx(angles[0]) @ Ry(angles[1]) @ Rz(angles[2]))
+    """
+    angles = _asarray(angles)
+    xp = _xp(angles)
+    c,s = xp.cos(angles),xp.sin(angles)
+    o,z = xp.ones_like(angles[...,0]),xp.zeros_like(angles[...,0])
+    Rs = [_matrix([[o,z,z],[z,c[...,0],-s[...,0]],[z,s[...,0],c[...,0]]]),
+          _matrix([[c[...,1],z,s[...,1]],[z,o,z],[-s[...,1],z,c[...,1]]]),
+          _matrix([[c[...,2],-s[...,2],z],[s[...,2],c[...,2],z],[z,z,o]])]
+    return Rs[order[0]]@Rs[order[1]]@Rs[order[2]]
+
+def r2rpy(R):
+    """
+        R [...,3,3] to roll, pitch, and yaw [...,3] in radian
+    """
+    R = _asarray(R)
+    xp = _xp(R)
+    roll  = _atan2(R[...,2,1],R[...,2,2])
+    pitch = _atan2(-R[...,2,0],xp.sqrt(R[...,2,1]**2+R[...,2,2]**2))
+    yaw   = _atan2(R[...,1,0],R[...,0,0])
+    return xp.stack([roll,pitch,yaw],-1)
+
+def quat2r(q):
+    """
+        Quaternion [...,4] (w,x,y,z, normalized internally) to R [...,3,3]
+    """
+    q = _asarray(q)
+    q = q/_norm(q)
+    w,x,y,z = q[...,0],q[...,1],q[...,2],q[...,3]
+    return _matrix([
+        [w*w+x*x-y*y-z*z, 2*(x*y-w*z), 2*(x*z+w*y)],
+        [2*(x*y+w*z), w*w-x*x+y*y-z*z, 2*(y*z-w*x)],
+        [2*(x*z-w*y), 2*(y*z+w*x), w*w-x*x-y*y+z*z]])
+
+def r2quat(R):
+    """
+        R [...,3,3] to quaternion [...,4] (w,x,y,z with w >= 0)
+        Closed form (Shepperd): of the four candidates, the one with the largest pivot
+        (trace or a diagonal entry) is used for numerical stability
+    """
+    R = _asarray(R)
+    xp = _xp(R)
+    m00,m01,m02 = R[...,0,0],R[...,0,1],R[...,0,2]
+    m10,m11,m12 = R[...,1,0],R[...,1,1],R[...,1,2]
+    m20,m21,m22 = R[...,2,0],R[...,2,1],R[...,2,2]
+    tr = m00+m11+m22
+    cands = xp.stack([
+        xp.stack([1+tr,m21-m12,m02-m20,m10-m01],-1),
+        xp.stack([m21-m12,1+m00-m11-m22,m01+m10,m02+m20],-1),
+        xp.stack([m02-m20,m01+m10,1-m00+m11-m22,m12+m21],-1),
+        xp.stack([m10-m01,m02+m20,m12+m21,1-m00-m11+m22],-1)],-2) # [...,4,4]
+    pivot  = xp.argmax(xp.stack([tr,m00,m11,m22],-1),-1)
+    q = (cands*_onehot(pivot,4,R)[...,:,None]).sum(-2)
+    q = q/_norm(q)
+    return xp.where(q[...,0:1] < 0,-q,q)
+
+def w2r(w):
+    """
+        Rotation vector [...,3] to R [...,3,3] (Rodrigues)
+    """
+    w = _asarray(w)
+    xp = _xp(w)
+    theta  = _norm(w)[...,0]
+    small  = theta < EPS
+    theta_ = xp.where(small,xp.ones_like(theta),theta)
+    A = xp.where(small,1-theta**2/6,xp.sin(theta_)/theta_)        # sin(t)/t
+    B = xp.where(small,0.5-theta**2/24,(1-xp.cos(theta_))/theta_**2) # (1-cos(t))/t^2
+    K = skew(w)
+    return _eye3(w) + A[...,None,None]*K + B[...,None,None]*(K@K)
+
+def r2w(R):
+    """
+        R [...,3,3] to rotation vector [...,3] (log map, angle in [0,pi])
+        Near pi, the axis is taken from the column of (R+I) with the largest diagonal
+    """
+    R = _asarray(R)
+    xp = _xp(R)
+    el = xp.stack([R[...,2,1]-R[...,1,2],R[...,0,2]-R[...,2,0],R[...,1,0]-R[...,0,1]],-1)
+    el_norm = _norm(el)[...,0] # = 2 sin(theta)
+    tr      = R[...,0,0]+R[...,1,1]+R[...,2,2]
+    theta   = _atan2(el_norm,tr-1)
+    # Regular and near-identity (theta/(2 sin(theta)) -> 1/2)
+    small   = el_norm < 1e-6
+    el_norm_ = xp.where(small,xp.ones_like(el_norm),el_norm)
+    scale   = xp.where(small,0.5+theta**2/12,theta/el_norm_)
+    w       = scale[...,None]*el
+    # Near pi: axis from (R+I) (sign follows 'el' when it is not vanishing)
+    near_pi = small & (tr < 0)
+    if bool(near_pi.any()):
+        diag = xp.stack([R[...,0,0],R[...,1,1],R[...,2,2]],-1)
+        k    = xp.argmax(diag,-1)
+        axis = ((R+_eye3(R))*_onehot(k,3,R)[...,None,:]).sum(-1) # column k
+        axis = axis/_norm(axis)
+        sign = xp.where((axis*el).sum(-1) < 0,-xp.ones_like(tr),xp.ones_like(tr))
+        w    = xp.where(near_pi[...,None],(sign*theta)[...,None]*axis,w)
+    return w
+
+def w2quat(w):
+    """
+        Rotation vector [...,3] to quaternion [...,4]
+    """
+    w = _asarray(w)
+    xp = _xp(w)
+    theta  = _norm(w)[...,0]
+    small  = theta < EPS
+    theta_ = xp.where(small,xp.ones_like(theta),theta)
+    s = xp.where(small,0.5-theta**2/48,xp.sin(theta_/2)/theta_) # sin(t/2)/t
+    return _cat([xp.cos(theta/2)[...,None],s[...,None]*w])
+
+def quat2w(q):
+    """
+        Quaternion [...,4] to rotation vector [...,3] (angle in [0,pi])
+    """
+    q = _asarray(q)
+    xp = _xp(q)
+    q = q/_norm(q)
+    q = xp.where(q[...,0:1] < 0,-q,q)
+    v      = q[...,1:]
+    v_norm = _norm(v)[...,0]
+    theta  = 2*_atan2(v_norm,q[...,0])
+    small  = v_norm < EPS
+    v_norm_ = xp.where(small,xp.ones_like(v_norm),v_norm)
+    scale  = xp.where(small,2/q[...,0],theta/v_norm_)
+    return scale[...,None]*v
+
+def rpy2quat(rpy):
+    """
+        Roll, pitch, and yaw [...,3] to quaternion [...,4]
+    """
+    return r2quat(rpy2r(rpy))
+
+def quat2rpy(q):
+    """
+        Quaternion [...,4] to roll, pitch, and yaw [...,3]
+    """
+    return r2rpy(quat2r(q))
+
+def r2rot6d(R):
+    """
+        R [...,3,3] to 6D representation [...,6] (first two columns)
+    """
+    R = _asarray(R)
+    return _cat([R[...,:,0],R[...,:,1]])
+
+def rot6d2r(x):
+    """
+        6D representation [...,6] to R [...,3,3] (Gram-Schmidt, so any 6D vector maps to a rotation)
+    """
+    x = _asarray(x)
+    xp = _xp(x)
+    a1,a2 = x[...,0:3],x[...,3:6]
+    b1 = a1/_norm(a1)
+    b2 = a2-(b1*a2).sum(-1)[...,None]*b1
+    b2 = b2/_norm(b2)
+    b3 = _cross(b1,b2)
+    return xp.stack([b1,b2,b3],-1)
+
+def quat_mul(q1,q2):
+    """
+        Hamilton product of quaternions [...,4] (R(q1 q2) = R(q1) R(q2))
+    """
+    q1,q2 = _asarray(q1),_asarray(q2)
+    w1,x1,y1,z1 = q1[...,0],q1[...,1],q1[...,2],q1[...,3]
+    w2,x2,y2,z2 = q2[...,0],q2[...,1],q2[...,2],q2[...,3]
+    return _xp(q1).stack([
+        w1*w2-x1*x2-y1*y2-z1*z2,
+        w1*x2+x1*w2+y1*z2-z1*y2,
+        w1*y2-x1*z2+y1*w2+z1*x2,
+        w1*z2+x1*y2-y1*x2+z1*w2],-1)
+
+def quat_conj(q):
+    """
+        Conjugate (inverse of a unit quaternion) [...,4]
+    """
+    q = _asarray(q)
+    sign = _asarray([1.0,-1.0,-1.0,-1.0])
+    if torch.is_tensor(q):
+        sign = torch.as_tensor(sign,dtype=q.dtype,device=q.device)
+    return q*sign
+
+def quat_slerp(q0,q1,t):
+    """
+        Spherical linear interpolation of unit quaternions [...,4] (w,x,y,z) with t scalar or [...]
+        - the shorter arc is taken (q1 is flipped when q0.q1 < 0)
+        - nearly identical quaternions fall back to normalized linear interpolation
+    """
+    q0,q1 = _asarray(q0),_asarray(q1)
+    xp = _xp(q0)
+    if xp is torch:
+        t = torch.as_tensor(t,dtype=q0.dtype,device=q0.device)
+    else:
+        t = np.asarray(t,dtype=np.float64)
+    dot   = (q0*q1).sum(-1)
+    q1    = xp.where(dot[...,None] < 0,-q1,q1)
+    dot   = xp.abs(dot)
+    theta = xp.arccos(torch.clamp(dot,-1.0,1.0) if xp is torch else np.clip(dot,-1.0,1.0))
+    sin_theta = xp.sin(theta)
+    small  = sin_theta < 1e-6
+    sin_theta_ = xp.where(small,xp.ones_like(sin_theta),sin_theta)
+    w0 = xp.where(small,1-t,xp.sin((1-t)*theta)/sin_theta_)
+    w1 = xp.where(small,t+0*theta,xp.sin(t*theta)/sin_theta_)
+    q  = w0[...,None]*q0 + w1[...,None]*q1
+    return q/_norm(q)
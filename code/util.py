@@ -1,11 +1,16 @@
-import math,time,os
+import math,time,os,queue,threading
+from collections import OrderedDict
 import numpy as np
 import tkinter as tk
 import shapely as sp # handle polygon
 import mediapy as media
 from shapely import Polygon,LineString,Point # handle polygons
 from scipy.spatial.distance import cdist
+from scipy.linalg import cho_factor,cho_solve,solveh_banded
+from scipy.sparse import csr_matrix
 import torch
+import rotation
+from retarget import load_retarget_rig
 
 def rot_mtx(deg):
     """
@@ -51,24 +56,9 @@ def t2r(T):
 
 def rpy2r(rpy_rad):
     """
-        roll,pitch,yaw in radian to R
-    """
-    roll  = rpy_rad[0]
-    pitch = rpy_rad[1]
-    yaw   = rpy_rad[2]
-    Cphi  = np.math.cos(roll)
-    Sphi  = np.math.sin(roll)
-    Cthe  = np.math.cos(pitch)
-    Sthe  = np.math.sin(pitch)
-    Cpsi  = np.math.cos(yaw)
-    Spsi  = np.math.sin(yaw)
-    R     = np.array([
-        [Cpsi * Cthe, -Spsi * Cphi + Cpsi * Sthe * Sphi, Spsi * Sphi + Cpsi * Sthe * Cphi],
-        [Spsi * Cthe, Cpsi * Cphi + Spsi * Sthe * Sphi, -Cpsi * Sphi + Spsi * Sthe * Cphi],
-        [-Sthe, Cthe * Sphi, Cthe * Cphi]
-    ])
-    assert R.shape == (3, 3)
-    return R
+        roll,pitch,yaw in radian to R (batched [...,3] => [...,3,3], see 'rotation.rpy2r')
+    """
+    return rotation.rpy2r(rpy_rad)
 
 def r2rpy(R,unit='rad'):
     """
@@ -106,60 +96,16 @@ def r2w(R):
 
 def r2quat(R):
     """ 
-        Convert Rotation Matrix to Quaternion.  See rotation.py for notes 
-        (https://gist.github.com/machinaut/dab261b78ac19641e91c6490fb9faa96)
-    """
-    R = np.asarray(R, dtype=np.float64)
-    Qxx, Qyx, Qzx = R[..., 0, 0], R[..., 0, 1], R[..., 0, 2]
-    Qxy, Qyy, Qzy = R[..., 1, 0], R[..., 1, 1], R[..., 1, 2]
-    Qxz, Qyz, Qzz = R[..., 2, 0], R[..., 2, 1], R[..., 2, 2]
-    # Fill only lower half of symmetric matrix
-    K = np.zeros(R.shape[:-2] + (4, 4), dtype=np.float64)
-    K[..., 0, 0] = Qxx - Qyy - Qzz
-    K[..., 1, 0] = Qyx + Qxy
-    K[..., 1, 1] = Qyy - Qxx - Qzz
-    K[..., 2, 0] = Qzx + Qxz
-    K[..., 2, 1] = Qzy + Qyz
-    K[..., 2, 2] = Qzz - Qxx - Qyy
-    K[..., 3, 0] = Qyz - Qzy
-    K[..., 3, 1] = Qzx - Qxz
-    K[..., 3, 2] = Qxy - Qyx
-    K[..., 3, 3] = Qxx + Qyy + Qzz
-    K /= 3.0
-    # TODO: vectorize this -- probably could be made faster
-    q = np.empty(K.shape[:-2] + (4,))
-    it = np.nditer(q[..., 0], flags=['multi_index'])
-    while not it.finished:
-        # Use Hermitian eigenvectors, values for speed
-        vals, vecs = np.linalg.eigh(K[it.multi_index])
-        # Select largest eigenvector, reorder to w,x,y,z quaternion
-        q[it.multi_index] = vecs[[3, 0, 1, 2], np.argmax(vals)]
-        # Prefer quaternion with positive w
-        # (q * -1 corresponds to same rotation as q)
-        if q[it.multi_index][0] < 0:
-            q[it.multi_index] *= -1
-        it.iternext()
-    return q
+        Convert Rotation Matrix to Quaternion (batched [...,3,3] => [...,4] in closed form, see 'rotation.r2quat')
+    """
+    return rotation.r2quat(R)
 
 def quat2r(q):
-    q = q / np.linalg.norm(q)
-    x = q[..., 1]
-    y = q[..., 2]
-    z = q[..., 3]
-    w = q[..., 0]
-
-    R = np.zeros(q.shape[:-1]+(3, 3), dtype=np.float64)
-    R[..., 0, 0] = w**2 + x**2 - y**2 - z**2
-    R[..., 0, 1] = 2*x*y - 2*w*z
-    R[..., 0, 2] = 2*x*z + 2*w*y
-    R[..., 1, 0] = 2*x*y + 2*w*z
-    R[..., 1, 1] = w**2 - x**2 + y**2 - z**2
-    R[..., 1, 2] = 2*y*z - 2*w*x
-    R[..., 2, 0] = 2*x*z - 2*w*y
-    R[..., 2, 1] = 2*y*z + 2*w*x
-    R[..., 2, 2] = w**2 - x**2 - y**2 + z**2
+    """
+        Convert Quaternion to Rotation Matrix (batched [...,4] => [...,3,3], see 'rotation.quat2r')
+    """
+    return rotation.quat2r(q)
 
-    return R
 def skew(x):
     """ 
         Get a skew-symmetric matrix
@@ -175,13 +121,7 @@ def rodrigues(a=np.array([1,0,0]),q_rad=0.0):
     if abs(a_norm-1) > 1e-6:
         print ("[rodrigues] norm of a should be 1.0 not [%.2e]."%(a_norm))
         return np.eye(3)
-    
-    a = a / a_norm
-    q_rad = q_rad * a_norm
-    a_hat = skew(a)
-    
-    R = np.eye(3) + a_hat*np.sin(q_rad) + a_hat@a_hat*(1-np.cos(q_rad))
-    return R
+    return rotation.w2r(np.asarray(a)/a_norm*q_rad)
     
 def np_uv(vec):
     """
@@ -202,7 +142,27 @@ def get_rotation_matrix_from_two_points(p_fr,p_to):
     else:
         R = np.eye(3,3) + S + S@S*(1-np.dot(p_a,p_b))/(np.linalg.norm(v)*np.linalg.norm(v))
     return R
-    
+
+def get_rotation_matrices_from_two_points(p_frs,p_tos):
+    """
+        Batched 'get_rotation_matrix_from_two_points' ([n x 3] points to [n x 3 x 3] rotations)
+    """
+    d      = np.asarray(p_tos,dtype=np.float64)-np.asarray(p_frs,dtype=np.float64) # [n x 3]
+    d_norm = np.linalg.norm(d,axis=1)
+    Rs     = np.tile(np.eye(3),(d.shape[0],1,1))
+    p_b    = d/np.maximum(d_norm,1e-8)[:,None]
+    v      = np.stack([-p_b[:,1],p_b[:,0],np.zeros(d.shape[0])],axis=1) # cross([0,0,1],p_b)
+    v_sq   = np.sum(v**2,axis=1)
+    valid  = (d_norm >= 1e-8) & (v_sq > 0)
+    S = np.zeros((d.shape[0],3,3))
+    S[:,0,1],S[:,0,2] = -v[:,2],v[:,1]
+    S[:,1,0],S[:,1,2] = v[:,2],-v[:,0]
+    S[:,2,0],S[:,2,1] = -v[:,1],v[:,0]
+    scale = np.zeros(d.shape[0])
+    scale[valid] = (1-p_b[valid,2])/v_sq[valid]
+    Rs[valid] += S[valid] + (S[valid]@S[valid])*scale[valid,None,None]
+    return Rs
+
 
 def trim_scale(x,th):
     """
@@ -214,6 +174,61 @@ def trim_scale(x,th):
         x = x*th/x_abs_max
     return x
 
+def nullspace_ls(Js,errs,weights=None,eps=1e-3,th=None,dq_min=None,dq_max=None,n_clamp=10):
+    """
+        Hierarchical (strict priority) damped least squares with nullspace projection
+        Js:      list of [m_k x n] Jacobians from the highest to the lowest priority
+        errs:    list of [m_k] errors
+        weights: (optional) list of scalar or [m_k] row weights within each priority level
+        th:      (optional) max absolute step, spent from the highest priority (lower levels only get
+                 what is left so that they cannot stall higher ones)
+        dq_min, dq_max: (optional) [n] bounds of dq (e.g., joint limits minus current joint positions)
+                        joints that would exceed a bound are clamped at it and the rest are re-solved
+        Each level k only moves within the nullspace of levels 0,...,k-1:
+        dq_k = dq_{k-1} + (J_k N_{k-1})^+ (err_k - J_k dq_{k-1}), N_k = N_{k-1} - (J_k N_{k-1})^+ (J_k N_{k-1})
+    """
+    n = Js[0].shape[1]
+    if weights is None: weights = [1.0]*len(Js)
+    sqrt_ws = [np.sqrt(np.broadcast_to(np.asarray(w,dtype=np.float64),(J.shape[0],)))
+               for J,w in zip(Js,weights)]
+    dq_fix = np.zeros(n)
+    free   = np.ones(n,dtype=bool)
+    for _ in range(n_clamp+1):
+        n_free = free.sum()
+        dq_free = np.zeros(n_free)
+        N = np.eye(n_free)
+        for J,err,sqrt_w in zip(Js,errs,sqrt_ws):
+            J_w   = sqrt_w[:,None]*J[:,free]
+            err_w = sqrt_w*(err - J[:,~free]@dq_fix[~free]) # clamped joints are fixed
+            JN    = J_w@N
+            A     = JN@JN.T
+            A.flat[::A.shape[0]+1] += eps
+            ddq = JN.T@np.linalg.solve(A,err_w-J_w@dq_free)
+            if (th is not None) and (np.abs(dq_free+ddq).max() > th):
+                # Largest s in [0,1] with |dq_free + s*ddq| <= th, then no budget is left
+                nz = np.abs(ddq) > 1e-12
+                s  = np.min((th-np.sign(ddq[nz])*dq_free[nz])/np.abs(ddq[nz]))
+                dq_free = dq_free + np.clip(s,0.0,1.0)*ddq
+                break
+            dq_free = dq_free + ddq
+            N = N - np.linalg.pinv(JN,rcond=1e-6)@JN
+        dq = dq_fix.copy()
+        dq[free] = dq_free
+        # Clamp joints exceeding the bounds
+        over = np.zeros(n,dtype=bool)
+        if dq_min is not None: over |= dq < dq_min
+        if dq_max is not None: over |= dq > dq_max
+        over &= free
+        if not over.any(): break
+        if dq_min is not None: dq = np.maximum(dq,dq_min)
+        if dq_max is not None: dq = np.minimum(dq,dq_max)
+        dq_fix[over] = dq[over]
+        free[over]   = False
+        if not free.any(): break
+    if dq_min is not None: dq = np.maximum(dq,dq_min)
+    if dq_max is not None: dq = np.minimum(dq,dq_max)
+    return dq
+
 def soft_squash(x,x_min=-1,x_max=+1,margin=0.1):
     """
         Soft squashing numpy array
@@ -342,6 +357,189 @@ class TicTocClass(object):
         if RETURN:
             return self.time_elapsed
 
+class RingBufferClass(object):
+    """
+        Fixed-capacity ring buffer of equally shaped arrays (preallocated, no allocation per push)
+        buf = RingBufferClass(capacity=100,shape=(3,))
+        buf.append(x)       # or write in-place to 'buf.push()'
+        x_prev = buf.get(1) # one before the latest
+        buf.rewind(5)       # drop the five latest entries
+    """
+    def __init__(self,capacity,shape=(),dtype=np.float64):
+        """
+            Initialize
+        """
+        self.capacity = capacity
+        self.shape    = (shape,) if np.isscalar(shape) else tuple(shape)
+        self.buf      = np.zeros((capacity,)+self.shape,dtype=dtype)
+        self.head     = -1 # index of the latest entry
+        self.size     = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        """
+            Remove all entries
+        """
+        self.head = -1
+        self.size = 0
+
+    def push(self):
+        """
+            Advance and return a writable view of the new latest slot
+        """
+        self.head = (self.head+1)%self.capacity
+        self.size = min(self.size+1,self.capacity)
+        return self.buf[self.head]
+
+    def append(self,x):
+        """
+            Copy 'x' into the new latest slot
+        """
+        self.buf[(self.head+1)%self.capacity] = x
+        self.push()
+
+    def get(self,n_back=0):
+        """
+            View of the entry 'n_back' steps before the latest (0: latest)
+        """
+        if (n_back < 0) or (n_back >= self.size):
+            raise IndexError("[RingBufferClass] n_back:[%d] out of range (size:[%d])"%(n_back,self.size))
+        return self.buf[(self.head-n_back)%self.capacity]
+
+    def rewind(self,n_step=1):
+        """
+            Drop 'n_step' latest entries and return a view of the new latest entry
+        """
+        if (n_step < 0) or (n_step >= self.size):
+            raise IndexError("[RingBufferClass] n_step:[%d] out of range (size:[%d])"%(n_step,self.size))
+        self.head = (self.head-n_step)%self.capacity
+        self.size = self.size-n_step
+        return self.buf[self.head]
+
+    def to_array(self):
+        """
+            Entries from the oldest to the latest [size x shape] (copy)
+        """
+        idxs = (self.head-np.arange(self.size)[::-1])%self.capacity
+        return self.buf[idxs]
+
+class LoopSchedulerClass(object):
+    """
+        Fixed-rate loop running several callbacks at independent rates
+        - the base loop runs at 'HZ' and each task runs every 'round(HZ/task_HZ)' base ticks
+        - REAL_TIME: pace with absolute deadlines (t_start + tick/HZ) so that errors do not accumulate
+          otherwise run as fast as possible (batch work)
+        - overrun statistics: late base ticks and task executions longer than the task period
+        sched = LoopSchedulerClass(HZ=500)
+        sched.add_task('ctrl',ctrl_func,HZ=100) # func(tick)
+        sched.add_task('log',log_func,HZ=1)
+        sched.run(duration=10.0)
+        sched.print_stats()
+    """
+    def __init__(self,HZ,REAL_TIME=True,max_lag=0.5,name='LoopScheduler'):
+        """
+            Initialize
+            max_lag: if the loop falls behind by more than 'max_lag' seconds, deadlines are re-anchored
+                     instead of running a burst of catch-up ticks
+        """
+        self.HZ        = HZ
+        self.dt        = 1.0/HZ
+        self.REAL_TIME = REAL_TIME
+        self.max_lag   = max_lag
+        self.name      = name
+        self.tasks     = [] # run in the order they are added
+        self.tick      = 0
+        self.reset_stats()
+
+    def add_task(self,name,func,HZ=None,tick_every=None):
+        """
+            Add a task 'func(tick)' which runs at 'HZ' (or every 'tick_every' base ticks)
+        """
+        if tick_every is None:
+            tick_every = 1 if HZ is None else max(int(round(self.HZ/HZ)),1)
+        task = {'name':name,'func':func,'tick_every':tick_every,'next_tick':self.tick,
+                'period':tick_every*self.dt,
+                'n_call':0,'t_total':0.0,'t_max':0.0,'n_overrun':0}
+        self.tasks.append(task)
+        return task
+
+    def reset_stats(self):
+        """
+            Reset overrun statistics
+        """
+        self.n_late     = 0   # number of base ticks that finished after their deadline
+        self.lag_max    = 0.0 # maximum lateness (sec)
+        self.n_resync   = 0   # number of re-anchored deadlines
+        self.t_elapsed  = 0.0
+        for task in self.tasks:
+            task['n_call'],task['t_total'],task['t_max'],task['n_overrun'] = 0,0.0,0.0,0
+
+    def run(self,n_tick=None,duration=None,stop_func=None):
+        """
+            Run the loop for 'n_tick' base ticks, 'duration' seconds of loop time, or until 'stop_func()' is True
+        """
+        if duration is not None:
+            n_tick_duration = int(round(duration*self.HZ))
+            n_tick = n_tick_duration if n_tick is None else min(n_tick,n_tick_duration)
+        tick_start = self.tick
+        t_start    = time.perf_counter()
+        t_anchor,tick_anchor = t_start,self.tick # deadlines are 't_anchor+(tick-tick_anchor+1)*dt'
+        while True:
+            if (n_tick is not None) and (self.tick-tick_start >= n_tick): break
+            if (stop_func is not None) and stop_func(): break
+            # Run due tasks
+            for task in self.tasks:
+                if self.tick < task['next_tick']: continue
+                t_task = time.perf_counter()
+                task['func'](self.tick)
+                t_exec = time.perf_counter()-t_task
+                task['n_call']  += 1
+                task['t_total'] += t_exec
+                task['t_max']    = max(task['t_max'],t_exec)
+                if t_exec > task['period']: task['n_overrun'] += 1
+                task['next_tick'] += task['tick_every']
+            self.tick += 1
+            # Pace
+            if self.REAL_TIME:
+                deadline = t_anchor+(self.tick-tick_anchor)*self.dt
+                lag = time.perf_counter()-deadline
+                if lag < 0:
+                    time.sleep(-lag)
+                else:
+                    self.n_late += 1
+                    self.lag_max = max(self.lag_max,lag)
+                    if lag > self.max_lag:
+                        t_anchor,tick_anchor = time.perf_counter(),self.tick
+                        self.n_resync += 1
+        self.t_elapsed += time.perf_counter()-t_start
+
+    def get_stats(self):
+        """
+            Get loop and per-task statistics
+        """
+        stats = {'n_tick':self.tick,'t_elapsed':self.t_elapsed,
+                 'n_late':self.n_late,'lag_max':self.lag_max,'n_resync':self.n_resync,'tasks':{}}
+        for task in self.tasks:
+            stats['tasks'][task['name']] = {
+                'n_call':task['n_call'],'period':task['period'],
+                't_mean':task['t_total']/max(task['n_call'],1),'t_max':task['t_max'],
+                'n_overrun':task['n_overrun']}
+        return stats
+
+    def print_stats(self):
+        """
+            Print statistics
+        """
+        stats = self.get_stats()
+        print ("[%s] n_tick:[%d] elapsed:[%.2f]s late ticks:[%d] max lag:[%.2f]ms resync:[%d]"%
+               (self.name,stats['n_tick'],stats['t_elapsed'],stats['n_late'],stats['lag_max']*1000,stats['n_resync']))
+        for task_name,task_stats in stats['tasks'].items():
+            print (" [%s] n_call:[%d] period:[%.2f]ms mean:[%.3f]ms max:[%.3f]ms overrun:[%d]"%
+                   (task_name,task_stats['n_call'],task_stats['period']*1000,
+                    task_stats['t_mean']*1000,task_stats['t_max']*1000,task_stats['n_overrun']))
+
 def get_interp_const_vel_traj(traj_anchor,vel=1.0,HZ=100,ord=np.inf):
     """
         Get linearly interpolated constant velocity trajectory
@@ -379,9 +577,59 @@ def meters2xyz(depth_img,cam_matrix):
     y_e = (indices[..., 0] - cy) * z_e / fy
     
     # Order of y_ e is reversed !
-    xyz_img = np.stack([z_e, -x_e, -y_e], axis=-1) # [H x W x 3] 
+    xyz_img = np.stack([z_e, -x_e, -y_e], axis=-1) # [H x W x 3]
     return xyz_img # [H x W x 3]
 
+class CameraProjectionClass(object):
+    """
+        Depth image to point cloud with cached per-pixel rays (same [z,-x,-y] convention as 'meters2xyz')
+        - rays of a (height,width,fovy,stride) camera are computed once
+        - xyz_img = depth*rays (camera frame) and pcd = xyz@R.T+p (world frame) are written into reusable buffers
+        - stride: use every 'stride'-th pixel (identical to nearest resizing by 'stride' when it divides the image size,
+          and keeps exact intrinsics when it does not)
+        proj = CameraProjectionClass(height=800,width=1200,fovy=45,stride=10)
+        pcd,xyz_img = proj.depth_to_pcd(depth_img,p_cam,R_cam) # views of the buffers
+    """
+    def __init__(self,height,width,fovy=45,stride=1,dtype=np.float64):
+        """
+            Initialize rays and buffers
+        """
+        self.height = height
+        self.width  = width
+        self.fovy   = fovy
+        self.stride = stride
+        self.dtype  = dtype
+        focal_scaling = 0.5*height/np.tan(fovy*np.pi/360)
+        cx,cy = width/2,height/2
+        v = (np.arange(height//stride)*stride).astype(np.float64) # pixel rows
+        u = (np.arange(width//stride)*stride).astype(np.float64) # pixel columns
+        self.h,self.w = len(v),len(u)
+        self.rays = np.empty((self.h,self.w,3),dtype=dtype) # [h x w x 3]
+        self.rays[:,:,0] = 1.0
+        self.rays[:,:,1] = -(u[None,:]-cx)/focal_scaling
+        self.rays[:,:,2] = -(v[:,None]-cy)/focal_scaling
+        self.xyz_img = np.empty((self.h,self.w,3),dtype=dtype)
+        self.pcd     = np.empty((self.h*self.w,3),dtype=dtype)
+
+    def depth_to_xyz(self,depth_img):
+        """
+            Depth image [H x W] to points in the camera frame [h x w x 3] (view of the buffer)
+        """
+        if self.stride > 1:
+            depth_img = depth_img[:self.h*self.stride:self.stride,:self.w*self.stride:self.stride]
+        np.multiply(depth_img[:,:,None],self.rays,out=self.xyz_img)
+        return self.xyz_img
+
+    def depth_to_pcd(self,depth_img,p_cam,R_cam):
+        """
+            Depth image [H x W] to point cloud in the world frame [N x 3] (views of the buffers)
+            p_cam,R_cam: camera pose
+        """
+        xyz_img = self.depth_to_xyz(depth_img)
+        np.matmul(xyz_img.reshape((-1,3)),np.asarray(R_cam,dtype=self.dtype).T,out=self.pcd)
+        self.pcd += np.asarray(p_cam,dtype=self.dtype)
+        return self.pcd,xyz_img
+
 def compute_view_params(camera_pos,target_pos,up_vector=np.array([0,0,1])):
     """Compute azimuth, distance, elevation, and lookat for a viewer given camera pose in 3D space.
 
@@ -437,7 +685,7 @@ def create_folder_if_not_exists(file_path):
         Create folder if not exist
     """
     folder_path = os.path.dirname(file_path)
-    if not os.path.exists(folder_path):
+    if folder_path and (not os.path.exists(folder_path)): # bare file names are in the current folder
         os.makedirs(folder_path)
         print ("[%s] created."%(folder_path))
         
@@ -694,58 +942,36 @@ def animiate_motion_with_slider(
     # Close MuJoCo viewer
     env.close_viewer()
 
-def feet_anchoring(env,q_list,quat_root_list,p_root_list,rev_joint_names,
-                   foot_thickness=0.04,p_cfoot_offset=np.array([0,0,0.02]),d_rf2lf_custom=0.3,
-                   ik_th=1e-3,ik_iters=5000,ANIMATE_IK=True):
+def get_feet_anchoring_targets(env,q_list,quat_root_list,p_root_list,rev_joint_names,
+                               foot_thickness=0.04,p_cfoot_offset=np.array([0,0,0.02]),d_rf2lf_custom=0.3):
     """ 
-        Feet anchoring
+        Feet anchoring ingredients (root centering and feet targets)
+        - returns 'p_root_centered_list', initial 'qpos_traj' [L x nq], and feet IK targets
     """
     # Get useful indices
     joint_idxs_fwd = env.get_idxs_fwd(joint_names=rev_joint_names)
-    joint_idxs_jac = env.get_idxs_jac(joint_names=rev_joint_names)
-    
-    # Initialize viewer
-    if ANIMATE_IK:
-        env.init_viewer(viewer_title='Common Rig',viewer_width=1200,viewer_height=800,
-                        viewer_hide_menus=True,FONTSCALE_VALUE=200)
-        env.update_viewer(azimuth=152,distance=3.0,elevation=-30,lookat=[0.02,-0.03,0.8])
+    geom_idxs_feet = env.get_idxs_geom(geom_names=['rfoot','lfoot'])
+    root_qposadr   = env.model.jnt_qposadr[env.body_jntadrs[env.body_name2id['base']]]
     env.reset()
 
-    # First, get two feet trajectories
+    # Initial poses (original root and joint positions)
     L = q_list.shape[0]
-    p_rfoot_list = np.zeros((L,3))
-    p_lfoot_list = np.zeros((L,3))
-    for tick in range(L):
-        # Update skeleton pose
-        q = q_list[tick,:] # [35]
-        p_root = p_root_list[tick,:] # [3]
-        quat_root = quat_root_list[tick,:] # [4] quaternion
-        env.set_p_root(root_name='base',p=p_root)
-        env.set_quat_root(root_name='base',quat=quat_root)
-        env.forward(q=q,joint_idxs=joint_idxs_fwd)
-        # Append two feet positions
-        p_rfoot_list[tick,:] = env.get_p_geom(geom_name='rfoot')
-        p_lfoot_list[tick,:] = env.get_p_geom(geom_name='lfoot')
+    qpos_traj = np.tile(env.data.qpos,(L,1)) # [L x nq]
+    qpos_traj[:,root_qposadr:root_qposadr+3] = p_root_list
+    qpos_traj[:,root_qposadr+3:root_qposadr+7] = quat_root_list
+    qpos_traj[:,joint_idxs_fwd] = q_list
+
+    # First, get two feet trajectories (kinematics only)
+    fk_res = env.batch_fk(qpos_traj,body_ids=[],geom_ids=geom_idxs_feet)
+    p_rfoot_list,p_lfoot_list = fk_res['p_geom'][:,0,:],fk_res['p_geom'][:,1,:] # [L x 3]
 
     # Modify the root position so that the center of two feet is in the origin
-    p_root_centered_list = np.zeros((L,3))
-    p_rfoot_centered_list = np.zeros((L,3))
-    p_lfoot_centered_list = np.zeros((L,3))
-    for tick in range(L):
-        # Get current pose
-        q = q_list[tick,:] # [35]
-        p_root = p_root_list[tick,:]
-        quat_root = quat_root_list[tick,:] # [4] quaternion
-        # Move the body so that the feet is in the origin
-        p_cfoot = 0.5*(p_rfoot_list[tick,:]+p_lfoot_list[tick,:])
-        p_root_centered = p_root-p_cfoot+np.array([0,0,foot_thickness/2])
-        p_root_centered_list[tick,:] = p_root_centered
-        env.set_p_root(root_name='base',p=p_root_centered)
-        env.set_quat_root(root_name='base',quat=quat_root)
-        env.forward(q=q,joint_idxs=joint_idxs_fwd)
-        # Append centered feet trajectories
-        p_rfoot_centered_list[tick,:] = env.get_p_geom(geom_name='rfoot')
-        p_lfoot_centered_list[tick,:] = env.get_p_geom(geom_name='lfoot')
+    # (translating the root translates both feet by the same amount)
+    p_cfoot_list = 0.5*(p_rfoot_list+p_lfoot_list) # [L x 3]
+    d_root_list = -p_cfoot_list+np.array([0,0,foot_thickness/2]) # [L x 3]
+    p_root_centered_list = p_root_list+d_root_list
+    p_rfoot_centered_list = p_rfoot_list+d_root_list
+    p_lfoot_centered_list = p_lfoot_list+d_root_list
         
     # Solve IK to anchor two feet
     p_trgt_rfoot = np.average(p_rfoot_centered_list,axis=0) # [3]
@@ -763,57 +989,85 @@ def feet_anchoring(env,q_list,quat_root_list,p_root_list,rev_joint_names,
     # Feet rotation target
     R_trgt_rfoot = rpy2r(np.radians([0,0,0]))
     R_trgt_lfoot = rpy2r(np.radians([0,0,0]))
-    q_feetanchor_list = np.zeros((L,len(rev_joint_names)))
-    for tick in range(L):
-        p_root_centered = p_root_centered_list[tick,:]
-        quat_root = quat_root_list[tick,:]
-        q = q_list[tick,:] # [35]
-        env.set_p_root(root_name='base',p=p_root_centered)
-        env.set_quat_root(root_name='base',quat=quat_root)
-        env.forward(q=q,joint_idxs=joint_idxs_fwd)
-        # Solve IK
-        ik_geom_names = ['rfoot','lfoot']
-        ik_p_trgts = [p_trgt_rfoot,p_trgt_lfoot]
-        ik_R_trgts = [R_trgt_rfoot,R_trgt_lfoot]
-        err_traj = np.zeros(ik_iters)
-        for ik_tick in range(ik_iters):
-            J_list,ik_err_list = [],[]
-            for ik_idx,ik_geom_name in enumerate(ik_geom_names):
-                ik_p_trgt = ik_p_trgts[ik_idx]
-                ik_R_trgt = ik_R_trgts[ik_idx]
-                IK_P = ik_p_trgt is not None
-                IK_R = ik_R_trgt is not None
-                J,ik_err = env.get_ik_ingredients_geom(
-                    geom_name=ik_geom_name,p_trgt=ik_p_trgt,R_trgt=ik_R_trgt,
-                    IK_P=IK_P,IK_R=IK_R)
-                J_list.append(J)
-                ik_err_list.append(ik_err)
-            J_stack      = np.vstack(J_list)
-            ik_err_stack = np.hstack(ik_err_list)
-            ik_err_norm = np.linalg.norm(ik_err_stack)
-            err_traj[ik_tick] = ik_err_norm
-            dq = env.damped_ls(J_stack,ik_err_stack,stepsize=1,eps=1e-3,th=np.radians(10.0))
-            q = q + dq[joint_idxs_jac]
-            env.forward(q=q,joint_idxs=joint_idxs_fwd)
-            # Early terminate
-            if ik_err_norm < ik_th: break
-            # Error
-            if ik_tick == (ik_iters-1):
-                print ("[feet_anchoring] ik_tick:[%d] ik_err_norm:[%.3f] is above threshold:[%.3f]"%
-                       (ik_tick,ik_err_norm,ik_th))
-            
-        # Append q
-        q_feetanchor_list[tick,:] = env.get_qpos_joints(rev_joint_names)
-        
-        # IK Debug plot
-        if ANIMATE_IK:
-            env.plot_T(p=np.zeros(3),R=np.eye(3,3),
-                    PLOT_AXIS=True,axis_len=0.5,axis_width=0.01)
-            env.plot_T(p=np.array([0,0,0.5]),R=np.eye(3,3),
-                    PLOT_AXIS=False,label="tick:[%d/%d]"%(tick,L))
-            env.plot_ik_geom_info(
-                ik_geom_names,ik_p_trgts,ik_R_trgts,axis_len=0.2,axis_width=0.01,sphere_r=0.1)
-            env.render()
+    
+    # Initial poses (centered root and original joint positions)
+    qpos_traj[:,root_qposadr:root_qposadr+3] = p_root_centered_list
+    
+    # Return
+    targets = {
+        'L':L,
+        'p_root_centered_list':p_root_centered_list,
+        'qpos_traj':qpos_traj,
+        'ik_geom_names':['rfoot','lfoot'],
+        'ik_p_trgts':[p_trgt_rfoot,p_trgt_lfoot],
+        'ik_R_trgts':[R_trgt_rfoot,R_trgt_lfoot]}
+    return targets
+
+def get_feet_anchoring_ik(env,ik_geom_names,rev_joint_names,ik_th=1e-3,ik_iters=5000,
+                          HIERARCHICAL_IK=False,posture_weight=0.0):
+    """ 
+        Trajectory IK engine of feet anchoring
+        - HIERARCHICAL_IK: feet at the highest priority (nullspace projection, joint limits) with an
+          optional posture task ('posture_weight') toward the input motion; stops when both feet are met
+    """
+    from ik_solver import TrajectoryIKClass,HierarchicalTrajectoryIKClass # lazy import (ik_solver imports util)
+    ik_tasks = [{'name':ik_geom_name,'type':'geom','IK_P':True,'IK_R':True,'priority':0}
+                for ik_geom_name in ik_geom_names]
+    if HIERARCHICAL_IK:
+        return HierarchicalTrajectoryIKClass(
+            env,ik_tasks=ik_tasks,joint_names=rev_joint_names,eps=1e-3,stepsize=1,th=np.radians(10.0),
+            max_iter=ik_iters,err_th=ik_th/np.sqrt(len(ik_tasks)),posture_weight=posture_weight)
+    return TrajectoryIKClass(
+        env,ik_tasks=ik_tasks,joint_names=rev_joint_names,eps=1e-3,stepsize=1,th=np.radians(10.0),
+        max_iter=ik_iters,err_th=ik_th)
+
+def feet_anchoring(env,q_list,quat_root_list,p_root_list,rev_joint_names,
+                   foot_thickness=0.04,p_cfoot_offset=np.array([0,0,0.02]),d_rf2lf_custom=0.3,
+                   ik_th=1e-3,ik_iters=5000,ANIMATE_IK=True,WARM_START=True,
+                   HIERARCHICAL_IK=False,posture_weight=0.0):
+    """ 
+        Feet anchoring
+        - WARM_START: initialize the IK of each frame from the previous frame's solution
+        - HIERARCHICAL_IK: use the multi-priority IK (see 'get_feet_anchoring_ik')
+    """
+    # Root centering and feet targets
+    targets = get_feet_anchoring_targets(
+        env,q_list,quat_root_list,p_root_list,rev_joint_names,
+        foot_thickness=foot_thickness,p_cfoot_offset=p_cfoot_offset,d_rf2lf_custom=d_rf2lf_custom)
+    L                    = targets['L']
+    p_root_centered_list = targets['p_root_centered_list']
+    qpos_traj            = targets['qpos_traj']
+    ik_geom_names        = targets['ik_geom_names']
+    ik_p_trgts           = targets['ik_p_trgts']
+    ik_R_trgts           = targets['ik_R_trgts']
+    
+    # Initialize viewer
+    if ANIMATE_IK:
+        env.init_viewer(viewer_title='Common Rig',viewer_width=1200,viewer_height=800,
+                        viewer_hide_menus=True,FONTSCALE_VALUE=200)
+        env.update_viewer(azimuth=152,distance=3.0,elevation=-30,lookat=[0.02,-0.03,0.8])
+    
+    # IK Debug plot
+    def plot_ik(tick):
+        env.plot_T(p=np.zeros(3),R=np.eye(3,3),
+                PLOT_AXIS=True,axis_len=0.5,axis_width=0.01)
+        env.plot_T(p=np.array([0,0,0.5]),R=np.eye(3,3),
+                PLOT_AXIS=False,label="tick:[%d/%d]"%(tick,L))
+        env.plot_ik_geom_info(
+            ik_geom_names,ik_p_trgts,ik_R_trgts,axis_len=0.2,axis_width=0.01,sphere_r=0.1)
+        env.render()
+    
+    # Solve IK for all frames (each frame is warm-started from the previous solution)
+    ik = get_feet_anchoring_ik(
+        env,ik_geom_names,rev_joint_names,ik_th=ik_th,ik_iters=ik_iters,
+        HIERARCHICAL_IK=HIERARCHICAL_IK,posture_weight=posture_weight)
+    ik_res = ik.solve(
+        qpos_traj,p_trgt_traj=np.array(ik_p_trgts),R_trgt_traj=np.array(ik_R_trgts),
+        WARM_START=WARM_START,frame_callback=plot_ik if ANIMATE_IK else None)
+    q_feetanchor_list = ik_res['q_traj']
+    for tick in np.where(ik_res['err_norms'] >= ik_th)[0]:
+        print ("[feet_anchoring] tick:[%d] ik_err_norm:[%.3f] is above threshold:[%.3f]"%
+               (tick,ik_res['err_norms'][tick],ik_th))
         
     # Close MuJoCo viewer
     if ANIMATE_IK:
@@ -823,71 +1077,177 @@ def feet_anchoring(env,q_list,quat_root_list,p_root_list,rev_joint_names,
     feet_anchor_res = {
         'L':L,
         'p_root_centered_list':p_root_centered_list,
-        'q_feetanchor_list':q_feetanchor_list}
+        'q_feetanchor_list':q_feetanchor_list,
+        'ik_n_iters':ik_res['n_iters'],
+        'ik_err_norms':ik_res['err_norms']}
     return feet_anchor_res
 
+_feet_anchoring_worker = {} # per-process state of 'feet_anchoring_parallel' workers
+
+def _init_feet_anchoring_worker(mjb_path,rev_joint_names,ik_geom_names,ik_iters,ik_th,
+                                HIERARCHICAL_IK=False,posture_weight=0.0):
+    """ 
+        Process pool initializer: load the shared compiled model once per worker
+    """
+    from mujoco_parser import MuJoCoParserClass # lazy import (mujoco_parser imports util)
+    env = MuJoCoParserClass(name='FeetAnchoringWorker',rel_xml_path=mjb_path,VERBOSE=False)
+    _feet_anchoring_worker['env'] = env
+    _feet_anchoring_worker['ik'] = get_feet_anchoring_ik(
+        env,ik_geom_names,rev_joint_names,ik_th=ik_th,ik_iters=ik_iters,
+        HIERARCHICAL_IK=HIERARCHICAL_IK,posture_weight=posture_weight)
+
+def _solve_feet_anchoring_chunk(qpos_traj_chunk,ik_p_trgts,ik_R_trgts,WARM_START):
+    """ 
+        Solve IK of one contiguous chunk (warm-started from its own first frame)
+    """
+    ik_res = _feet_anchoring_worker['ik'].solve(
+        qpos_traj_chunk,p_trgt_traj=ik_p_trgts,R_trgt_traj=ik_R_trgts,WARM_START=WARM_START)
+    return ik_res
+
+def feet_anchoring_parallel(env,q_list,quat_root_list,p_root_list,rev_joint_names,
+                            foot_thickness=0.04,p_cfoot_offset=np.array([0,0,0.02]),d_rf2lf_custom=0.3,
+                            ik_th=1e-3,ik_iters=5000,WARM_START=True,
+                            HIERARCHICAL_IK=False,posture_weight=0.0,
+                            n_worker=None,chunk_len=None,mjb_path=None,VERBOSE=True):
+    """ 
+        Feet anchoring with the IK solved over contiguous chunks in a process pool
+        - each worker loads its own MuJoCoParserClass from a shared compiled '.mjb'
+        - each chunk is warm-started from its own first frame and the results are stitched
+        - n_worker: number of processes (default: os.cpu_count())
+        - chunk_len: frames per chunk (default: one chunk per worker)
+        - mjb_path: (optional) where to save the compiled model (default: temporary file)
+        - HIERARCHICAL_IK: use the multi-priority IK (see 'get_feet_anchoring_ik')
+        Returns the same dictionary as 'feet_anchoring'
+    """
+    import tempfile,mujoco
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Root centering and feet targets (cheap, done in the main process)
+    targets = get_feet_anchoring_targets(
+        env,q_list,quat_root_list,p_root_list,rev_joint_names,
+        foot_thickness=foot_thickness,p_cfoot_offset=p_cfoot_offset,d_rf2lf_custom=d_rf2lf_custom)
+    L         = targets['L']
+    qpos_traj = targets['qpos_traj']
+    
+    # Split into contiguous chunks
+    if n_worker is None:
+        n_worker = os.cpu_count() or 1
+    if chunk_len is None:
+        n_chunk = max(min(n_worker,L),1)
+    else:
+        n_chunk = max(int(np.ceil(L/chunk_len)),1)
+    qpos_traj_chunks = np.array_split(qpos_traj,n_chunk,axis=0)
+    
+    # Save the compiled model so that workers skip XML parsing
+    tmp_dir = None
+    if mjb_path is None:
+        tmp_dir  = tempfile.TemporaryDirectory()
+        mjb_path = os.path.join(tmp_dir.name,'model.mjb')
+    mjb_path = os.path.abspath(mjb_path)
+    mujoco.mj_saveModel(env.model,mjb_path,None)
+    
+    # Solve chunks in parallel
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(n_worker,n_chunk),
+            initializer=_init_feet_anchoring_worker,
+            initargs=(mjb_path,rev_joint_names,targets['ik_geom_names'],ik_iters,ik_th,
+                      HIERARCHICAL_IK,posture_weight)) as executor:
+            futures = [executor.submit(_solve_feet_anchoring_chunk,qpos_traj_chunk,
+                                       np.array(targets['ik_p_trgts']),np.array(targets['ik_R_trgts']),
+                                       WARM_START)
+                       for qpos_traj_chunk in qpos_traj_chunks]
+            ik_res_list = [future.result() for future in futures]
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+    
+    # Stitch
+    q_feetanchor_list = np.concatenate([ik_res['q_traj'] for ik_res in ik_res_list],axis=0)
+    ik_n_iters        = np.concatenate([ik_res['n_iters'] for ik_res in ik_res_list],axis=0)
+    ik_err_norms      = np.concatenate([ik_res['err_norms'] for ik_res in ik_res_list],axis=0)
+    if VERBOSE:
+        print ("[feet_anchoring_parallel] L:[%d] n_chunk:[%d] n_worker:[%d] total IK iterations:[%d]"%
+               (L,n_chunk,min(n_worker,n_chunk),ik_n_iters.sum()))
+    for tick in np.where(ik_err_norms >= ik_th)[0]:
+        print ("[feet_anchoring_parallel] tick:[%d] ik_err_norm:[%.3f] is above threshold:[%.3f]"%
+               (tick,ik_err_norms[tick],ik_th))
+    
+    # Return
+    feet_anchor_res = {
+        'L':L,
+        'p_root_centered_list':targets['p_root_centered_list'],
+        'q_feetanchor_list':q_feetanchor_list,
+        'ik_n_iters':ik_n_iters,
+        'ik_err_norms':ik_err_norms}
+    return feet_anchor_res
+
+def get_nearest_idxs(time_list,time_query_list):
+    """
+        Indices of the nearest samples of a sorted 'time_list' for every query time
+        (ties go to the earlier sample, identical to 'np.argmin(np.abs(time_list-t))' per query)
+    """
+    time_list       = np.asarray(time_list,dtype=np.float64)
+    time_query_list = np.asarray(time_query_list,dtype=np.float64)
+    n = time_list.shape[0]
+    idx_hi = np.clip(np.searchsorted(time_list,time_query_list,side='left'),1,n-1) if n > 1 \
+        else np.zeros(time_query_list.shape,dtype=np.int64)
+    idx_lo = np.maximum(idx_hi-1,0)
+    use_lo = np.abs(time_query_list-time_list[idx_lo]) <= np.abs(time_list[idx_hi]-time_query_list)
+    idxs = np.where(use_lo,idx_lo,idx_hi)
+    # First of duplicated time stamps
+    return np.searchsorted(time_list,time_list[idxs],side='left')
+
 def blend_tween_trajectories(
     time_blend_list,intv_fade,
     time_a_list,x_a_list,time_b_list,x_b_list,
-    time_tween_list,x_tween_list):
+    time_tween_list,x_tween_list,quat_idxs=None):
     """ 
         Blen trajectory a, trajectory b, and tweened trajectory
-    """
-    # Buffers to save blended results
-    dim_x        = x_a_list.shape[1]
-    n_blend      = time_blend_list.shape[0]
-    x_blend_list = np.zeros((n_blend,dim_x))
+        - nearest samples of a+b everywhere, then
+        - a fades into the tween around the end of a, the tween fades into b around the start of b,
+          and the tween alone is used in between
+        - 'quat_idxs': start columns of quaternion channels (4 columns each) blended with slerp
+        Nearest indices are found once with 'np.searchsorted' and all channels are blended at once
+    """
+    time_blend_list = np.asarray(time_blend_list,dtype=np.float64)
+    x_a_list,x_b_list = np.asarray(x_a_list),np.asarray(x_b_list)
+    x_tween_list = np.asarray(x_tween_list)
     
     # Append
     time_ab_list = np.concatenate((time_a_list,time_b_list))
     x_ab_list    = np.vstack((x_a_list,x_b_list))
+    order        = np.argsort(time_ab_list,kind='stable')
     
     # Initialize 'x_blend_list' with nearest interpolation of 'x_ab_list'
-    for d_idx in range(dim_x):
-        for tick in range(len(time_blend_list)):
-            time_curr = time_blend_list[tick]
-            idx_min = np.argmin(np.abs(time_ab_list-time_curr))
-            x_blend_list[tick,d_idx] = x_ab_list[idx_min,d_idx]
-            
-    # Blend trajectories
-    for d_idx in range(dim_x):
-        
-        # First blending (centered at the end of motion a)
-        time_center = time_a_list[-1]
-        time_min    = time_center - intv_fade
-        time_max    = time_center + intv_fade
-        for tick in range(n_blend):
-            time_curr = time_blend_list[tick]
-            if (time_min < time_curr) and (time_curr <= time_max):
-                alpha = (time_curr-time_min)/(time_max-time_min)
-                idx_a = np.argmin(np.abs(time_a_list-time_curr))
-                idx_tween = np.argmin(np.abs(time_tween_list-time_curr))
-                # Update
-                x_blend_list[tick,d_idx] = (1-alpha)*x_a_list[idx_a,d_idx] + \
-                    alpha*x_tween_list[idx_tween,d_idx]
-                
-        # Second blending (centered at the start of motion b)
-        time_center = time_b_list[0]
-        time_min    = time_center - intv_fade
-        time_max    = time_center + intv_fade
-        for tick in range(n_blend):
-            time_curr = time_blend_list[tick]
-            if (time_min < time_curr) and (time_curr <= time_max):
-                alpha = (time_curr-time_min)/(time_max-time_min)
-                idx_b = np.argmin(np.abs(time_b_list-time_curr))
-                idx_tween = np.argmin(np.abs(time_tween_list-time_curr))
-                # Update
-                x_blend_list[tick,d_idx] = alpha*x_b_list[idx_b,d_idx] + \
-                    (1-alpha)*x_tween_list[idx_tween,d_idx]
-                
-        # Third blending (nearest filtering between the end of a and the start of b)
-        for tick in range(n_blend):
-            time_curr = time_blend_list[tick]
-            if ((time_a_list[-1]+intv_fade) < time_curr) and (time_curr <= (time_b_list[0]-intv_fade)):
-                idx_tween = np.argmin(np.abs(time_tween_list-time_curr))
-                # Update
-                x_blend_list[tick,d_idx] = x_tween_list[idx_tween,d_idx]
-
+    x_blend_list = x_ab_list[order[get_nearest_idxs(time_ab_list[order],time_blend_list)]].astype(np.float64)
+    
+    # Nearest samples of each trajectory
+    x_a_near     = x_a_list[get_nearest_idxs(time_a_list,time_blend_list)]
+    x_b_near     = x_b_list[get_nearest_idxs(time_b_list,time_blend_list)]
+    x_tween_near = x_tween_list[get_nearest_idxs(time_tween_list,time_blend_list)]
+    
+    # Per-tick masks and weights
+    time_a_end,time_b_start = time_a_list[-1],time_b_list[0]
+    mask_a = ((time_a_end-intv_fade) < time_blend_list) & (time_blend_list <= (time_a_end+intv_fade))
+    mask_b = ((time_b_start-intv_fade) < time_blend_list) & (time_blend_list <= (time_b_start+intv_fade))
+    mask_tween = ((time_a_end+intv_fade) < time_blend_list) & (time_blend_list <= (time_b_start-intv_fade))
+    alpha_a = (time_blend_list-(time_a_end-intv_fade))/(2*intv_fade)
+    alpha_b = (time_blend_list-(time_b_start-intv_fade))/(2*intv_fade)
+    
+    # Blend trajectories (later blends overwrite earlier ones)
+    x_blend_list[mask_a] = (1-alpha_a[mask_a,None])*x_a_near[mask_a] + alpha_a[mask_a,None]*x_tween_near[mask_a]
+    x_blend_list[mask_b] = alpha_b[mask_b,None]*x_b_near[mask_b] + (1-alpha_b[mask_b,None])*x_tween_near[mask_b]
+    x_blend_list[mask_tween] = x_tween_near[mask_tween]
+    
+    # Quaternion channels
+    for q_idx in ([] if quat_idxs is None else quat_idxs):
+        cols = slice(q_idx,q_idx+4)
+        x_blend_list[mask_a,cols] = rotation.quat_slerp(
+            x_a_near[mask_a,cols],x_tween_near[mask_a,cols],alpha_a[mask_a])
+        x_blend_list[mask_b,cols] = rotation.quat_slerp(
+            x_tween_near[mask_b,cols],x_b_near[mask_b,cols],alpha_b[mask_b])
+    
     # Return
     return x_blend_list
 
@@ -895,25 +1255,112 @@ def get_gp_mean_function(time_in_list,x_in_list,time_out_list,
                          hyp={'g':1.0,'l':1.0},sig2w=1e-8):
     """ 
         Gaussian process mean
+        (Cholesky factors are shared across calls with the same time grids, see 'GPTweenClass')
+    """
+    return gp_tween.get_mean(time_in_list,x_in_list,time_out_list,hyp=hyp,sig2w=sig2w)
+
+class GPTweenClass(object):
     """
-    n_in,n_out  = time_in_list.shape[0],time_out_list.shape[0]
-    K_in        = kernel_se(time_in_list,time_in_list,hyp=hyp)
-    K_tween_in  = kernel_se(time_out_list,time_in_list,hyp=hyp)
-    inv_K_ab    = np.linalg.inv(K_in+sig2w*np.eye(n_in))
-    mu_x_in     = np.mean(x_in_list,axis=0)
-    x_out_list  = K_tween_in @ inv_K_ab @ (x_in_list-mu_x_in) + mu_x_in # GP result
-    return x_out_list
+        Gaussian process tweening with cached Cholesky factors
+        - K_in + sig2w*I is factorized once per (input time grid, hyperparameters) with 'cho_factor'
+        - the projection K_out_in (K_in + sig2w*I)^-1 is solved once per output grid (multi-RHS 'cho_solve')
+          so that every channel of every transition between the same frame windows is a single matmul
+        - both caches are LRU with 'capacity' entries
+        gp = GPTweenClass(capacity=32)
+        x_out = gp.get_mean(time_in_list,x_in_list,time_out_list,hyp={'g':1.0,'l':0.2})
+        x_out,var_out = gp.get_mean(time_in_list,x_in_list,time_out_list,RETURN_VAR=True)
+    """
+    def __init__(self,capacity=32):
+        """
+            Initialize
+        """
+        self.capacity    = capacity
+        self.factor_dict = OrderedDict() # (time_in,hyp,sig2w) => cho_factor
+        self.proj_dict   = OrderedDict() # (time_in,time_out,hyp,sig2w) => (W,var)
+        self.n_hit       = 0
+        self.n_miss      = 0
+
+    def clear(self):
+        """
+            Drop all cached factors
+        """
+        self.factor_dict.clear()
+        self.proj_dict.clear()
+        self.n_hit,self.n_miss = 0,0
+
+    def _lru_get(self,cache,key):
+        if key in cache:
+            cache.move_to_end(key)
+            self.n_hit += 1
+            return cache[key]
+        self.n_miss += 1
+        return None
+
+    def _lru_put(self,cache,key,val):
+        cache[key] = val
+        if len(cache) > self.capacity:
+            cache.popitem(last=False)
+        return val
+
+    def get_factor(self,time_in_list,hyp={'g':1.0,'l':1.0},sig2w=1e-8):
+        """
+            Cholesky factor of K_in + sig2w*I
+        """
+        time_in_list = np.ascontiguousarray(time_in_list,dtype=np.float64)
+        key = (time_in_list.shape,time_in_list.tobytes(),float(hyp['g']),float(hyp['l']),float(sig2w))
+        factor = self._lru_get(self.factor_dict,key)
+        if factor is None:
+            K_in   = kernel_se(time_in_list,time_in_list,hyp=hyp)
+            factor = self._lru_put(self.factor_dict,key,
+                                   cho_factor(K_in+sig2w*np.eye(K_in.shape[0]),lower=True))
+        return factor
+
+    def get_projection(self,time_in_list,time_out_list,hyp={'g':1.0,'l':1.0},sig2w=1e-8):
+        """
+            Projection W [n_out x n_in] (mean = W @ x_in) and posterior variance [n_out]
+        """
+        time_in_list  = np.ascontiguousarray(time_in_list,dtype=np.float64)
+        time_out_list = np.ascontiguousarray(time_out_list,dtype=np.float64)
+        key = (time_in_list.shape,time_in_list.tobytes(),time_out_list.shape,time_out_list.tobytes(),
+               float(hyp['g']),float(hyp['l']),float(sig2w))
+        proj = self._lru_get(self.proj_dict,key)
+        if proj is None:
+            factor     = self.get_factor(time_in_list,hyp=hyp,sig2w=sig2w)
+            K_out_in   = kernel_se(time_out_list,time_in_list,hyp=hyp)
+            W          = cho_solve(factor,K_out_in.T).T # one solve for all output times
+            var        = np.maximum(hyp['g']-np.sum(K_out_in*W,axis=1),0.0)
+            proj = self._lru_put(self.proj_dict,key,(W,var))
+        return proj
+
+    def get_mean(self,time_in_list,x_in_list,time_out_list,
+                 hyp={'g':1.0,'l':1.0},sig2w=1e-8,RETURN_VAR=False):
+        """
+            Posterior mean [n_out x D] of all channels (centered at the mean of 'x_in_list')
+            and, optionally, the posterior variance [n_out] shared by all channels
+        """
+        W,var      = self.get_projection(time_in_list,time_out_list,hyp=hyp,sig2w=sig2w)
+        mu_x_in    = np.mean(x_in_list,axis=0)
+        x_out_list = W @ (x_in_list-mu_x_in) + mu_x_in # GP result
+        if RETURN_VAR:
+            return x_out_list,var
+        return x_out_list
+
+gp_tween = GPTweenClass() # shared by 'get_gp_mean_function'
     
 def animate_motion_with_media(env,p_root_list,quat_root_list,q_list,rev_joint_names,HZ,
-                              viewer_distance=3.0):
+                              viewer_distance=3.0,USE_OFFSCREEN=False):
     """
         Animate motion with media.show_video
+        - USE_OFFSCREEN: render headless (no window required)
     """
     # Initialize viewer
     L              = q_list.shape[0]
     joint_idxs_fwd = env.get_idxs_fwd(joint_names=rev_joint_names)
-    env.init_viewer(viewer_title='Common Rig',viewer_width=1200,viewer_height=800,
-                    viewer_hide_menus=True,FONTSCALE_VALUE=200)
+    if USE_OFFSCREEN:
+        env.init_offscreen_viewer(viewer_width=1200,viewer_height=800,FONTSCALE_VALUE=200)
+    else:
+        env.init_viewer(viewer_title='Common Rig',viewer_width=1200,viewer_height=800,
+                        viewer_hide_menus=True,FONTSCALE_VALUE=200)
     env.update_viewer(azimuth=152,distance=viewer_distance,elevation=-30,lookat=[0.02,-0.03,0.8])
     env.reset()
     img_list = []
@@ -936,495 +1383,324 @@ def animate_motion_with_media(env,p_root_list,quat_root_list,q_list,rev_joint_na
         env.render()
         # Append image
         img = env.grab_image()
-        img_list.append(img)
+        img_list.append(img.copy() if USE_OFFSCREEN else img) # offscreen image is a view
     # Close MuJoCo viewer
     env.close_viewer()
     # Make video
     media.show_video(img_list,fps=HZ)
 
+class VideoEncoderClass(object):
+    """
+        Streaming video encoder
+        Frames are pushed into a bounded queue and written to an MP4 file by a background thread
+        (memory stays constant regardless of the clip length, rendering overlaps with encoding)
+        encoder = VideoEncoderClass(video_path='a.mp4',shape=(800,1200),fps=30)
+        encoder.add_frame(img)
+        ~~
+        encoder.close()
+    """
+    def __init__(self,video_path,shape,fps=30,queue_size=16,VERBOSE=True):
+        """
+            Initialize encoder thread
+        """
+        self.video_path = video_path
+        self.shape      = shape # (height,width)
+        self.fps        = fps
+        self.VERBOSE    = VERBOSE
+        self.n_frame    = 0
+        self.error      = None
+        self.queue      = queue.Queue(maxsize=queue_size)
+        self.thread     = threading.Thread(target=self._encode,daemon=True)
+        self.thread.start()
+
+    def _encode(self):
+        """
+            Encoder loop (runs on the background thread)
+        """
+        try:
+            with media.VideoWriter(self.video_path,shape=self.shape,fps=self.fps) as writer:
+                while True:
+                    frame = self.queue.get()
+                    if frame is None: break # end of stream
+                    writer.add_image(frame)
+        except Exception as e:
+            self.error = e
+
+    def add_frame(self,frame):
+        """
+            Push a frame (copied, so views of reused render buffers are safe)
+            Blocks while the queue is full
+        """
+        frame = np.array(frame,dtype=np.uint8,copy=True)
+        while True:
+            if self.error is not None:
+                raise RuntimeError("[VideoEncoderClass] encoder failed. %s"%(self.error))
+            try:
+                self.queue.put(frame,timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.n_frame = self.n_frame + 1
+
+    def close(self):
+        """
+            Flush remaining frames and finalize the video file
+        """
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None,timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("[VideoEncoderClass] encoder failed. %s"%(self.error))
+        if self.VERBOSE:
+            print ("[%s] saved. n_frame:[%d]"%(self.video_path,self.n_frame))
+
+def animate_motion_with_media_stream(env,p_root_list,quat_root_list,q_list,rev_joint_names,HZ,
+                                     video_path='../video/motion.mp4',viewer_distance=3.0,
+                                     viewer_width=1200,viewer_height=800,queue_size=16,
+                                     USE_OFFSCREEN=True,SHOW_VIDEO=False):
+    """
+        Animate motion and stream frames into an MP4 file
+        (streaming variant of 'animate_motion_with_media' with constant memory usage)
+        - SHOW_VIDEO: embed the encoded MP4 file in the notebook (frames are not decoded back into memory)
+    """
+    # Initialize viewer
+    L              = q_list.shape[0]
+    joint_idxs_fwd = env.get_idxs_fwd(joint_names=rev_joint_names)
+    if USE_OFFSCREEN:
+        env.init_offscreen_viewer(viewer_width=viewer_width,viewer_height=viewer_height,FONTSCALE_VALUE=200)
+    else:
+        env.init_viewer(viewer_title='Common Rig',viewer_width=viewer_width,viewer_height=viewer_height,
+                        viewer_hide_menus=True,FONTSCALE_VALUE=200)
+    env.update_viewer(azimuth=152,distance=viewer_distance,elevation=-30,lookat=[0.02,-0.03,0.8])
+    env.reset()
+    # Initialize encoder
+    create_folder_if_not_exists(video_path)
+    encoder = VideoEncoderClass(
+        video_path=video_path,shape=(env.viewer.viewport.height,env.viewer.viewport.width),
+        fps=HZ,queue_size=queue_size)
+    try:
+        for tick in range(L):
+            # FK
+            q         = q_list[tick,:] # [35]
+            p_root    = p_root_list[tick,:] # [3]
+            quat_root = quat_root_list[tick,:] # [4] quaternion
+            env.set_p_root(root_name='base',p=p_root)
+            env.set_quat_root(root_name='base',quat=quat_root)
+            env.forward(q=q,joint_idxs=joint_idxs_fwd)
+            # Render
+            env.plot_T(p=np.zeros(3),R=np.eye(3,3),
+                    PLOT_AXIS=True,axis_len=0.5,axis_width=0.005)
+            env.plot_T(p=np.array([0,0,0.5]),R=np.eye(3,3),
+                    PLOT_AXIS=False,label="tick:[%d]"%(tick))
+            env.plot_geom_T(geom_name='rfoot',axis_len=0.3)
+            env.plot_geom_T(geom_name='lfoot',axis_len=0.3)
+            env.plot_joint_axis(axis_len=0.1,axis_r=0.01)    
+            env.render()
+            # Push image to the encoder
+            encoder.add_frame(env.grab_image())
+    finally:
+        # Close MuJoCo viewer and finalize video
+        env.close_viewer()
+        encoder.close()
+    # Show video
+    if SHOW_VIDEO:
+        from IPython.display import Video,display
+        display(Video(video_path,embed=True,width=viewer_width//2))
+    return video_path
+
 ### extra functions
 
 def rpy2R(r0, order=[0,1,2]):
-    c1 = np.math.cos(r0[0]); c2 = np.math.cos(r0[1]); c3 = np.math.cos(r0[2])
-    s1 = np.math.sin(r0[0]); s2 = np.math.sin(r0[1]); s3 = np.math.sin(r0[2])
-
-    a1 = np.array([[1,0,0],[0,c1,-s1],[0,s1,c1]])
-    a2 = np.array([[c2,0,s2],[0,1,0],[-s2,0,c2]])
-    a3 = np.array([[c3,-s3,0],[s3,c3,0],[0,0,1]])
+    """
+        Product of elementary rotations about x, y, and z in 'order' (see 'rotation.euler2r')
+    """
+    return rotation.euler2r(r0,order=order)
 
-    a_list = [a1,a2,a3]
-    a = np.matmul(np.matmul(a_list[order[0]],a_list[order[1]]),a_list[order[2]])
+_spec_rigs = {}
 
-    assert a.shape == (3,3)
-    return a
+def _get_spec_rig(name):
+    """
+        Private rig of a built-in spec with the spec lengths (not shared with 'load_retarget_rig' callers)
+    """
+    if name not in _spec_rigs:
+        _spec_rigs[name] = load_retarget_rig(name)
+    return _spec_rigs[name]
 
 def get_uv_dict_em(p):
-    uv_dict = {}
-
-    # Upper Body
-    uv_dict['root2spine'] = np_uv(p[11,:] - p[0,:])
-    uv_dict['spine2neck'] = np_uv(p[13,:] - p[11,:])
-    uv_dict['neck2rs'] = np_uv(p[17,:] - p[13,:])
-    uv_dict['rs2re'] = np_uv(p[18,:] - p[17,:])
-    uv_dict['re2rw'] = np_uv(p[19,:] - p[18,:])
-    uv_dict['neck2ls'] = np_uv(p[45,:] - p[13,:])
-    uv_dict['ls2le'] = np_uv(p[46,:] - p[45,:])
-    uv_dict['le2lw'] = np_uv(p[47,:] - p[46,:])
-
-    # Lower Body
-    uv_dict['root2rp'] = np_uv(p[1,:] - p[0,:])
-    uv_dict['rp2rk'] = np_uv(p[2,:] - p[1,:])
-    uv_dict['rk2ra'] = np_uv(p[3,:] - p[2,:])
-    uv_dict['root2lp'] = np_uv(p[5,:] - p[0,:])
-    uv_dict['lp2lk'] = np_uv(p[6,:] - p[5,:])
-    uv_dict['lk2la'] = np_uv(p[7,:] - p[6,:])
-
-    # Right Hand
-    uv_dict['rw2r1meta'] = np_uv(p[20,:] - p[19,:])
-    uv_dict['rw2r2meta'] = np_uv(p[24,:] - p[19,:])
-    uv_dict['rw2r3meta'] = np_uv(p[29,:] - p[19,:])
-    uv_dict['rw2r4meta'] = np_uv(p[34,:] - p[19,:])
-    uv_dict['rw2r5meta'] = np_uv(p[39,:] - p[19,:])
-    ## Thumb
-    uv_dict['r1meta2r1prox'] = np_uv(p[21,:] - p[20,:])
-    uv_dict['r1prox2r1dist'] = np_uv(p[22,:] - p[21,:])
-    uv_dict['r1dist2r1tip'] = np_uv(p[23,:] - p[22,:])
-    ## Index
-    uv_dict['r2meta2r2prox'] = np_uv(p[25,:] - p[24,:])
-    uv_dict['r2prox2r2med'] = np_uv(p[26,:] - p[25,:])
-    uv_dict['r2med2r2dist'] = np_uv(p[27,:] - p[26,:])
-    uv_dict['r2dist2r2tip'] = np_uv(p[28,:] - p[27,:])
-    ## Middle
-    uv_dict['r3meta2r3prox'] = np_uv(p[30,:] - p[29,:])
-    uv_dict['r3prox2r3med'] = np_uv(p[31,:] - p[30,:])
-    uv_dict['r3med2r3dist'] = np_uv(p[32,:] - p[31,:])
-    uv_dict['r3dist2r3tip'] = np_uv(p[33,:] - p[32,:])
-    ## Ring
-    uv_dict['r4meta2r4prox'] = np_uv(p[35,:] - p[34,:])
-    uv_dict['r4prox2r4med'] = np_uv(p[36,:] - p[35,:])
-    uv_dict['r4med2r4dist'] = np_uv(p[37,:] - p[36,:])
-    uv_dict['r4dist2r4tip'] = np_uv(p[38,:] - p[37,:])
-    ## Pinky
-    uv_dict['r5meta2r5prox'] = np_uv(p[40,:] - p[39,:])
-    uv_dict['r5prox2r5med'] = np_uv(p[41,:] - p[40,:])
-    uv_dict['r5med2r5dist'] = np_uv(p[42,:] - p[41,:])
-    uv_dict['r5dist2r5tip'] = np_uv(p[43,:] - p[42,:])
-
-    # Left Hand
-    uv_dict['lw2l1meta'] = np_uv(p[48,:] - p[47,:])
-    uv_dict['lw2l2meta'] = np_uv(p[52,:] - p[47,:])
-    uv_dict['lw2l3meta'] = np_uv(p[57,:] - p[47,:])
-    uv_dict['lw2l4meta'] = np_uv(p[62,:] - p[47,:])
-    uv_dict['lw2l5meta'] = np_uv(p[67,:] - p[47,:])
-    ## Thumb
-    uv_dict['l1meta2l1prox'] = np_uv(p[49,:] - p[48,:])
-    uv_dict['l1prox2l1dist'] = np_uv(p[50,:] - p[49,:])
-    uv_dict['l1dist2l1tip'] = np_uv(p[51,:] - p[50,:])
-    ## Index
-    uv_dict['l2meta2l2prox'] = np_uv(p[53,:] - p[52,:])
-    uv_dict['l2prox2l2med'] = np_uv(p[54,:] - p[53,:])
-    uv_dict['l2med2l2dist'] = np_uv(p[55,:] - p[54,:])
-    uv_dict['l2dist2l2tip'] = np_uv(p[56,:] - p[55,:])
-    ## Middle
-    uv_dict['l3meta2l3prox'] = np_uv(p[58,:] - p[57,:])
-    uv_dict['l3prox2l3med'] = np_uv(p[59,:] - p[58,:])
-    uv_dict['l3med2l3dist'] = np_uv(p[60,:] - p[59,:])
-    uv_dict['l3dist2l3tip'] = np_uv(p[61,:] - p[60,:])
-    ## Ring
-    uv_dict['l4meta2l4prox'] = np_uv(p[63,:] - p[62,:])
-    uv_dict['l4prox2l4med'] = np_uv(p[64,:] - p[63,:])
-    uv_dict['l4med2l4dist'] = np_uv(p[65,:] - p[64,:])
-    uv_dict['l4dist2l4tip'] = np_uv(p[66,:] - p[65,:])
-    ## Pinky
-    uv_dict['l5meta2l5prox'] = np_uv(p[68,:] - p[67,:])
-    uv_dict['l5prox2l5med'] = np_uv(p[69,:] - p[68,:])
-    uv_dict['l5med2l5dist'] = np_uv(p[70,:] - p[69,:])
-    uv_dict['l5dist2l5tip'] = np_uv(p[71,:] - p[70,:])
-
-    return uv_dict
+    """
+        Bone unit vectors of EmotionMocap keypoints [J x 3] (see 'retarget.py' and 'asset/retarget/em.json')
+    """
+    return _get_spec_rig('em').get_uv_dict(p=p)
 
 def get_p_target_em(p, uv_dict):
-    len_rig = {}
-    len_rig['root2spine'] = 0.1990
-    len_rig['spine2neck'] = 0.1990
-    len_rig['neck2rs'] = 0.1809
-    len_rig['rs2re'] = 0.2768
-    len_rig['re2rw'] = 0.1815
-    len_rig['neck2ls'] = 0.1809
-    len_rig['ls2le'] = 0.2768
-    len_rig['le2lw'] = 0.1815
-    len_rig['root2rp'] = 0.1357
-    len_rig['rp2rk'] = 0.4049
-    len_rig['rk2ra'] = 0.4057
-    len_rig['root2lp'] = 0.1357
-    len_rig['lp2lk'] = 0.4049
-    len_rig['lk2la'] = 0.4057
-
-    p_target = {}
-    p_target['right_pelvis'] = p[0,:] + len_rig['root2rp'] * uv_dict['root2rp']
-    p_target['right_knee'] = p_target['right_pelvis'] + len_rig['rp2rk'] * uv_dict['rp2rk']
-    p_target['right_ankle'] = p_target['right_knee'] + len_rig['rk2ra'] * uv_dict['rk2ra']
-    p_target['left_pelvis'] = p[0,:] + len_rig['root2lp'] * uv_dict['root2lp']
-    p_target['left_knee'] = p_target['left_pelvis'] + len_rig['lp2lk'] * uv_dict['lp2lk']
-    p_target['left_ankle'] = p_target['left_knee'] + len_rig['lk2la'] * uv_dict['lk2la']
-    p_target['spine'] = p[0,:] + len_rig['root2spine'] * uv_dict['root2spine']
-    p_target['neck'] = p_target['spine'] + len_rig['spine2neck'] * uv_dict['spine2neck']
-    p_target['right_shoulder'] = p_target['neck'] + len_rig['neck2rs'] * uv_dict['neck2rs']
-    p_target['right_elbow'] = p_target['right_shoulder'] + len_rig['rs2re'] * uv_dict['rs2re']
-    p_target['right_hand'] = p_target['right_elbow'] + len_rig['re2rw'] * uv_dict['re2rw']
-    p_target['left_shoulder'] = p_target['neck'] + len_rig['neck2ls'] * uv_dict['neck2ls']
-    p_target['left_elbow'] = p_target['left_shoulder'] + len_rig['ls2le'] * uv_dict['ls2le']
-    p_target['left_hand'] = p_target['left_elbow'] + len_rig['le2lw'] * uv_dict['le2lw']
-
-    len_rig['rw2r1meta'] = 0.0411049
-    len_rig['rw2r2meta'] = 0.0392563
-    len_rig['rw2r3meta'] = 0.0360309
-    len_rig['rw2r4meta'] = 0.0350433
-    len_rig['rw2r5meta'] = 0.0351108
-
-    len_rig['r1meta2r1prox'] = 0.03788
-    len_rig['r1prox2r1dist'] = 0.02631
-    len_rig['r1dist2r1tip'] = 0.02256
-
-    len_rig['r2meta2r2prox'] = 0.0546439
-    len_rig['r2prox2r2med'] = 0.03723
-    len_rig['r2med2r2dist'] = 0.02111
-    len_rig['r2dist2r2tip'] = 0.01857
-
-    len_rig['r3meta2r3prox'] = 0.0533249
-    len_rig['r3prox2r3med'] = 0.04062
-    len_rig['r3med2r3dist'] = 0.02547
-    len_rig['r3dist2r3tip'] = 0.02031
-
-    len_rig['r4meta2r4prox'] = 0.0479248
-    len_rig['r4prox2r4med'] = 0.03541
-    len_rig['r4med2r4dist'] = 0.02456
-    len_rig['r4dist2r4tip'] = 0.01910
-
-    len_rig['r5meta2r5prox'] = 0.0440437
-    len_rig['r5prox2r5med'] = 0.02835
-    len_rig['r5med2r5dist'] = 0.01792
-    len_rig['r5dist2r5tip'] = 0.01692
-
-    len_rig['lw2l1meta'] = 0.0411049
-    len_rig['lw2l2meta'] = 0.0392563
-    len_rig['lw2l3meta'] = 0.0360309
-    len_rig['lw2l4meta'] = 0.0350433
-    len_rig['lw2l5meta'] = 0.0351108
-
-    len_rig['l1meta2l1prox'] = 0.03788
-    len_rig['l1prox2l1dist'] = 0.02631
-    len_rig['l1dist2l1tip'] = 0.02256
-
-    len_rig['l2meta2l2prox'] = 0.0546439
-    len_rig['l2prox2l2med'] = 0.03723
-    len_rig['l2med2l2dist'] = 0.02111
-    len_rig['l2dist2l2tip'] = 0.01857
-
-    len_rig['l3meta2l3prox'] = 0.0533249
-    len_rig['l3prox2l3med'] = 0.04062
-    len_rig['l3med2l3dist'] = 0.02547
-    len_rig['l3dist2l3tip'] = 0.02031
-
-    len_rig['l4meta2l4prox'] = 0.0479248
-    len_rig['l4prox2l4med'] = 0.03541
-    len_rig['l4med2l4dist'] = 0.02456
-    len_rig['l4dist2l4tip'] = 0.01910
-
-    len_rig['l5meta2l5prox'] = 0.0440437
-    len_rig['l5prox2l5med'] = 0.02835
-    len_rig['l5med2l5dist'] = 0.01792
-    len_rig['l5dist2l5tip'] = 0.01692
-
-    p_target['rh_meta_1'] = p_target['right_hand'] + len_rig['rw2r1meta'] * uv_dict['rw2r1meta']
-    p_target['rh_meta_2'] = p_target['right_hand'] + len_rig['rw2r2meta'] * uv_dict['rw2r2meta']
-    p_target['rh_meta_3'] = p_target['right_hand'] + len_rig['rw2r3meta'] * uv_dict['rw2r3meta']
-    p_target['rh_meta_4'] = p_target['right_hand'] + len_rig['rw2r4meta'] * uv_dict['rw2r4meta']
-    p_target['rh_meta_5'] = p_target['right_hand'] + len_rig['rw2r5meta'] * uv_dict['rw2r5meta']
-    
-    p_target['rh_prox_1'] = p_target['rh_meta_1'] + len_rig['r1meta2r1prox'] * uv_dict['r1meta2r1prox']
-    p_target['rh_dist_1'] = p_target['rh_prox_1'] + len_rig['r1prox2r1dist'] * uv_dict['r1prox2r1dist']
-    p_target['rh_tip_1'] = p_target['rh_dist_1'] + len_rig['r1dist2r1tip'] * uv_dict['r1dist2r1tip']
-
-    p_target['rh_prox_2'] = p_target['rh_meta_2'] + len_rig['r2meta2r2prox'] * uv_dict['r2meta2r2prox']
-    p_target['rh_med_2'] = p_target['rh_prox_2'] + len_rig['r2prox2r2med'] * uv_dict['r2prox2r2med']
-    p_target['rh_dist_2'] = p_target['rh_med_2'] + len_rig['r2med2r2dist'] * uv_dict['r2med2r2dist']
-    p_target['rh_tip_2'] = p_target['rh_dist_2'] + len_rig['r2dist2r2tip'] * uv_dict['r2dist2r2tip']
-
-    p_target['rh_prox_3'] = p_target['rh_meta_3'] + len_rig['r3meta2r3prox'] * uv_dict['r3meta2r3prox']
-    p_target['rh_med_3'] = p_target['rh_prox_3'] + len_rig['r3prox2r3med'] * uv_dict['r3prox2r3med']
-    p_target['rh_dist_3'] = p_target['rh_med_3'] + len_rig['r3med2r3dist'] * uv_dict['r3med2r3dist']
-    p_target['rh_tip_3'] = p_target['rh_dist_3'] + len_rig['r3dist2r3tip'] * uv_dict['r3dist2r3tip']
-
-    p_target['rh_prox_4'] = p_target['rh_meta_4'] + len_rig['r4meta2r4prox'] * uv_dict['r4meta2r4prox']
-    p_target['rh_med_4'] = p_target['rh_prox_4'] + len_rig['r4prox2r4med'] * uv_dict['r4prox2r4med']
-    p_target['rh_dist_4'] = p_target['rh_med_4'] + len_rig['r4med2r4dist'] * uv_dict['r4med2r4dist']
-    p_target['rh_tip_4'] = p_target['rh_dist_4'] + len_rig['r4dist2r4tip'] * uv_dict['r4dist2r4tip']
-
-    p_target['rh_prox_5'] = p_target['rh_meta_5'] + len_rig['r5meta2r5prox'] * uv_dict['r5meta2r5prox']
-    p_target['rh_med_5'] = p_target['rh_prox_5'] + len_rig['r5prox2r5med'] * uv_dict['r5prox2r5med']
-    p_target['rh_dist_5'] = p_target['rh_med_5'] + len_rig['r5med2r5dist'] * uv_dict['r5med2r5dist']
-    p_target['rh_tip_5'] = p_target['rh_dist_5'] + len_rig['r5dist2r5tip'] * uv_dict['r5dist2r5tip']
-
-    p_target['lh_meta_1'] = p_target['left_hand'] + len_rig['lw2l1meta'] * uv_dict['lw2l1meta']
-    p_target['lh_meta_2'] = p_target['left_hand'] + len_rig['lw2l2meta'] * uv_dict['lw2l2meta']
-    p_target['lh_meta_3'] = p_target['left_hand'] + len_rig['lw2l3meta'] * uv_dict['lw2l3meta']
-    p_target['lh_meta_4'] = p_target['left_hand'] + len_rig['lw2l4meta'] * uv_dict['lw2l4meta']
-    p_target['lh_meta_5'] = p_target['left_hand'] + len_rig['lw2l5meta'] * uv_dict['lw2l5meta']
-
-    p_target['lh_prox_1'] = p_target['lh_meta_1'] + len_rig['l1meta2l1prox'] * uv_dict['l1meta2l1prox']
-    p_target['lh_dist_1'] = p_target['lh_prox_1'] + len_rig['l1prox2l1dist'] * uv_dict['l1prox2l1dist']
-    p_target['lh_tip_1'] = p_target['lh_dist_1'] + len_rig['l1dist2l1tip'] * uv_dict['l1dist2l1tip']
-
-    p_target['lh_prox_2'] = p_target['lh_meta_2'] + len_rig['l2meta2l2prox'] * uv_dict['l2meta2l2prox']
-    p_target['lh_med_2'] = p_target['lh_prox_2'] + len_rig['l2prox2l2med'] * uv_dict['l2prox2l2med']
-    p_target['lh_dist_2'] = p_target['lh_med_2'] + len_rig['l2med2l2dist'] * uv_dict['l2med2l2dist']
-    p_target['lh_tip_2'] = p_target['lh_dist_2'] + len_rig['l2dist2l2tip'] * uv_dict['l2dist2l2tip']
-
-    p_target['lh_prox_3'] = p_target['lh_meta_3'] + len_rig['l3meta2l3prox'] * uv_dict['l3meta2l3prox']
-    p_target['lh_med_3'] = p_target['lh_prox_3'] + len_rig['l3prox2l3med'] * uv_dict['l3prox2l3med']
-    p_target['lh_dist_3'] = p_target['lh_med_3'] + len_rig['l3med2l3dist'] * uv_dict['l3med2l3dist']
-    p_target['lh_tip_3'] = p_target['lh_dist_3'] + len_rig['l3dist2l3tip'] * uv_dict['l3dist2l3tip']
-
-    p_target['lh_prox_4'] = p_target['lh_meta_4'] + len_rig['l4meta2l4prox'] * uv_dict['l4meta2l4prox']
-    p_target['lh_med_4'] = p_target['lh_prox_4'] + len_rig['l4prox2l4med'] * uv_dict['l4prox2l4med']
-    p_target['lh_dist_4'] = p_target['lh_med_4'] + len_rig['l4med2l4dist'] * uv_dict['l4med2l4dist']
-    p_target['lh_tip_4'] = p_target['lh_dist_4'] + len_rig['l4dist2l4tip'] * uv_dict['l4dist2l4tip']
-
-    p_target['lh_prox_5'] = p_target['lh_meta_5'] + len_rig['l5meta2l5prox'] * uv_dict['l5meta2l5prox']
-    p_target['lh_med_5'] = p_target['lh_prox_5'] + len_rig['l5prox2l5med'] * uv_dict['l5prox2l5med']
-    p_target['lh_dist_5'] = p_target['lh_med_5'] + len_rig['l5med2l5dist'] * uv_dict['l5med2l5dist']
-    p_target['lh_tip_5'] = p_target['lh_dist_5'] + len_rig['l5dist2l5tip'] * uv_dict['l5dist2l5tip']
-
-    return p_target
+    """
+        Common rig targets from EmotionMocap keypoints and bone unit vectors
+    """
+    return _get_spec_rig('em').get_p_target_dict(p,uv_dict)
 
 def get_uv_dict_myohuman(p):
-    uv_dict = {}
-
-    # Lower Body
-    uv_dict['pelvis2femur_r'] = np_uv(p[1,:] - p[0,:])
-    uv_dict['femur_r2tibia_r'] = np_uv(p[2,:] - p[1,:])
-    uv_dict['tibia_r2talus_r'] = np_uv(p[3,:] - p[2,:])
-    uv_dict['pelvis2femur_l'] = np_uv(p[5,:] - p[0,:])
-    uv_dict['femur_l2tibia_l'] = np_uv(p[6,:] - p[5,:])
-    uv_dict['tibia_l2talus_l'] = np_uv(p[7,:] - p[6,:])
-    
-    # Upper Body
-    uv_dict['pelvis2torso'] = np_uv(p[9,:] - p[0,:])
-    uv_dict['torso2humerus_r'] = np_uv(p[17,:] - p[9,:])
-    uv_dict['humerus_r2radius'] = np_uv(p[18,:] - p[17,:])
-    uv_dict['radius2lunate'] = np_uv(p[19,:] - p[18,:])
-    uv_dict['torso2humerus_l'] = np_uv(p[45,:] - p[9,:])
-    uv_dict['humerus_l2radius_l'] = np_uv(p[46,:] - p[45,:])
-    uv_dict['radius_l2lunate_l'] = np_uv(p[47,:] - p[46,:])
-
-    return uv_dict
+    """
+        Bone unit vectors of EmotionMocap keypoints for the MyoHuman rig
+    """
+    return _get_spec_rig('myohuman').get_uv_dict(p=p)
 
 def get_p_target_myohuman(p, uv_dict):
-    len_rig = {}
-    len_rig['pelvis2femur_r'] = 0.12368013533304369
-    len_rig['femur_r2tibia_r'] = 0.4044269792040081
-    len_rig['tibia_r2talus_r'] = 0.4001249804748512
-    len_rig['pelvis2femur_l'] = 0.12368013533304369
-    len_rig['femur_l2tibia_l'] = 0.4044269792040081
-    len_rig['tibia_l2talus_l'] = 0.4001249804748512
-    len_rig['pelvis2torso'] = 0.12954821496261537
-    len_rig['torso2humerus_r'] = 0.408561138662257
-    len_rig['humerus_r2radius'] = 0.3003331483536241
-    len_rig['radius2lunate'] = 0.2439528642996429
-    len_rig['torso2humerus_l'] = 0.408561138662257
-    len_rig['humerus_l2radius_l'] = 0.3003331483536241
-    len_rig['radius_l2lunate_l'] = 0.2439528642996429
-
-    p_target = {}
-    p_target['femur_r'] = p[0,:] + len_rig['pelvis2femur_r'] * uv_dict['pelvis2femur_r']
-    p_target['tibia_r'] = p_target['femur_r'] + len_rig['femur_r2tibia_r'] * uv_dict['femur_r2tibia_r']
-    p_target['talus_r'] = p_target['tibia_r'] + len_rig['tibia_r2talus_r'] * uv_dict['tibia_r2talus_r']
-    p_target['femur_l'] = p[0,:] + len_rig['pelvis2femur_l'] * uv_dict['pelvis2femur_l']
-    p_target['tibia_l'] = p_target['femur_l'] + len_rig['femur_l2tibia_l'] * uv_dict['femur_l2tibia_l']
-    p_target['talus_l'] = p_target['tibia_l'] + len_rig['tibia_l2talus_l'] * uv_dict['tibia_l2talus_l']
-    p_target['torso'] = p[0,:] + len_rig['pelvis2torso'] * uv_dict['pelvis2torso']
-    p_target['humerus_r'] = p_target['torso'] + len_rig['torso2humerus_r'] * uv_dict['torso2humerus_r']
-    p_target['radius'] = p_target['humerus_r'] + len_rig['humerus_r2radius'] * uv_dict['humerus_r2radius']
-    p_target['lunate'] = p_target['radius'] + len_rig['radius2lunate'] * uv_dict['radius2lunate']
-    p_target['humerus_l'] = p_target['torso'] + len_rig['torso2humerus_l'] * uv_dict['torso2humerus_l']
-    p_target['radius_l'] = p_target['humerus_l'] + len_rig['humerus_l2radius_l'] * uv_dict['humerus_l2radius_l']
-    p_target['lunate_l'] = p_target['radius_l'] + len_rig['radius_l2lunate_l'] * uv_dict['radius_l2lunate_l']
-    
-    return p_target
+    """
+        MyoHuman targets from EmotionMocap keypoints and bone unit vectors
+    """
+    return _get_spec_rig('myohuman').get_p_target_dict(p,uv_dict)
 
 def get_uv_dict_smpl(p):
-    uv_dict = {}
-
-    # Lower Body
-    # uv_dict['pelvis2right_hip'] = np_uv(p[1,:] - p[0,:])
-    # uv_dict['right_hip2right_knee'] = np_uv(p[2,:] - p[1,:])
-    # uv_dict['right_knee2right_ankle'] = np_uv(p[3,:] - p[2,:])
-    # uv_dict['pelvis2left_hip'] = np_uv(p[5,:] - p[0,:])
-    # uv_dict['left_hip2left_knee'] = np_uv(p[6,:] - p[5,:])
-    # uv_dict['left_knee2left_ankle'] = np_uv(p[7,:] - p[6,:])
-
-    uv_dict['base2right_pelvis'] = np_uv(p[68,:] - p[0,:])
-    uv_dict['right_pelvis2right_knee'] = np_uv(p[69,:] - p[68,:])
-    uv_dict['right_knee2right_ankle'] = np_uv(p[70,:] - p[69,:])
-    uv_dict['base2left_pelvis'] = np_uv(p[64,:] - p[0,:])
-    uv_dict['left_pelvis2left_knee'] = np_uv(p[65,:] - p[64,:])
-    uv_dict['left_knee2left_ankle'] = np_uv(p[66,:] - p[65,:])
-    
-    # Upper Body
-    # uv_dict['pelvis2spine'] = np_uv(p[9,:] - p[0,:])
-    # uv_dict['spine2right_shoulder'] = np_uv(p[17,:] - p[9,:])
-    # uv_dict['right_shoulder2right_elbow'] = np_uv(p[18,:] - p[17,:])
-    # uv_dict['right_elbow2right_wrist'] = np_uv(p[19,:] - p[18,:])
-    # uv_dict['spine2left_shoulder'] = np_uv(p[45,:] - p[9,:])
-    # uv_dict['left_shoulder2left_elbow'] = np_uv(p[46,:] - p[45,:])
-    # uv_dict['left_elbow2left_wrist'] = np_uv(p[47,:] - p[46,:])
-
-    uv_dict['base2spine'] = np_uv(p[1,:] - p[0,:])
-    uv_dict['spine2right_shoulder'] = np_uv(p[34,:] - p[1,:])
-    uv_dict['right_shoulder2right_elbow'] = np_uv(p[35,:] - p[34,:])
-    uv_dict['right_elbow2right_wrist'] = np_uv(p[36,:] - p[35,:])
-    uv_dict['spine2left_shoulder'] = np_uv(p[6,:] - p[1,:])
-    uv_dict['left_shoulder2left_elbow'] = np_uv(p[7,:] - p[6,:])
-    uv_dict['left_elbow2left_wrist'] = np_uv(p[8,:] - p[7,:])
-
-    return uv_dict
+    """
+        Bone unit vectors of keypoints [J x 3] for the SMPL rig
+    """
+    return _get_spec_rig('smpl').get_uv_dict(p=p)
 
 def get_uv_dict_smpl_cmu(r):
-    uv_dict = {}
-
-    # Lower Body
-    # uv_dict['pelvis2right_hip'] = np_uv(p[1,:] - p[0,:])
-    # uv_dict['right_hip2right_knee'] = np_uv(p[2,:] - p[1,:])
-    # uv_dict['right_knee2right_ankle'] = np_uv(p[3,:] - p[2,:])
-    # uv_dict['pelvis2left_hip'] = np_uv(p[5,:] - p[0,:])
-    # uv_dict['left_hip2left_knee'] = np_uv(p[6,:] - p[5,:])
-    # uv_dict['left_knee2left_ankle'] = np_uv(p[7,:] - p[6,:])
-
-    uv_dict['base2right_pelvis'] = np_uv(r[27]) # np_uv(p[68,:] - p[0,:])
-    uv_dict['right_pelvis2right_knee'] = np_uv(r[28]) # np_uv(p[69,:] - p[68,:])
-    uv_dict['right_knee2right_ankle'] = np_uv(r[29]) # np_uv(p[70,:] - p[69,:])
-    uv_dict['base2left_pelvis'] = np_uv(r[33]) # np_uv(p[64,:] - p[0,:])
-    uv_dict['left_pelvis2left_knee'] = np_uv(r[34]) # np_uv(p[65,:] - p[64,:])
-    uv_dict['left_knee2left_ankle'] = np_uv(r[35]) # np_uv(p[66,:] - p[65,:])
-    
-    # Upper Body
-    # uv_dict['pelvis2spine'] = np_uv(p[9,:] - p[0,:])
-    # uv_dict['spine2right_shoulder'] = np_uv(p[17,:] - p[9,:])
-    # uv_dict['right_shoulder2right_elbow'] = np_uv(p[18,:] - p[17,:])
-    # uv_dict['right_elbow2right_wrist'] = np_uv(p[19,:] - p[18,:])
-    # uv_dict['spine2left_shoulder'] = np_uv(p[45,:] - p[9,:])
-    # uv_dict['left_shoulder2left_elbow'] = np_uv(p[46,:] - p[45,:])
-    # uv_dict['left_elbow2left_wrist'] = np_uv(p[47,:] - p[46,:])
-
-    uv_dict['base2spine'] = np_uv(r[3]) # np_uv(p[1,:] - p[0,:])
-    uv_dict['spine2right_shoulder'] = np_uv(r[5]) # np_uv(p[34,:] - p[1,:])
-    uv_dict['right_shoulder2right_elbow'] = np_uv(r[6]) # np_uv(p[35,:] - p[34,:])
-    uv_dict['right_elbow2right_wrist'] = np_uv(r[7]) # np_uv(p[36,:] - p[35,:])
-    uv_dict['spine2left_shoulder'] = np_uv(r[14]) # np_uv(p[6,:] - p[1,:])
-    uv_dict['left_shoulder2left_elbow'] = np_uv(r[15]) # np_uv(p[7,:] - p[6,:])
-    uv_dict['left_elbow2left_wrist'] = np_uv(r[16]) # np_uv(p[8,:] - p[7,:])
-
-    return uv_dict
-
+    """
+        Bone unit vectors of CMU bvh direction vectors [J x 3] for the SMPL rig
+    """
+    return _get_spec_rig('smpl_cmu').get_uv_dict(v=r)
 
 def get_p_target_smpl(p, uv_dict):
-    len_rig = {}
-    len_rig['base2right_pelvis'] = 0.11504147358444483
-    len_rig['right_pelvis2right_knee'] = 0.37678782215893153
-    len_rig['right_knee2right_ankle'] = 0.40058266700996176
-    len_rig['base2left_pelvis'] = 0.11504147358444483
-    len_rig['left_pelvis2left_knee'] = 0.37678782215893153
-    len_rig['left_knee2left_ankle'] = 0.40058266700996176
-    len_rig['base2spine'] = 0.1122145063476423
-    len_rig['spine2right_shoulder'] = 0.38384200442376404
-    len_rig['right_shoulder2right_elbow'] = 0.261372309763501
-    len_rig['right_elbow2right_wrist'] = 0.24939829355374343
-    len_rig['spine2left_shoulder'] = 0.38384200442376404
-    len_rig['left_shoulder2left_elbow'] = 0.261372309763501
-    len_rig['left_elbow2left_wrist'] = 0.24939829355374343
-
-    p_target = {}
-    p_target['right_pelvis'] = p[0,:] + len_rig['base2right_pelvis'] * uv_dict['base2right_pelvis']
-    p_target['right_knee'] = p_target['right_pelvis'] + len_rig['right_pelvis2right_knee'] * uv_dict['right_pelvis2right_knee']
-    p_target['right_ankle'] = p_target['right_knee'] + len_rig['right_knee2right_ankle'] * uv_dict['right_knee2right_ankle']
-    p_target['left_pelvis'] = p[0,:] + len_rig['base2left_pelvis'] * uv_dict['base2left_pelvis']
-    p_target['left_knee'] = p_target['left_pelvis'] + len_rig['left_pelvis2left_knee'] * uv_dict['left_pelvis2left_knee']
-    p_target['left_ankle'] = p_target['left_knee'] + len_rig['left_knee2left_ankle'] * uv_dict['left_knee2left_ankle']
-    p_target['spine1'] = p[0,:] + len_rig['base2spine'] * uv_dict['base2spine']
-    p_target['right_shoulder'] = p_target['spine1'] + len_rig['spine2right_shoulder'] * uv_dict['spine2right_shoulder']
-    p_target['right_elbow'] = p_target['right_shoulder'] + len_rig['right_shoulder2right_elbow'] * uv_dict['right_shoulder2right_elbow']
-    p_target['right_wrist'] = p_target['right_elbow'] + len_rig['right_elbow2right_wrist'] * uv_dict['right_elbow2right_wrist']
-    p_target['left_shoulder'] = p_target['spine1'] + len_rig['spine2left_shoulder'] * uv_dict['spine2left_shoulder']
-    p_target['left_elbow'] = p_target['left_shoulder'] + len_rig['left_shoulder2left_elbow'] * uv_dict['left_shoulder2left_elbow']
-    p_target['left_wrist'] = p_target['left_elbow'] + len_rig['left_elbow2left_wrist'] * uv_dict['left_elbow2left_wrist']
-    
-    return p_target
+    """
+        SMPL rig targets from keypoints and bone unit vectors
+    """
+    return _get_spec_rig('smpl').get_p_target_dict(p,uv_dict)
 
-def finite_difference_matrix(n, dt, order):
+FD_COEFFS = {
+    1:np.array([-1.0,1.0]),          # velocity
+    2:np.array([1.0,-2.0,1.0]),      # acceleration
+    3:np.array([-1.0,3.0,-3.0,1.0]), # jerk
+}
+
+def finite_difference_matrix(n, dt, order, SPARSE=False):
     """
     n: number of points
     dt: time interval
     order: (1=velocity, 2=acceleration, 3=jerk)
+    SPARSE: return a 'scipy.sparse' banded (csr) matrix instead of a dense one
+    (the last 'order' rows are zero)
     """ 
     # Order
-    if order == 1:  # velocity
-        coeffs = np.array([-1, 1])
-    elif order == 2:  # acceleration
-        coeffs = np.array([1, -2, 1])
-    elif order == 3:  # jerk
-        coeffs = np.array([-1, 3, -3, 1])
-    else:
+    if order not in FD_COEFFS:
         raise ValueError("Order must be 1, 2, or 3.")
-
-    # Fill-in matrix
-    mat = np.zeros((n, n))
-    for i in range(n - order):
-        for j, c in enumerate(coeffs):
-            mat[i, i + j] = c
+    coeffs = FD_COEFFS[order]
+
+    # Fill-in diagonals
+    rows = np.arange(max(n-order,0))
+    if SPARSE:
+        mat = csr_matrix((np.repeat(coeffs,len(rows)),
+                          (np.tile(rows,order+1),np.add.outer(np.arange(order+1),rows).ravel())),shape=(n,n))
+        return mat / (dt ** order)
+    mat  = np.zeros((n, n))
+    for j, c in enumerate(coeffs):
+        mat[rows, rows + j] = c
     return mat / (dt ** order)
 
-def get_A_vel_acc_jerk(n=100,dt=1e-2):
+def finite_difference(x, dt, order, axis=0):
+    """
+        Matrix-free finite difference along 'axis', identical to 'finite_difference_matrix(n,dt,order) @ x'
+        (the last 'order' samples are zero)
+    """
+    if order not in FD_COEFFS:
+        raise ValueError("Order must be 1, 2, or 3.")
+    x   = np.moveaxis(np.asarray(x,dtype=np.float64),axis,0)
+    out = np.zeros_like(x)
+    if x.shape[0] > order:
+        out[:x.shape[0]-order] = np.diff(x,n=order,axis=0) / (dt ** order)
+    return np.moveaxis(out,0,axis)
+
+def get_A_vel_acc_jerk(n=100,dt=1e-2,SPARSE=False):
     """
         Get matrices to compute velocities, accelerations, and jerks
+        SPARSE: 'scipy.sparse' banded matrices (O(n) memory, use for long clips)
     """
-    A_vel  = finite_difference_matrix(n,dt,order=1)
-    A_acc  = finite_difference_matrix(n,dt,order=2)
-    A_jerk = finite_difference_matrix(n,dt,order=3)
+    A_vel  = finite_difference_matrix(n,dt,order=1,SPARSE=SPARSE)
+    A_acc  = finite_difference_matrix(n,dt,order=2,SPARSE=SPARSE)
+    A_jerk = finite_difference_matrix(n,dt,order=3,SPARSE=SPARSE)
     return A_vel,A_acc,A_jerk
 
-def slerp(q0, q1, t):
-    qx, qy, qz, qw = 0, 1, 2, 3
-
-    cos_half_theta = q0[..., qw] * q1[..., qw] \
-                   + q0[..., qx] * q1[..., qx] \
-                   + q0[..., qy] * q1[..., qy] \
-                   + q0[..., qz] * q1[..., qz]
-    
-    neg_mask = cos_half_theta < 0
-    q1 = q1.copy()
-    q1[neg_mask] = -q1[neg_mask]
-    cos_half_theta = np.abs(cos_half_theta)
-    cos_half_theta = np.expand_dims(cos_half_theta, axis=-1)
-
-    half_theta = np.arccos(cos_half_theta)
-    sin_half_theta = np.sqrt(1.0 - cos_half_theta * cos_half_theta)
+def smooth_min_jerk(x_list,dt,lam_jerk=1e-6,lam_acc=0.0,lam_vel=0.0,w_list=None):
+    """
+        Smooth trajectories [L x D] (or [L]) by minimizing, for every channel at once,
+        sum_t w_t*(x_t-x_list_t)^2 + lam_vel*||A_vel x||^2 + lam_acc*||A_acc x||^2 + lam_jerk*||A_jerk x||^2
+        - the normal equations are symmetric banded (bandwidth 3) and solved with 'solveh_banded' in O(L*D)
+        - 'w_list' [L]: per-frame fidelity weights (e.g., large values at the ends to pin them, default: 1)
+        - the regularization weights multiply squared differences (scaled by 1/dt^order) of each order
+    """
+    x_list = np.asarray(x_list,dtype=np.float64)
+    L = x_list.shape[0]
+    w_list = np.ones(L) if w_list is None else np.asarray(w_list,dtype=np.float64)
+    # Upper banded form of diag(w) + sum_k lam_k * A_k^T A_k
+    ab = np.zeros((4,L))
+    ab[3] = w_list
+    for order,lam in ((1,lam_vel),(2,lam_acc),(3,lam_jerk)):
+        if (lam == 0.0) or (L <= order): continue
+        coeffs,m = FD_COEFFS[order] / (dt ** order),L-order
+        for k in range(order+1): # (i,i+k) of A^T A collects c_j*c_(j+k) from rows i-j
+            for j in range(order+1-k):
+                ab[3-k,j+k:j+k+m] += lam*coeffs[j]*coeffs[j+k]
+    rhs = w_list.reshape((-1,)+(1,)*(x_list.ndim-1))*x_list
+    return solveh_banded(ab,rhs,lower=False)
 
-    ratioA = np.sin((1 - t) * half_theta) / sin_half_theta
-    ratioB = np.sin(t * half_theta) / sin_half_theta; 
-    
-    new_q_x = ratioA * q0[..., qx:qx+1] + ratioB * q1[..., qx:qx+1]
-    new_q_y = ratioA * q0[..., qy:qy+1] + ratioB * q1[..., qy:qy+1]
-    new_q_z = ratioA * q0[..., qz:qz+1] + ratioB * q1[..., qz:qz+1]
-    new_q_w = ratioA * q0[..., qw:qw+1] + ratioB * q1[..., qw:qw+1]
-
-    cat_dim = len(new_q_w.shape) - 1
-    new_q = np.concatenate([new_q_x, new_q_y, new_q_z, new_q_w], axis=cat_dim)
-
-    new_q = np.where(np.abs(sin_half_theta) < 0.001, 0.5 * q0 + 0.5 * q1, new_q)
-    new_q = np.where(np.abs(cos_half_theta) >= 1, q0, new_q)
-
-    return new_q
+def slerp(q0, q1, t):
+    """
+        Spherical linear interpolation of quaternions (see 'rotation.quat_slerp')
+        The blend does not depend on the component order, so both w,x,y,z and x,y,z,w work
+        't' is a scalar or an array of the batch shape (a trailing singleton axis is allowed)
+    """
+    t = np.asarray(t,dtype=np.float64)
+    if (t.ndim > 0) and (t.ndim == np.ndim(q0)) and (t.shape[-1] == 1):
+        t = t[...,0]
+    return rotation.quat_slerp(q0,q1,t)
+
+def resample_motion(p_root_list,quat_root_list,q_list,dt=0.0083,times=None,
+                    HZ_out=None,times_out=None,method='cubic'):
+    """
+        Resample a motion clip (root positions [L x 3], root quaternions [L x 4] (w,x,y,z), joints [L x n])
+        - input samples are at 'times' or every 'dt' seconds
+        - output samples are at 'times_out' or every 1/'HZ_out' seconds over the clip
+        - quaternions are slerped, positions and joints are interpolated with 'linear' or 'cubic' (spline)
+        - segments of all output samples are found at once with 'np.searchsorted'
+        res = resample_motion(p_root_list,quat_root_list,q_list,dt=0.0083,HZ_out=50)
+    """
+    from scipy.interpolate import CubicSpline
+    p_root_list    = np.asarray(p_root_list,dtype=np.float64)
+    quat_root_list = np.asarray(quat_root_list,dtype=np.float64)
+    q_list         = np.asarray(q_list,dtype=np.float64)
+    L = q_list.shape[0]
+    if times is None:
+        times = dt*np.arange(L)
+    times = np.asarray(times,dtype=np.float64)
+    if times_out is None:
+        if HZ_out is None:
+            raise ValueError("[resample_motion] either 'HZ_out' or 'times_out' is required")
+        n_out = int(np.floor((times[-1]-times[0])*HZ_out+1e-6))+1
+        times_out = times[0] + np.arange(n_out)/HZ_out
+    times_out = np.clip(np.asarray(times_out,dtype=np.float64),times[0],times[-1])
+    if L < 2: # nothing to interpolate
+        idxs = np.zeros(len(times_out),dtype=np.int64)
+        return {'times':times_out,'p_root':p_root_list[idxs],'quat_root':quat_root_list[idxs],'q':q_list[idxs]}
+    # Segment of each output sample and its interpolation weight
+    idxs  = np.clip(np.searchsorted(times,times_out,side='right')-1,0,L-2)
+    alpha = (times_out-times[idxs])/(times[idxs+1]-times[idxs])
+    # Quaternions
+    quat_out = rotation.quat_slerp(quat_root_list[idxs],quat_root_list[idxs+1],alpha)
+    # Positions and joints (interpolated together)
+    x = np.concatenate([p_root_list,q_list],axis=1)
+    if method == 'linear':
+        x_out = x[idxs]*(1-alpha)[:,None] + x[idxs+1]*alpha[:,None]
+    elif method == 'cubic':
+        x_out = CubicSpline(times,x,axis=0)(times_out)
+    else:
+        raise ValueError("[resample_motion] unknown method:[%s]"%(method))
+    res = {'times':times_out,'p_root':x_out[:,:3],'quat_root':quat_out,'q':x_out[:,3:]}
+    return res
 
 def block_mtx(M11,M12,M21,M22):
     M_upper = np.concatenate((M11,M12),axis=1)